@@ -0,0 +1,312 @@
+"""
+Offline bulk analysis of a directory of PDFs.
+
+Walks a local directory, loads prompts with load_prompts (txt/json/yaml) and
+runs extraction and AI queries for many documents in parallel, without the
+HTTP server or workspace uploads. Each finished document is appended to a
+JSONL file (or a directory of Parquet parts) and recorded in a checkpoint
+file once it is on disk, so an interrupted backfill resumes where it stopped.
+
+Usage:
+    python -m backend.cli ./pdfs --prompts backend/prompts/prompts.json --output results.jsonl
+    python -m backend.cli ./pdfs --output results.parquet --documents 8 --query-mode batch
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.databricks_ai import DatabricksAI
+from backend.src.analysis_pipeline import DocumentAnalysisPipeline, QUERY_MODES
+from backend.src.http_session import close_http_session
+from backend.src.map_reduce import MapReduceAnalyzer
+from backend.src.statement_waiter import stop_statement_waiters
+from backend.src.warehouse_resolver import stop_warehouse_resolvers
+from backend.src.warehouse_warmer import get_warehouse_warmer, stop_warehouse_warmers
+from backend.utils.async_io import shutdown_io_pool
+from backend.utils.pdf_text_extractor import shutdown_extraction_pool
+from backend.utils.prompt_executor import PromptExecutor
+from backend.utils.prompt_loader import load_prompts
+from backend.utils.request_context import request_scope
+
+logger = logging.getLogger("backend.cli")
+
+DEFAULT_PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', 'prompts.json')
+
+
+def find_pdfs(input_dir: str, recursive: bool = True) -> List[str]:
+    """Return PDF paths under input_dir, relative to it, in a stable order."""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.pdf'):
+                found.append(os.path.relpath(os.path.join(root, name), input_dir))
+        if not recursive:
+            break
+    return found
+
+
+class Checkpoint:
+    """Append-only record of processed documents (one JSON line per document)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        self.failed: Set[str] = set()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partially written last line from an interrupted run
+                        continue
+                    if entry.get('success'):
+                        self.done.add(entry['path'])
+                        self.failed.discard(entry['path'])
+                    else:
+                        self.failed.add(entry['path'])
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def should_skip(self, path: str, retry_failed: bool) -> bool:
+        return path in self.done or (path in self.failed and not retry_failed)
+
+    def record(self, path: str, success: bool, content_hash: Optional[str]):
+        self._file.write(json.dumps({'path': path, 'success': success, 'content_hash': content_hash,
+                                     'timestamp': datetime.now().isoformat()}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    """Appends one JSON document per line, flushed (and checkpointed) after every record."""
+
+    def __init__(self, path: str, checkpoint: Checkpoint):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.checkpoint = checkpoint
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.checkpoint.record(record['path'], record['success'], record['content_hash'])
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Writes records as numbered Parquet part files in a directory (requires pyarrow).
+
+    Records are buffered until a part is written, and only then checkpointed, so
+    documents lost with an unwritten part are analyzed again on resume.
+    """
+
+    def __init__(self, path: str, checkpoint: Checkpoint, rows_per_part: int = 100):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+
+        self.path = path
+        self.checkpoint = checkpoint
+        self.rows_per_part = rows_per_part
+        self._rows: List[Dict[str, Any]] = []
+        os.makedirs(path, exist_ok=True)
+        # Resumed runs add parts after the existing ones
+        self._part = len([name for name in os.listdir(path) if name.endswith('.parquet')])
+
+    def write(self, record: Dict[str, Any]):
+        row = dict(record)
+        # Nested responses are stored as a JSON string column
+        row['responses'] = json.dumps(row.get('responses', []), ensure_ascii=False, default=str)
+        self._rows.append(row)
+        if len(self._rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(self._rows)
+        part_path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        pq.write_table(table, part_path + ".tmp")
+        os.replace(part_path + ".tmp", part_path)
+        self._part += 1
+        for row in self._rows:
+            self.checkpoint.record(row['path'], row['success'], row['content_hash'])
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def build_record(path: str, analysis: Dict[str, Any], elapsed: float) -> Dict[str, Any]:
+    """Flatten a pipeline result into one output record."""
+    record = {
+        'path': path,
+        'name': os.path.basename(path),
+        'success': bool(analysis.get('success')),
+        'error': analysis.get('error'),
+        'stage': analysis.get('stage'),
+        'content_hash': analysis.get('content_hash'),
+        'responses': analysis.get('responses', []),
+        'merged_summary': analysis.get('merged_summary', ''),
+        'query_mode': analysis.get('query_mode'),
+        'extraction_method': analysis.get('extraction_method'),
+        'cached_answers': analysis.get('cached_answers', 0),
+        'processing_time': round(elapsed, 2),
+        'timestamp': datetime.now().isoformat(),
+    }
+    # Prompts that failed are retried on resume, like failed documents
+    if record['success'] and not all(r.get('success') for r in record['responses']):
+        record['success'] = False
+        record['error'] = record['error'] or "One or more prompts failed"
+    return record
+
+
+async def run_bulk(args: argparse.Namespace) -> int:
+    """Analyze every pending PDF; returns the number of failed documents."""
+    host = os.getenv('DATABRICKS_HOST')
+    token = os.getenv('DATABRICKS_TOKEN')
+    if not host or not token:
+        raise RuntimeError("DATABRICKS_HOST and DATABRICKS_TOKEN must be set")
+
+    prompts = [p for p in load_prompts(args.prompts) if p.get('prompt')]
+    if not prompts:
+        raise RuntimeError(f"No prompts found in {args.prompts}")
+
+    paths = find_pdfs(args.input_dir, recursive=not args.no_recursive)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint")
+    pending = [p for p in paths if not checkpoint.should_skip(p, args.retry_failed)]
+    if args.limit:
+        pending = pending[:args.limit]
+
+    logger.info(f"{len(paths)} PDFs found, {len(paths) - len(pending)} already processed, "
+                f"{len(pending)} to analyze with {len(prompts)} prompts")
+
+    if args.output.endswith('.parquet'):
+        writer = ParquetWriter(args.output, checkpoint)
+    else:
+        writer = JsonlWriter(args.output, checkpoint)
+    ai_client = DatabricksAI(host, token)
+    # A cold start overlaps with extracting the first documents
+    get_warehouse_warmer(host, token).request_warm("bulk run")
+    # One prompt pool for every document keeps warehouse slots busy across document boundaries
+    executor = PromptExecutor(args.prompt_concurrency)
+    map_reducer = MapReduceAnalyzer(ai_client) if args.query_mode == "map_reduce" else None
+    documents = asyncio.Semaphore(args.documents)
+    failures = 0
+    completed = 0
+    start_time = time.time()
+
+    async def process(path: str):
+        nonlocal failures, completed
+        async with documents:
+            doc_start = time.time()
+            try:
+                with open(os.path.join(args.input_dir, path), 'rb') as f:
+                    file_content = f.read()
+                pipeline = DocumentAnalysisPipeline(
+                    ai_client=ai_client,
+                    query_mode=args.query_mode,
+                    use_answer_cache=not args.no_answer_cache,
+                    executor=executor,
+                    map_reducer=map_reducer
+                )
+                # Interrupting the run cancels this document's statements on the warehouse
+                async with request_scope(path, timeout=args.deadline):
+                    analysis = await pipeline.run(file_content, path, prompts)
+            except Exception as e:
+                analysis = {'success': False, 'error': str(e)}
+
+            record = build_record(path, analysis, time.time() - doc_start)
+            # The writer checkpoints the document once the record is on disk
+            writer.write(record)
+
+            completed += 1
+            if not record['success']:
+                failures += 1
+                logger.warning(f"[{completed}/{len(pending)}] {path} failed: {record['error']}")
+            else:
+                logger.info(f"[{completed}/{len(pending)}] {path} done in {record['processing_time']}s")
+
+    try:
+        await asyncio.gather(*(process(path) for path in pending))
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    logger.info(f"Analyzed {completed} PDFs in {round(time.time() - start_time, 2)}s, {failures} failed")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Analyze a directory of PDFs with a prompts file.")
+    parser.add_argument('input_dir', help="Directory containing PDF files")
+    parser.add_argument('--prompts', default=DEFAULT_PROMPTS_PATH, help="Prompts file (.txt, .json or .yaml)")
+    parser.add_argument('--output', default='results.jsonl',
+                        help="Output .jsonl file, or .parquet directory (requires pyarrow)")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument('--documents', type=int, default=4, help="Documents processed at the same time")
+    parser.add_argument('--prompt-concurrency', type=int, default=None,
+                        help="Prompts in flight across all documents (default: PROMPT_CONCURRENCY)")
+    parser.add_argument('--query-mode', choices=QUERY_MODES, default=os.getenv('AI_QUERY_MODE', 'per_prompt'))
+    parser.add_argument('--retry-failed', action='store_true', help="Re-run documents that failed previously")
+    parser.add_argument('--no-recursive', action='store_true', help="Only scan the top-level directory")
+    parser.add_argument('--no-answer-cache', action='store_true', help="Do not reuse cached answers")
+    parser.add_argument('--deadline', type=float, default=None,
+                        help="Time budget in seconds for each document (default: none)")
+    parser.add_argument('--limit', type=int, default=None, help="Analyze at most this many pending PDFs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args = parse_args(argv)
+    args.documents = max(1, args.documents)
+
+    try:
+        failures = asyncio.run(run_bulk(args))
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; rerun the same command to resume from the checkpoint")
+        return 130
+    except Exception as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        stop_warehouse_warmers()
+        stop_statement_waiters()
+        stop_warehouse_resolvers()
+        close_http_session()
+        shutdown_io_pool(wait=False)
+        shutdown_extraction_pool(wait=False)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
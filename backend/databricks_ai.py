@@ -1,21 +1,95 @@
 """
 Databricks AI integration for PDF analysis
 """
-import requests
 import base64
+import json
 import logging
 import time
-from typing import Dict, Any, Optional
-from io import BytesIO
-import PyPDF2
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from backend.src.http_session import DatabricksHTTPSession, get_http_session
+from backend.src.statement_waiter import StatementSubmitError, get_statement_waiter, statement_parameter
+from backend.src.warehouse_pool import get_warehouse_pool
+from backend.src.warehouse_resolver import WarehouseResolver, get_warehouse_resolver
+from backend.utils.request_context import current_request, deadline_stage, stage_timeout
+from backend.utils.retry_helper import classify_error, classify_statement_result, error_fields
+from backend.utils.pdf_document import PDFDocument
+from backend.utils.pdf_text_extractor import PDFTextExtractor, format_pages
+from backend.utils.token_budget import PromptAssembler, get_prompt_assembler
 
 logger = logging.getLogger(__name__)
 
+# Shared prompt framing for ai_query, bound as statement parameters
+ANSWER_PROMPT_PREFIX = """You are a helpful AI assistant analyzing a PDF document. 
+                 Based on the following document content, please answer the user question accurately and comprehensively."""
+
+ANSWER_PROMPT_SUFFIX = """Return your output as valid JSON with the following fields:
+{
+  "answer": "<the direct answer to the question>",
+  "explanation": "<a short explanation of how you derived that answer based on the document>"
+}
+
+If the answer cannot be found, return:
+{
+  "answer": "Not found in document",
+  "explanation": "The requested information was not present in the provided text."
+}"""
+
+# Map step of map_reduce mode: one excerpt at a time, with a found flag and confidence
+MAP_PROMPT_PREFIX = """You are a helpful AI assistant analyzing one excerpt of a longer PDF document.
+                 Answer the user question using only this excerpt. Other excerpts are analyzed separately."""
+
+MAP_PROMPT_SUFFIX = """Return your output as valid JSON with the following fields:
+{
+  "answer": "<the direct answer to the question, or Not found in excerpt>",
+  "explanation": "<a short explanation citing where in the excerpt the answer is>",
+  "found": <true if this excerpt answers the question, otherwise false>,
+  "confidence": <a number between 0 and 1>
+}"""
+
+# Reduce step of map_reduce mode: consolidate the partial answers into one
+REDUCE_PROMPT_PREFIX = """You are a helpful AI assistant. A long PDF document was split into excerpts and the
+                 question below was answered against each excerpt separately. Consolidate the partial answers
+                 into a single accurate answer. Prefer specific, well-supported answers and resolve conflicts."""
+
+# Constant statement texts: the prompt framing, document, question and model settings are
+# bound as named parameters, so nothing is escaped or inlined per call and every
+# statement has the same shape. {model_parameters} is filled once per client configuration.
+AI_QUERY_SQL = """SELECT ai_query(
+    :model,
+    CONCAT(:instructions, :document_label, :document, :question_label, :question, :output_format){model_parameters}
+) AS answer"""
+
+# One row per question of the :questions JSON array, all against the same :document
+AI_QUERY_BATCH_SQL = """SELECT q.idx, ai_query(
+    :model,
+    CONCAT(:instructions, :document_label, :document, :question_label, q.question, :output_format){model_parameters}
+) AS answer
+FROM (SELECT posexplode(from_json(:questions, 'array<string>')) AS (idx, question)) q
+ORDER BY q.idx"""
+
 class DatabricksAI:
-    def __init__(self, host: str, token: str):
+    def __init__(self, host: str, token: str, session: Optional[DatabricksHTTPSession] = None,
+                 warehouse_resolver: Optional[WarehouseResolver] = None,
+                 model: str = "databricks-gpt-oss-120b",
+                 max_tokens: Optional[int] = None, temperature: Optional[float] = None):
         self.host = host.rstrip('/')
         self.token = token
+        # Model and optional modelParameters for ai_query (None = endpoint defaults)
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
         self.headers = {"Authorization": f"Bearer {token}"}
+        # Shared keep-alive pool for every REST call made by this client
+        self.session = session or get_http_session()
+        # Shared warehouse choice, so statements don't list warehouses every time
+        self.warehouse_resolver = warehouse_resolver or get_warehouse_resolver(self.host, token)
+        # Spreads statements over DATABRICKS_WAREHOUSE_IDS (or the resolver's one warehouse)
+        self.warehouse_pool = get_warehouse_pool(self.host, token)
+        # One poller tracks every outstanding statement for this workspace
+        self.statement_waiter = get_statement_waiter(self.host, token)
+        # Token budget for document context, sized to the model's context window
+        self.assembler = self.get_assembler()
     
     def download_pdf_from_workspace(self, workspace_path: str) -> Optional[bytes]:
         """Download PDF content from Databricks workspace"""
@@ -26,8 +100,10 @@ class DatabricksAI:
                 "format": "SOURCE"
             }
             
-            response = requests.get(url, headers=self.headers, params=data, timeout=3)
-            response.raise_for_status()
+            with deadline_stage("download"):
+                response = self.session.get(url, headers=self.headers, params=data,
+                                            timeout=stage_timeout("download", 3))
+                response.raise_for_status()
             
             result = response.json()
             if 'content' in result:
@@ -43,32 +119,28 @@ class DatabricksAI:
             logger.error(f"Failed to download PDF from workspace: {str(e)}")
             return None
     
-    def extract_text_from_pdf(self, pdf_content: bytes) -> Dict[str, Any]:
-        """Extract text from PDF content"""
+    def extract_text_from_pdf(self, pdf_content: Union[bytes, PDFDocument],
+                              content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Extract text from PDF content or a parsed PDFDocument (served from the text cache or split across the extraction pool)"""
         result = {
             'success': False,
             'text': '',
             'pages': 0,
+            'page_texts': [],
+            'method': None,
             'error': None
         }
         
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_content))
-            result['pages'] = len(pdf_reader.pages)
-            
-            text_parts = []
-            for i, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        text_parts.append(f"--- Page {i+1} ---\n{page_text}\n")
-                except Exception as e:
-                    logger.warning(f"Failed to extract text from page {i+1}: {str(e)}")
+            extraction = PDFTextExtractor().extract_pages(pdf_content, content_hash=content_hash)
+            result['pages'] = extraction['total_pages']
+            result['method'] = extraction['method']
             
-            if text_parts:
-                result['text'] = '\n'.join(text_parts)
+            if extraction['pages']:
+                result['text'] = format_pages(extraction['pages'])
+                result['page_texts'] = extraction['pages']
                 result['success'] = True
-                logger.info(f"Extracted {len(result['text'])} characters from {result['pages']} pages")
+                logger.info(f"Extracted {len(result['text'])} characters from {result['pages']} pages ({extraction['method']})")
             else:
                 result['error'] = "No text could be extracted from the PDF"
                 logger.warning("No text extracted from PDF")
@@ -79,135 +151,328 @@ class DatabricksAI:
         
         return result
         
-    def _get_warehouse_id(self) -> str:
-        """Return a warehouse ID (default if set, otherwise pick first running one)."""
-        # if self.default_warehouse_id:
-            # return self.default_warehouse_id
-
-        url = f"{self.host}/api/2.0/sql/warehouses"
-        res = requests.get(url, headers=self.headers, timeout=10)
-        res.raise_for_status()
-        warehouses = res.json().get("warehouses", [])
-        if not warehouses:
-            raise RuntimeError("No SQL warehouses available")
-
-        # Pick first running one
-        for w in warehouses:
-            if w.get("state") == "RUNNING":
-                return w["id"]
-
-        # Fallback to first
-        return warehouses[0]["id"]
-    
-    def query_with_databricks_ai(self, text: str, question: str, model: str = "databricks-gpt-oss-120b") -> Dict[str, Any]:
+    def get_assembler(self, model: Optional[str] = None) -> PromptAssembler:
+        """Return the prompt assembler for a model (defaults to self.model)."""
+        return get_prompt_assembler(
+            model or self.model,
+            template_text=ANSWER_PROMPT_PREFIX + ANSWER_PROMPT_SUFFIX,
+            max_output_tokens=self.max_tokens
+        )
+
+    def _truncate_text(self, text: str, question: str = "", model: Optional[str] = None) -> str:
+        """Trim document text to the model's token budget (no-op for already packed context)."""
+        return self.get_assembler(model).fit_text(text, question)
+
+    def _model_parameters(self) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Return the modelParameters argument for ai_query and its statement parameters.
+
+        The SQL is '' when using endpoint defaults; it only changes with the
+        client's configuration, not per call.
+        """
+        names, parameters = [], []
+        if self.max_tokens is not None:
+            names.append("max_tokens")
+            parameters.append(statement_parameter("max_tokens", int(self.max_tokens), "INT"))
+        if self.temperature is not None:
+            names.append("temperature")
+            parameters.append(statement_parameter("temperature", float(self.temperature), "DOUBLE"))
+        if not names:
+            return "", parameters
+        fields = ", ".join(f"'{name}', :{name}" for name in names)
+        return f",\n    modelParameters => named_struct({fields})", parameters
+
+    def _prompt_parameters(self, model: str, instructions: str, document_label: str, document: str,
+                           question_label: str, output_format: str) -> List[Dict[str, Any]]:
+        """Bind the prompt framing and document for AI_QUERY_SQL / AI_QUERY_BATCH_SQL (all but :question(s))."""
+        return [
+            statement_parameter("model", model),
+            statement_parameter("instructions", instructions),
+            statement_parameter("document_label", document_label),
+            statement_parameter("document", document),
+            statement_parameter("question_label", question_label),
+            statement_parameter("output_format", output_format),
+        ]
+
+    def _parse_ai_answer(self, raw_answer: Any) -> Tuple[Any, str]:
+        """Split an ai_query response into (answer, explanation), falling back to plain text."""
+        answer_text = raw_answer
+        explanation = ""
+
+        # Try parsing JSON from the AI response
+        try:
+            parsed = json.loads(raw_answer)
+            answer_text = parsed.get("answer", "")
+            explanation = parsed.get("explanation", "")
+        except Exception:
+            # if not JSON, just return as plain text
+            explanation = ""
+
+        return answer_text, explanation
+
+    def _execute_statement(self, sql_query: str,
+                           parameters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Submit a SQL statement and poll until it reaches a terminal state.
+
+        The warehouse pool picks the warehouse with the shortest expected wait
+        and the statement waits for a slot in that warehouse's process-wide
+        adaptive limiter, so concurrent requests never overload one warehouse,
+        and each outcome feeds the limit and the warehouse's circuit breaker.
+        Queueing, submit and polling all draw on the current request's deadline budget.
+
+        Args:
+            sql_query: Statement text, with :name markers for parameters
+            parameters: Named statement parameters (see statement_parameter)
+
+        Returns:
+            Dict with success flag, 'warehouse_id' and either the data_array rows
+            or an error message with its retry_helper 'error_type'
+        """
+        with deadline_stage("queue"):
+            warehouse_id = self.warehouse_pool.acquire(stage_timeout("queue"))
+        logger.info(f"Using warehouse: {warehouse_id}")
+
+        started_at = time.time()
+        error_type = None
         try:
-            warehouse_id = self._get_warehouse_id()
-            logger.info(f"Using warehouse: {warehouse_id}")
+            result = self._submit_and_poll(sql_query, warehouse_id, parameters)
+            result["warehouse_id"] = warehouse_id
+            if not result.get("success"):
+                typed = classify_statement_result(result, self.warehouse_resolver.get_state(warehouse_id))
+                result.update(error_fields(typed))
+                error_type = typed.kind
+            return result
+        except Exception as e:
+            error_type = classify_error(e).kind
+            raise
+        finally:
+            self.warehouse_pool.release(warehouse_id, error_type, started_at)
+
+    def _submit_and_poll(self, sql_query: str, warehouse_id: str,
+                         parameters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        # The shared waiter uses the server-side wait first, then polls with backoff
+        logger.info("Submitting AI query...")
+        try:
+            with deadline_stage("submit"):
+                future = self.statement_waiter.submit(warehouse_id, sql_query, parameters)
+                # Submit errors and statements that finish within the server-side wait resolve here
+                finished = future.done()
+                if finished:
+                    result = future.result()
+            if not finished:
+                with deadline_stage("poll"):
+                    result = future.result()
+        except StatementSubmitError as e:
+            self.warehouse_resolver.report_error(e.body, e.error_code)
+            raise
+
+        if not result.get("success") and result.get("error_message"):
+            self.warehouse_resolver.report_error(result["error_message"], result.get("error_code"))
+
+        context = current_request()
+        if not result.get("success") and context is not None and context.cancelled:
+            return {**result, "error": f"Request cancelled: {context.reason}"}
+        return result
 
-            # Truncate to avoid token overflow (basic safeguard)
-            max_chars = 15000
-            if len(text) > max_chars:
-                text = text[:max_chars] + "\n\n[Text truncated due to length...]"
+    def query_with_databricks_ai(self, text: str, question: str, model: str = None) -> Dict[str, Any]:
+        model = model or self.model
+        try:
+            text = self._truncate_text(text, question, model)
 
-            # Escape quotes for SQL safety
-            safe_text = text.replace("'", "''")
-            safe_question = question.replace("'", "''")
+            execution = self._run_ai_query(ANSWER_PROMPT_PREFIX, "\n\nDocument Content:\n", text,
+                                           question, "\n\n" + ANSWER_PROMPT_SUFFIX, model)
+            if not execution["success"]:
+                return execution
 
-            sql_query = f"""
-            SELECT ai_query(
-                '{model}',
-                'You are a helpful AI assistant analyzing a PDF document. 
-                 Based on the following document content, please answer the user question accurately and comprehensively.
+            answer_text, explanation = self._parse_ai_answer(execution["raw_answer"])
+            return {
+                "success": True,
+                "question": question,
+                "answer": answer_text,
+                "explanation": explanation,
+            }
 
-Document Content:
-{safe_text}
+        except Exception as e:
+            logger.error(f"Databricks AI query failed: {str(e)}")
+            return {"success": False, "error": str(e), **error_fields(e)}
 
-User Question: {safe_question}
+    def _parse_json_object(self, raw_answer: Any) -> Optional[Dict[str, Any]]:
+        """Parse a JSON object from a model response, tolerating surrounding text or code fences."""
+        if isinstance(raw_answer, dict):
+            return raw_answer
+        if not isinstance(raw_answer, str):
+            return None
+        try:
+            parsed = json.loads(raw_answer)
+            return parsed if isinstance(parsed, dict) else None
+        except Exception:
+            pass
+        start, end = raw_answer.find('{'), raw_answer.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        try:
+            parsed = json.loads(raw_answer[start:end + 1])
+            return parsed if isinstance(parsed, dict) else None
+        except Exception:
+            return None
 
-Return your output as valid JSON with the following fields:
-{{
-  "answer": "<the direct answer to the question>",
-  "explanation": "<a short explanation of how you derived that answer based on the document>"
-}}
+    def _run_ai_query(self, instructions: str, document_label: str, document: str, question: str,
+                      output_format: str, model: str = None) -> Dict[str, Any]:
+        """
+        Run a single ai_query and return the raw answer.
+
+        The prompt is instructions + document_label + document + "User Question: "
+        + question + output_format, concatenated server-side from statement
+        parameters of the constant AI_QUERY_SQL.
+        """
+        model_parameters_sql, model_parameters = self._model_parameters()
+        sql_query = AI_QUERY_SQL.format(model_parameters=model_parameters_sql)
+        parameters = self._prompt_parameters(model or self.model, instructions, document_label, document,
+                                             "\n\nUser Question: ", output_format)
+        parameters += [statement_parameter("question", question)] + model_parameters
+
+        execution = self._execute_statement(sql_query, parameters)
+        if not execution["success"]:
+            return execution
+
+        rows = execution["rows"]
+        if rows and rows[0]:
+            return {"success": True, "raw_answer": rows[0][0]}
+        return {"success": False, "error": "No answer returned from AI"}
+
+    def query_chunk_with_databricks_ai(self, text: str, question: str, model: str = None) -> Dict[str, Any]:
+        """
+        Map step: answer a question against one excerpt of a document.
+
+        Returns:
+            Dict with success flag, 'answer', 'explanation', 'found' and 'confidence' (0-1)
+        """
+        try:
+            execution = self._run_ai_query(MAP_PROMPT_PREFIX, "\n\nDocument Excerpt:\n", text,
+                                           question, "\n\n" + MAP_PROMPT_SUFFIX, model)
+            if not execution["success"]:
+                return execution
+
+            parsed = self._parse_json_object(execution["raw_answer"])
+            if parsed is None:
+                # Unstructured answer: keep it, but never treat it as confident
+                return {"success": True, "answer": execution["raw_answer"], "explanation": "",
+                        "found": True, "confidence": 0.0}
+
+            try:
+                confidence = min(1.0, max(0.0, float(parsed.get("confidence", 0))))
+            except (TypeError, ValueError):
+                confidence = 0.0
+            found = parsed.get("found")
+            if isinstance(found, str):
+                found = found.strip().lower() == "true"
 
-If the answer cannot be found, return:
-{{
-  "answer": "Not found in document",
-  "explanation": "The requested information was not present in the provided text."
-}}'
-) as answer
-            """
-
-            # Submit the SQL statement
-            execute_url = f"{self.host}/api/2.0/sql/statements"
-            payload = {
-                "warehouse_id": warehouse_id,
-                "statement": sql_query,
-                "wait_timeout": "50s"
+            return {
+                "success": True,
+                "answer": parsed.get("answer", ""),
+                "explanation": parsed.get("explanation", ""),
+                "found": bool(found),
+                "confidence": confidence,
             }
 
-            logger.info("Submitting AI query...")
-            res = requests.post(execute_url, headers=self.headers, json=payload, timeout=30)
-            res.raise_for_status()
-            result = res.json()
-
-            statement_id = result.get("statement_id")
-            if not statement_id:
-                return {"success": False, "error": "No statement_id returned from Databricks"}
-
-                        # Poll for completion
-            status_url = f"{self.host}/api/2.0/sql/statements/{statement_id}"
-            for _ in range(60):  # up to ~2 minutes
-                status_res = requests.get(status_url, headers=self.headers, timeout=30)
-                status_res.raise_for_status()
-                status = status_res.json()
-                state = status.get("status", {}).get("state")
-
-                if state == "SUCCEEDED":
-                    # Extract result
-                    data_array = status.get("result", {}).get("data_array", [])
-                    if data_array and data_array[0]:
-                        raw_answer = data_array[0][0]
-                        import json
-
-                        explanation = ""
-                        answer_text = raw_answer
-
-                        # Try parsing JSON from the AI response
-                        try:
-                            parsed = json.loads(raw_answer)
-                            answer_text = parsed.get("answer", "")
-                            explanation = parsed.get("explanation", "")
-                        except Exception:
-                            # if not JSON, just return as plain text
-                            explanation = ""
-
-                        return {
-                            "success": True,
-                            "question": question,
-                            "answer": answer_text,
-                            "explanation": explanation,
-                        }
-
-                    return {"success": False, "error": "No answer returned from AI"}
-
-                elif state in ("FAILED", "CANCELED"):
-                    error_msg = (
-                        status.get("status", {}).get("error", {}).get("message")
-                        or status.get("error", {}).get("message")
-                        or "Unknown error"
-                    )
-                    return {"success": False, "error": f"AI query failed: {error_msg}"}
-
-                time.sleep(2)
-
-
-            return {"success": False, "error": "AI query timeout"}
+        except Exception as e:
+            logger.error(f"Databricks AI chunk query failed: {str(e)}")
+            return {"success": False, "error": str(e), **error_fields(e)}
+
+    def reduce_with_databricks_ai(self, question: str, partial_answers: List[Dict[str, Any]],
+                                  model: str = None) -> Dict[str, Any]:
+        """
+        Reduce step: consolidate per-excerpt answers into one.
+
+        Args:
+            question: The original question
+            partial_answers: Map results with 'answer', 'explanation', 'confidence' and 'pages'
+
+        Returns:
+            Dict with success flag, 'answer' and 'explanation'
+        """
+        try:
+            partials = "\n\n".join(
+                f"Excerpt {i + 1} (pages {', '.join(str(p) for p in partial.get('pages') or [])}, "
+                f"confidence {partial.get('confidence', 0):.2f}):\n"
+                f"Answer: {partial.get('answer', '')}\nExplanation: {partial.get('explanation', '')}"
+                for i, partial in enumerate(partial_answers)
+            )
+            execution = self._run_ai_query(REDUCE_PROMPT_PREFIX, "\n\nPartial Answers:\n", partials,
+                                           question, "\n\n" + ANSWER_PROMPT_SUFFIX, model)
+            if not execution["success"]:
+                return execution
+
+            answer_text, explanation = self._parse_ai_answer(execution["raw_answer"])
+            return {"success": True, "question": question, "answer": answer_text, "explanation": explanation}
 
         except Exception as e:
-            logger.error(f"Databricks AI query failed: {str(e)}")
-            return {"success": False, "error": str(e)}
-        
+            logger.error(f"Databricks AI reduce query failed: {str(e)}")
+            return {"success": False, "error": str(e), **error_fields(e)}
+
+    def query_batch_with_databricks_ai(self, text: str, questions: List[str],
+                                       model: str = None) -> Dict[str, Any]:
+        """
+        Answer every question in a single SQL statement.
+
+        The document is bound once and the questions are bound as one JSON array
+        that the statement explodes into rows, so the warehouse runs one ai_query
+        per row inside one statement.
+
+        Args:
+            text: Extracted document text
+            questions: Questions to answer, in order
+            model: Databricks AI model to use (defaults to self.model)
+
+        Returns:
+            Dict with success flag and 'results', a list of per-question result dicts
+            in the same order as questions
+        """
+        model = model or self.model
+        if not questions:
+            return {"success": True, "results": []}
+
+        try:
+            text = self._truncate_text(text, max(questions, key=len), model)
+
+            model_parameters_sql, model_parameters = self._model_parameters()
+            sql_query = AI_QUERY_BATCH_SQL.format(model_parameters=model_parameters_sql)
+            parameters = self._prompt_parameters(model, ANSWER_PROMPT_PREFIX, "\n\nDocument Content:\n", text,
+                                                 "\n\nUser Question: ", "\n\n" + ANSWER_PROMPT_SUFFIX)
+            parameters += [statement_parameter("questions", json.dumps(questions))] + model_parameters
+
+            execution = self._execute_statement(sql_query, parameters)
+            if not execution["success"]:
+                return execution
+
+            answers_by_index = {}
+            for row in execution["rows"]:
+                if row and len(row) >= 2 and row[0] is not None:
+                    answers_by_index[int(row[0])] = row[1]
+
+            results = []
+            for i, question in enumerate(questions):
+                raw_answer = answers_by_index.get(i)
+                if raw_answer is None:
+                    results.append({"success": False, "question": question,
+                                    "error": "No answer returned from AI"})
+                    continue
+
+                answer_text, explanation = self._parse_ai_answer(raw_answer)
+                results.append({
+                    "success": True,
+                    "question": question,
+                    "answer": answer_text,
+                    "explanation": explanation,
+                })
+
+            return {"success": True, "results": results}
+
+        except Exception as e:
+            logger.error(f"Databricks AI batch query failed: {str(e)}")
+            return {"success": False, "error": str(e), **error_fields(e)}
+
     def analyze_pdf(self, workspace_path: str, question: str) -> Dict[str, Any]:
         """Complete PDF analysis workflow (downloads and extracts each time - use analyze_with_cached_text for efficiency)"""
         start_time = time.time()
@@ -300,3 +565,39 @@ If the answer cannot be found, return:
                 'error': str(e),
                 'timing': timing_info
             }
+
+    def analyze_batch_with_cached_text(self, extracted_text: str, questions: List[str],
+                                       download_time: float = 0.0, extraction_time: float = 0.0,
+                                       pages_analyzed: int = 0, text_length: int = 0,
+                                       workspace_path: str = "") -> Dict[str, Any]:
+        """
+        Batched counterpart of analyze_with_cached_text: one statement for all questions.
+
+        The statement time is shared by every question, so each result reports the
+        batch duration as its ai_query_time and carries 'batched': True in timing.
+
+        Returns:
+            Dict with success flag and 'results' in the same order as questions
+        """
+        ai_start = time.time()
+        batch_result = self.query_batch_with_databricks_ai(extracted_text, questions)
+        ai_query_time = round(time.time() - ai_start, 2)
+
+        if not batch_result.get('success'):
+            batch_result['ai_query_time'] = ai_query_time
+            return batch_result
+
+        for ai_result in batch_result['results']:
+            ai_result['pdf_path'] = workspace_path
+            ai_result['pages_analyzed'] = pages_analyzed
+            ai_result['text_length'] = text_length
+            ai_result['timing'] = {
+                'download_time': download_time,
+                'extraction_time': extraction_time,
+                'ai_query_time': ai_query_time,
+                'total_time': round(download_time + extraction_time + ai_query_time, 2),
+                'batched': True
+            }
+
+        batch_result['ai_query_time'] = ai_query_time
+        return batch_result
@@ -5,12 +5,16 @@ Replaces Streamlit with REST API endpoints
 import os
 import sys
 import logging
-from typing import Optional
+import asyncio
+from typing import List, Optional
 from datetime import datetime
 import time
 import json
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends,Form
+from contextlib import asynccontextmanager
+from collections import Counter
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends,Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import uvicorn
 from dotenv import load_dotenv
 # Add parent directory to path for imports
@@ -19,8 +23,25 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from backend.src.databricks_api import DatabricksAPIIntegration
 from backend.src.pdf_manager import PDFManager
 from backend.src.databricks_ai_engine import DatabricksAIEngine
+from backend.src.audit_notebooks import audit_notebook_metrics, stop_audit_notebook_writers
+from backend.src.http_session import get_http_session, close_http_session
+from backend.src.warehouse_resolver import stop_warehouse_resolvers
+from backend.src.warehouse_limiter import warehouse_limiter_metrics
+from backend.src.warehouse_warmer import stop_warehouse_warmers
+from backend.src.statement_waiter import stop_statement_waiters
+from backend.src.analysis_pipeline import DocumentAnalysisPipeline, QUERY_MODES
+from backend.src.map_reduce import MapReduceAnalyzer
+from backend.src.job_manager import get_job_manager
 from backend.utils.prompt_loader import load_prompts
-from backend.utils.retry_helper import analyze_with_cached_text_retries, normalize_answer
+from backend.utils.prompt_executor import PromptExecutor
+from backend.utils.async_io import run_blocking, get_io_pool, shutdown_io_pool
+from backend.utils.pdf_text_extractor import shutdown_extraction_pool
+from backend.utils.text_cache import get_text_cache
+from backend.utils.answer_cache import get_answer_cache
+from backend.utils.retry_helper import retry_metrics
+from backend.utils.request_context import (
+    current_deadline, deadline_stage, get_request_timeout, request_context_metrics, request_scope, stage_timeout
+)
 
 # Load environment variables
 load_dotenv()
@@ -29,8 +50,25 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared I/O resources on startup and release them on shutdown."""
+    get_io_pool()
+    get_http_session()
+    yield
+    await get_job_manager().shutdown()
+    # Pending audit notebooks are written before the HTTP session closes
+    stop_audit_notebook_writers()
+    stop_warehouse_warmers()
+    stop_statement_waiters()
+    stop_warehouse_resolvers()
+    close_http_session()
+    shutdown_io_pool(wait=False)
+    shutdown_extraction_pool(wait=False)
+
 # Initialize FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="Databricks PDF Processing API",
     description="REST API for PDF upload, processing, and AI-powered querying using Databricks",
     version="1.0.0",
@@ -81,8 +119,8 @@ async def setup_system():
 
     try:
         # Step 1: Connect to Databricks
-        databricks_api = DatabricksAPIIntegration(DATABRICKS_HOST, DATABRICKS_TOKEN)
-        connection_result = databricks_api.test_connection()
+        databricks_api = await run_blocking(DatabricksAPIIntegration, DATABRICKS_HOST, DATABRICKS_TOKEN)
+        connection_result = await run_blocking(databricks_api.test_connection)
 
         if not connection_result["success"]:
             return {
@@ -91,12 +129,17 @@ async def setup_system():
                 "error": connection_result.get("error"),
             }
 
+        # Start a stopped warehouse now so the first query doesn't wait for it
+        warmer = databricks_api.client.warehouse_warmer
+        warmer.request_warm("setup")
+        warmer.start_keepalive()
+
         # Step 2: Initialize PDF Manager
         pdf_manager = PDFManager(databricks_api.client)
 
         # Step 3: Get workspace info (clusters etc.)
         try:
-            clusters = databricks_api.get_cluster_info()
+            clusters = await run_blocking(databricks_api.get_cluster_info)
         except Exception as e:
             clusters = f"Failed to fetch clusters: {str(e)}"
 
@@ -124,6 +167,7 @@ async def setup_system():
                 "clusters": clusters,
             },
             "ai": ai_config_result,
+            "warehouse": warmer.status(),
             "timestamp": datetime.now().isoformat(),
         }
 
@@ -131,13 +175,45 @@ async def setup_system():
         logger.error(f"Setup failed: {str(e)}")
         return {"success": False, "error": str(e)}
 
+@app.get("/api/databricks/warehouse/status")
+async def get_warehouse_status(db: DatabricksAPIIntegration = Depends(get_databricks_connection)):
+    """Warm/cold state of the SQL warehouse, so the frontend can warn about a cold start."""
+    return {"success": True, "warehouse": db.client.warehouse_warmer.status()}
+
+@app.post("/api/databricks/warehouse/warm")
+async def warm_warehouse(db: DatabricksAPIIntegration = Depends(get_databricks_connection)):
+    """Start the SQL warehouse in the background (e.g. when the user opens the upload form)."""
+    return {"success": True, "warehouse": db.client.warehouse_warmer.request_warm("frontend")}
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Runtime metrics used to size shared resources."""
+    return {
+        "http_pool": get_http_session().metrics(),
+        "warehouse": databricks_api.client.warehouse_resolver.metrics() if databricks_api else None,
+        "text_cache": get_text_cache().stats() if get_text_cache() else None,
+        "answer_cache": get_answer_cache().stats() if get_answer_cache() else None,
+        "warehouse_limits": warehouse_limiter_metrics(),
+        "warehouse_pool": databricks_api.client.warehouse_pool.metrics() if databricks_api else None,
+        "audit_notebooks": audit_notebook_metrics(),
+        "warehouse_warmer": databricks_api.client.warehouse_warmer.status() if databricks_api else None,
+        "cancellation": request_context_metrics(),
+        "retries": retry_metrics(),
+        "statements": databricks_api.client.statement_waiter.metrics() if databricks_api else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
 async def upload_pdf_direct_method(file_content: bytes, filename: str, db: DatabricksAPIIntegration) -> bool:
     """
     Upload PDF using the proven method from single-page-app (demo-try2.py)
+    without blocking the event loop.
     """
+    return await run_blocking(_upload_pdf_direct, file_content, filename, db)
+
+def _upload_pdf_direct(file_content: bytes, filename: str, db: DatabricksAPIIntegration) -> bool:
+    """Blocking workspace import used by upload_pdf_direct_method."""
     try:
         import base64
-        import requests
 
         # Get Databricks credentials
         host = db.client.host.rstrip('/')
@@ -159,8 +235,9 @@ async def upload_pdf_direct_method(file_content: bytes, filename: str, db: Datab
         }
 
         # Make the API call
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
+        with deadline_stage("upload"):
+            response = get_http_session().post(url, headers=headers, json=data, timeout=stage_timeout("upload"))
+            response.raise_for_status()
 
         logger.info(f"Direct upload successful for {filename} ✅")
         return True
@@ -169,143 +246,307 @@ async def upload_pdf_direct_method(file_content: bytes, filename: str, db: Datab
         logger.error(f"Direct upload failed for {filename}: {str(e)}")
         return False
 
-@app.post("/api/pdf/upload-and-analyze")
-async def upload_and_analyze_pdf(
-    file: UploadFile = File(...),  
-    prompts_json: str = Form(...),
-    db: DatabricksAPIIntegration = Depends(get_databricks_connection)
-):
-    """Upload a PDF and immediately analyze it with hardcoded prompts."""
-    try:
-        # Validate file type
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+def _parse_analysis_request(file: UploadFile, prompts_json: str, query_mode: Optional[str]):
+    """Validate the upload form shared by the blocking and job endpoints."""
+    # Validate file type
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
-        # Read file content
-        file_content = await file.read()
+    return _parse_prompts(prompts_json, query_mode)
 
-        # Upload to Databricks Workspace
-        success = await upload_pdf_direct_method(
-            file_content=file_content,
-            filename=file.filename,
-            db=db
-        )
+def _parse_prompts(prompts_json: str, query_mode: Optional[str]):
+    """Validate the prompt list and query mode of an analysis request."""
+    try:
+        prompts = json.loads(prompts_json)
+        if not isinstance(prompts, list):
+            raise ValueError("Prompts must be a list of {title, prompt} objects")
+        logger.info(f"Received {len(prompts)} prompts from frontend")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid prompts: {str(e)}")
 
-        if not success:
-            raise HTTPException(status_code=500, detail="PDF upload failed")
+    query_mode = (query_mode or os.getenv("AI_QUERY_MODE", "per_prompt")).lower()
+    if query_mode not in QUERY_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid query_mode: {query_mode}. Expected one of {QUERY_MODES}")
 
-        # Construct path used for analysis
-        pdf_path = f"/Workspace/Shared/pdf_uploads/{file.filename}"
+    return prompts, query_mode
 
+def _ai_client(db: DatabricksAPIIntegration):
+    """Build an AI client sharing the integration's HTTP session and warehouse resolver."""
+    # Import AI client
+    from backend.databricks_ai import DatabricksAI
 
-        # Import AI client
-        from backend.databricks_ai import DatabricksAI
+    return DatabricksAI(
+        db.client.host.rstrip('/'), db.client.token,
+        session=get_http_session(),
+        warehouse_resolver=db.client.warehouse_resolver
+    )
 
-        host = db.client.host.rstrip('/')
-        token = db.client.token
-        ai_client = DatabricksAI(host, token)
+async def _run_analysis(db: DatabricksAPIIntegration, file_content: bytes, filename: str,
+                        prompts: list, max_concurrency: Optional[int], query_mode: str,
+                        use_answer_cache: bool, on_result=None,
+                        executor: Optional[PromptExecutor] = None,
+                        map_reducer: Optional[MapReduceAnalyzer] = None) -> dict:
+    """Run the analysis pipeline for one uploaded PDF and shape the response body."""
+    # Construct path used for analysis
+    pdf_path = f"/Workspace/Shared/pdf_uploads/{filename}"
+
+    pipeline = DocumentAnalysisPipeline(
+        ai_client=map_reducer.ai_client if map_reducer is not None else _ai_client(db),
+        pdf_manager=pdf_manager,
+        max_concurrency=max_concurrency,
+        query_mode=query_mode,
+        use_answer_cache=use_answer_cache,
+        executor=executor,
+        map_reducer=map_reducer
+    )
 
-        # Download and extract PDF content once, then cache it
-        # Step 1: Download PDF content (once)
-        download_start = time.time()
-        pdf_content = pdf_manager.get_pdf_content(pdf_path, use_cache=True)
-        download_time = round(time.time() - download_start, 2)
+    # Upload to Databricks Workspace in parallel with the analysis
+    analysis = await pipeline.run(
+        file_content=file_content,
+        pdf_path=pdf_path,
+        prompts=prompts,
+        upload=lambda: upload_pdf_direct_method(
+            file_content=file_content,
+            filename=filename,
+            db=db
+        ),
+        on_result=on_result
+    )
 
-        if not pdf_content:
-            raise HTTPException(status_code=500, detail="Failed to download PDF content")
+    deadline = current_deadline()
+    if not analysis.get("success"):
+        logger.error(f"Pipeline stage '{analysis.get('stage')}' failed: {analysis.get('error')}")
+        return {"success": False, "stage": analysis.get("stage"), "error": analysis.get("error"),
+                "deadline": deadline.to_dict() if deadline else None}
 
-        # Step 2: Extract text from PDF (once)
-        extraction_start = time.time()
-        extraction_result = ai_client.extract_text_from_pdf(pdf_content)
-        extraction_time = round(time.time() - extraction_start, 2)
+    return {
+        "success": True,
+        "analysis": {
+            "responses": analysis["responses"],
+            "merged_summary": analysis["merged_summary"],
+            "total_processing_time": analysis["total_processing_time"],
+            "prompts_wall_time": analysis["prompts_wall_time"],
+            "max_concurrency": analysis["max_concurrency"],
+            "query_mode": analysis["query_mode"],
+            "extraction_method": analysis["extraction_method"],
+            "context_strategy": analysis["context_strategy"],
+            "context_budget": analysis["context_budget"],
+            "cached_answers": analysis["cached_answers"],
+            "pipeline": analysis["pipeline"],
+            "deadline": deadline.to_dict() if deadline else None,
+        },
+        "name": filename,
+        "content_hash": analysis["content_hash"],
+        "timestamp": datetime.now().isoformat()
+    }
 
-        if not extraction_result['success']:
-            raise HTTPException(status_code=500, detail=f"Text extraction failed: {extraction_result.get('error', 'Unknown error')}")
+@app.post("/api/pdf/upload-and-analyze")
+async def upload_and_analyze_pdf(
+    request: Request,
+    file: UploadFile = File(...),  
+    prompts_json: str = Form(...),
+    max_concurrency: Optional[int] = Form(None),
+    query_mode: Optional[str] = Form(None),
+    use_answer_cache: bool = Form(True),
+    db: DatabricksAPIIntegration = Depends(get_databricks_connection)
+):
+    """Upload a PDF and analyze it with the given prompts.
 
-        extracted_text = extraction_result['text']
-        pages_analyzed = extraction_result['pages']
-        text_length = len(extracted_text)
+    Extraction and AI querying start from the uploaded bytes while the
+    workspace upload runs in parallel. For long prompt lists prefer
+    /api/jobs/upload-and-analyze, which returns immediately.
 
-        logger.info(f"PDF processed once: {download_time}s download, {extraction_time}s extraction, {pages_analyzed} pages, {text_length} characters")
+    Every stage draws on one REQUEST_TIMEOUT_SECONDS deadline budget;
+    analysis.deadline reports the stage that ran out of it, if any. Statements
+    still running when the client disconnects or the budget runs out are
+    cancelled on the warehouse.
+    """
+    try:
+        prompts, query_mode = _parse_analysis_request(file, prompts_json, query_mode)
+        # Any cold start overlaps with reading, uploading and extracting the file
+        db.client.warehouse_warmer.request_warm("upload")
 
-        try:
-            prompts = json.loads(prompts_json)
-            if not isinstance(prompts, list):
-                raise ValueError("Prompts must be a list of {title, prompt} objects")
-            logger.info(f"Received {len(prompts)} prompts from frontend")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid prompts: {str(e)}")
-
-        # Step 3: Process each prompt with the cached text (with retry logic)
-        responses = []
-        MAX_RETRIES = 2
-        BASE_DELAY = 5
-        for prompt in prompts:
-            question_text = prompt.get("prompt", "")
-            title_text = prompt.get("title", "")
-
-            # Use the retry helper with cached text approach
-            result = analyze_with_cached_text_retries(
-                ai_client=ai_client,
-                extracted_text=extracted_text,
-                question=question_text,
-                download_time=download_time,
-                extraction_time=extraction_time,
-                pages_analyzed=pages_analyzed,
-                text_length=text_length,
-                workspace_path=pdf_path,
-                max_retries=MAX_RETRIES,
-                base_delay=BASE_DELAY
-            )
-
-            # result should be a dict consistent with your existing expectations
-            # if something unexpected happened above, make a safe fallback
-            if not isinstance(result, dict):
-                result = {"success": False, "error": f"Unexpected non-dict result: {result}", "timing": {}}
-
-            responses.append({
-                "prompt": question_text,
-                "title": title_text,
-                "answer": result.get("answer", ""),
-                "explanation": result.get("explanation", ""),
-                "success": result.get("success", False),
-                "error": result.get("error"),
-                "timing": result.get("timing", {})
-            })
-        
-        for r in responses:
-            if isinstance(r.get("answer"), (list, dict)):
-                logger.warning(f"Answer for '{r.get('prompt')}' returned a {type(r.get('answer')).__name__}")
-
-        merged_summary = " ".join(
-            [
-                normalize_answer(r.get("answer"))
-                for r in responses
-                if r.get("success")
-            ]
-        )
-        
-        # Calculate total processing time across all prompts
-        total_processing_time = sum([
-            r.get("timing", {}).get("total_time", 0) for r in responses
-        ])
-        total_processing_time = round(total_processing_time, 2)
+        # Read file content
+        file_content = await file.read()
+
+        async with request_scope(file.filename, request, get_request_timeout()) as context:
+            result = await _run_analysis(db, file_content, file.filename, prompts,
+                                         max_concurrency, query_mode, use_answer_cache)
+        if not result["success"]:
+            deadline = context.deadline
+            if deadline is not None and deadline.exhausted_stage:
+                detail = result["error"]
+                if "exhausted during" not in detail:
+                    detail += f" (deadline of {deadline.budget:g}s exhausted during {deadline.exhausted_stage})"
+                raise HTTPException(status_code=504, detail=detail)
+            raise HTTPException(status_code=500, detail=result["error"])
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload + Analyze failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/pdf/batch-analyze")
+async def batch_analyze_pdfs(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    prompts_json: str = Form(...),
+    max_concurrency: Optional[int] = Form(None),
+    query_mode: Optional[str] = Form(None),
+    use_answer_cache: bool = Form(True),
+    db: DatabricksAPIIntegration = Depends(get_databricks_connection)
+):
+    """Analyze several PDFs with one prompt set.
+
+    Every (file x prompt) work item is scheduled on one bounded pool
+    (max_concurrency, default BATCH_CONCURRENCY), so a file's prompts start as
+    soon as its text is extracted and warehouse slots don't idle between
+    files. In batch and map_reduce modes the batch statements and map-reduce
+    prompts draw from the same pool, and every file's chunk statements share
+    one MAP_REDUCE_CONCURRENCY bound. Statements are additionally capped per
+    warehouse, and statement
+    work never takes the DATABRICKS_IO_RESERVED_THREADS I/O threads kept for
+    uploads and extraction. File names must be unique within a batch.
+    """
+    try:
+        prompts, query_mode = _parse_prompts(prompts_json, query_mode)
+
+        max_files = int(os.getenv("BATCH_MAX_FILES", 50))
+        if len(files) > max_files:
+            raise HTTPException(status_code=400, detail=f"Too many files: {len(files)} (max {max_files})")
+        invalid = [f.filename for f in files if not f.filename.lower().endswith('.pdf')]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Only PDF files are allowed: {', '.join(invalid)}")
+        # Files are uploaded to (and cached under) a path derived from their name
+        duplicates = sorted(name for name, count in Counter(f.filename for f in files).items() if count > 1)
+        if duplicates:
+            raise HTTPException(status_code=400, detail=f"Duplicate file names in batch: {', '.join(duplicates)}")
+
+        db.client.warehouse_warmer.request_warm("batch upload")
+        contents = [await f.read() for f in files]
+        executor = PromptExecutor(max_concurrency or int(os.getenv("BATCH_CONCURRENCY", 16)))
+        # Chunk statements of every file share one bound, like prompts share the executor
+        map_reducer = MapReduceAnalyzer(_ai_client(db)) if query_mode == "map_reduce" else None
+        logger.info(f"Batch of {len(files)} files x {len(prompts)} prompts, concurrency {executor.max_concurrency}")
+
+        batch_start = time.time()
+        async with request_scope(f"batch of {len(files)} files", request, get_request_timeout()) as context:
+            outcomes = await asyncio.gather(*(
+                _run_analysis(db, content, f.filename, prompts, None, query_mode, use_answer_cache,
+                              executor=executor, map_reducer=map_reducer)
+                for f, content in zip(files, contents)
+            ), return_exceptions=True)
+        wall_time = round(time.time() - batch_start, 2)
+
+        results = []
+        for f, outcome in zip(files, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Batch analysis failed for {f.filename}: {str(outcome)}")
+                outcome = {"success": False, "error": str(outcome)}
+            results.append({"name": f.filename, **outcome})
+
+        succeeded = [r for r in results if r.get("success")]
+        prompt_responses = [resp for r in succeeded for resp in r["analysis"]["responses"]]
         return {
             "success": True,
-            "analysis": {
-                "responses": responses,
-                "merged_summary": merged_summary,
-                "total_processing_time": total_processing_time,
+            "summary": {
+                "files_total": len(files),
+                "files_succeeded": len(succeeded),
+                "files_failed": len(files) - len(succeeded),
+                "prompts_total": len(files) * len(prompts),
+                "prompts_succeeded": sum(1 for resp in prompt_responses if resp.get("success")),
+                "cached_answers": sum(r["analysis"]["cached_answers"] for r in succeeded),
+                "max_concurrency": executor.max_concurrency,
+                "query_mode": query_mode,
+                "wall_time": wall_time,
+                "cancelled": context.reason,
+                "deadline": context.deadline.to_dict() if context.deadline else None,
+                "sequential_time": round(sum(r["analysis"]["pipeline"]["wall_time"] for r in succeeded), 2),
             },
-            "name": file.filename,
+            "results": results,
             "timestamp": datetime.now().isoformat()
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Upload + Analyze failed: {str(e)}")
+        logger.error(f"Batch analyze failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/jobs/upload-and-analyze")
+async def start_analysis_job(
+    file: UploadFile = File(...),
+    prompts_json: str = Form(...),
+    max_concurrency: Optional[int] = Form(None),
+    query_mode: Optional[str] = Form(None),
+    use_answer_cache: bool = Form(True),
+    db: DatabricksAPIIntegration = Depends(get_databricks_connection)
+):
+    """Start a background analysis and return its job ID immediately.
+
+    Follow progress with GET /api/jobs/{job_id} (partial responses) or
+    GET /api/jobs/{job_id}/stream (NDJSON events as each prompt completes).
+    """
+    prompts, query_mode = _parse_analysis_request(file, prompts_json, query_mode)
+    db.client.warehouse_warmer.request_warm("job upload")
+    file_content = await file.read()
+    filename = file.filename
+
+    async def runner(job):
+        # Jobs outlive the HTTP request, so only cancelling the job stops its statements
+        async with request_scope(f"job {job.id}"):
+            return await _run_analysis(db, file_content, filename, prompts, max_concurrency,
+                                       query_mode, use_answer_cache, on_result=job.record_response)
+
+    job = get_job_manager().start(filename, prompts, query_mode, runner)
+    return {
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "total_prompts": len(prompts),
+        "status_url": f"/api/jobs/{job.id}",
+        "stream_url": f"/api/jobs/{job.id}/stream"
+    }
+
+@app.get("/api/jobs")
+async def list_analysis_jobs():
+    """List known analysis jobs without their responses."""
+    return {"success": True, "jobs": get_job_manager().list_jobs()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """Return a job's status, the responses completed so far and, once done, the full result."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return {"success": True, **job.to_dict()}
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_analysis_job(job_id: str):
+    """Cancel a running job; its statements still in flight are cancelled on the warehouse."""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    await manager.cancel(job)
+    return {"success": True, "job_id": job.id, "status": job.status}
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_analysis_job(job_id: str):
+    """Stream a job's events as NDJSON: status changes, one line per prompt result, then the result."""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return StreamingResponse(
+        manager.stream(job),
+        media_type="application/x-ndjson",
+        # Stop reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     # Run the server
     uvicorn.run(
@@ -0,0 +1,428 @@
+"""
+Staged document analysis pipeline.
+
+Text extraction and AI querying only need the uploaded bytes, so they start as
+soon as the bytes arrive. The workspace upload runs alongside them as a side
+effect, and the result reports how long each stage took and how much the stages
+overlapped. Stages run against the request's deadline budget, if it has one.
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from backend.src.map_reduce import MapReduceAnalyzer
+from backend.utils.answer_cache import get_answer_cache, make_answer_key
+from backend.utils.async_io import run_blocking, run_blocking_statement
+from backend.utils.deadline import Deadline, DeadlineExceeded
+from backend.utils.page_retriever import get_context_strategy, get_page_index
+from backend.utils.pdf_document import PDFDocument
+from backend.utils.pdf_processor import compute_content_hash
+from backend.utils.prompt_executor import PromptExecutor
+from backend.utils.request_context import (RequestContext, current_deadline, current_request, deadline_stage,
+                                           stage_timeout, use_request)
+from backend.utils.retry_helper import analyze_with_cached_text_retries, normalize_answer
+
+logger = logging.getLogger(__name__)
+
+# Supported ways of sending prompts to the warehouse
+QUERY_MODES = ("per_prompt", "batch", "map_reduce")
+
+
+class StageTimer:
+    """Records start/end offsets of named pipeline stages relative to a common origin."""
+
+    def __init__(self, deadline: Optional[Deadline] = None):
+        self.origin = time.time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        # Running stages are reported if the request's deadline runs out during them
+        self.deadline = deadline
+
+    def start(self, name: str):
+        self.stages[name] = {'start': round(time.time() - self.origin, 2)}
+        if self.deadline is not None:
+            self.deadline.enter(name)
+
+    def end(self, name: str):
+        stage = self.stages.setdefault(name, {'start': 0.0})
+        if self.deadline is not None and 'end' not in stage:
+            self.deadline.leave(name)
+        stage['end'] = round(time.time() - self.origin, 2)
+        stage['duration'] = round(stage['end'] - stage['start'], 2)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return per-stage timings plus overall overlap.
+
+        'sequential_time' is what the stages would have cost back to back and
+        'overlap_saved' is how much of that the pipeline hid by running them together.
+        """
+        wall_time = round(time.time() - self.origin, 2)
+        sequential_time = round(sum(s.get('duration', 0.0) for s in self.stages.values()), 2)
+        return {
+            'stages': self.stages,
+            'wall_time': wall_time,
+            'sequential_time': sequential_time,
+            'overlap_saved': round(max(0.0, sequential_time - wall_time), 2),
+        }
+
+
+def build_prompt_response(prompt: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape an AI result into the response entry the frontend expects."""
+    return {
+        "prompt": prompt.get("prompt", ""),
+        "title": prompt.get("title", ""),
+        "answer": result.get("answer", ""),
+        "explanation": result.get("explanation", ""),
+        "success": result.get("success", False),
+        "error": result.get("error"),
+        "timing": result.get("timing", {}),
+        "context_pages": result.get("context_pages")
+    }
+
+
+class DocumentAnalysisPipeline:
+    """Runs upload, extraction and AI querying for one document as overlapping stages."""
+
+    def __init__(self, ai_client, pdf_manager=None, max_concurrency: Optional[int] = None,
+                 query_mode: str = "per_prompt", max_retries: int = 2, base_delay: int = 5,
+                 use_answer_cache: bool = True, executor: Optional[PromptExecutor] = None,
+                 map_reducer: Optional[MapReduceAnalyzer] = None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            ai_client: DatabricksAI instance used for extraction and queries
+            pdf_manager: Optional PDFManager whose content cache is seeded with the upload
+            max_concurrency: Maximum prompts in flight (defaults to PROMPT_CONCURRENCY)
+            query_mode: 'per_prompt', 'batch' or 'map_reduce'
+            max_retries: Attempts per prompt for transient failures
+            base_delay: Base retry delay in seconds
+            use_answer_cache: Serve and store answers in the shared answer cache
+            executor: Optional PromptExecutor shared with other pipelines, so prompts
+                of several documents draw from one bounded pool (overrides max_concurrency)
+            map_reducer: Optional MapReduceAnalyzer shared with other pipelines, so chunk
+                statements of several documents draw from one bounded pool
+        """
+        if query_mode not in QUERY_MODES:
+            raise ValueError(f"Invalid query_mode: {query_mode}. Expected one of {QUERY_MODES}")
+
+        self.ai_client = ai_client
+        self.pdf_manager = pdf_manager
+        self.executor = executor or PromptExecutor(max_concurrency)
+        self.query_mode = query_mode
+        self.map_reducer = map_reducer
+        if query_mode == "map_reduce" and map_reducer is None:
+            self.map_reducer = MapReduceAnalyzer(ai_client)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.answer_cache = get_answer_cache() if use_answer_cache else None
+
+    async def run(self, file_content: bytes, pdf_path: str, prompts: List[Dict[str, Any]],
+                  upload: Optional[Callable[[], Awaitable[bool]]] = None,
+                  on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Analyze a document with a prompt list.
+
+        Args:
+            file_content: PDF bytes
+            pdf_path: Workspace path the document is (being) uploaded to
+            prompts: List of {title, prompt} dicts
+            upload: Optional coroutine factory performing the workspace upload
+            on_result: Optional callback(prompt_index, response) invoked on the event
+                loop as each prompt's response becomes available
+
+        Returns:
+            Dict with success flag and either the analysis or the failing 'stage' and 'error'
+        """
+        timer = StageTimer(current_deadline())
+
+        upload_task = None
+        if upload is not None:
+            timer.start('upload')
+            upload_task = asyncio.create_task(self._timed_upload(upload, timer))
+
+        # The analysis runs in a child of the request so it can be cancelled on its own
+        analysis_context = RequestContext(f"analysis of {pdf_path}", parent=current_request())
+        analysis_task = asyncio.create_task(self._run_in_context(
+            analysis_context, self._analyze(file_content, pdf_path, prompts, timer, on_result)))
+
+        # Stop spending warehouse time as soon as the upload is known to have failed
+        pending = {analysis_task} | ({upload_task} if upload_task else set())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if upload_task in done and not upload_task.result() and not analysis_task.done():
+                # Prompts already running in worker threads see the cancellation: retries
+                # and unsubmitted prompts stop, and statements in flight are cancelled
+                analysis_context.cancel("PDF upload failed")
+                analysis_task.cancel()
+                try:
+                    await analysis_task
+                except asyncio.CancelledError:
+                    pass
+                break
+
+        if upload_task is not None and not upload_task.result():
+            return {'success': False, 'stage': 'upload', 'error': 'PDF upload failed',
+                    'pipeline': timer.summary()}
+
+        analysis = analysis_task.result()
+        analysis['pipeline'] = timer.summary()
+        return analysis
+
+    @staticmethod
+    async def _run_in_context(context: RequestContext, analysis: Awaitable[Dict[str, Any]]) -> Dict[str, Any]:
+        with use_request(context):
+            return await analysis
+
+    @staticmethod
+    async def _timed_upload(upload: Callable[[], Awaitable[bool]], timer: StageTimer) -> bool:
+        try:
+            return await upload()
+        finally:
+            timer.end('upload')
+
+    async def _analyze(self, file_content: bytes, pdf_path: str, prompts: List[Dict[str, Any]],
+                       timer: StageTimer,
+                       on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        # Make the bytes available locally (write-through cache, no workspace export)
+        local_start = time.time()
+        if self.pdf_manager is not None:
+            content_hash = await run_blocking(self.pdf_manager.cache_pdf_content, pdf_path, file_content)
+        else:
+            content_hash = await run_blocking(compute_content_hash, file_content)
+        download_time = round(time.time() - local_start, 2)
+        # Parsed lazily, and only if the text cache misses
+        document = PDFDocument(file_content, content_hash)
+
+        # Extract text once, straight from the uploaded bytes (or the on-disk text cache)
+        timer.start('extraction')
+        try:
+            with deadline_stage('extraction'):
+                extraction_result = await asyncio.wait_for(
+                    run_blocking(self.ai_client.extract_text_from_pdf, document),
+                    timeout=stage_timeout('extraction')
+                )
+        except DeadlineExceeded as e:
+            return {'success': False, 'stage': 'extraction', 'error': str(e)}
+        except asyncio.TimeoutError:
+            # The stage timeout is the rest of the request's budget, so the budget ran out here
+            deadline = current_deadline()
+            error = str(deadline.exhaust('extraction')) if deadline is not None else "Text extraction timed out"
+            return {'success': False, 'stage': 'extraction', 'error': error}
+        finally:
+            timer.end('extraction')
+        extraction_time = timer.stages['extraction']['duration']
+
+        if not extraction_result['success']:
+            return {'success': False, 'stage': 'extraction',
+                    'error': f"Text extraction failed: {extraction_result.get('error', 'Unknown error')}"}
+
+        extracted_text = extraction_result['text']
+        pages_analyzed = extraction_result['pages']
+        text_length = len(extracted_text)
+
+        logger.info(f"PDF processed once: {extraction_time}s extraction, {pages_analyzed} pages, {text_length} characters")
+
+        # Pack each prompt's context to the model's token budget; documents that do not
+        # fit get their most relevant pages instead of only the leading ones
+        assembler = self.ai_client.assembler
+        page_texts = extraction_result.get('page_texts') or []
+        select_pages = None
+        if get_context_strategy() == 'retrieval' and page_texts:
+            page_index = await run_blocking(get_page_index, content_hash, page_texts)
+            select_pages = page_index.select_pages
+        context_strategies = set()
+
+        def build_context(query: str) -> Dict[str, Any]:
+            if not page_texts:
+                return {'text': extracted_text, 'pages': None, 'strategy': 'full_text'}
+            context = assembler.pack(content_hash, page_texts, query, select_pages)
+            context_strategies.add(context['strategy'])
+            return context
+
+        def analyze_prompt(prompt):
+            context = build_context(prompt.get("prompt", ""))
+            # Use the retry helper with cached text approach
+            result = analyze_with_cached_text_retries(
+                ai_client=self.ai_client,
+                extracted_text=context['text'],
+                question=prompt.get("prompt", ""),
+                download_time=download_time,
+                extraction_time=extraction_time,
+                pages_analyzed=pages_analyzed,
+                text_length=text_length,
+                workspace_path=pdf_path,
+                max_retries=self.max_retries,
+                base_delay=self.base_delay
+            )
+            result["context_pages"] = context['pages']
+            return result
+
+        timer.start('ai_queries')
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+
+        cache_keys = [None] * len(prompts)
+
+        def complete(i: int, result: Dict[str, Any]):
+            # Record a finished prompt, store fresh answers and notify the caller
+            if isinstance(result.get("timing"), dict):
+                result["timing"].setdefault("cached", False)
+            if (self.answer_cache is not None and result.get("success")
+                    and not result.get("timing", {}).get("cached")):
+                self.answer_cache.put(cache_keys[i], result.get("answer", ""), result.get("explanation", ""))
+            results[i] = result
+            if on_result is not None:
+                on_result(i, build_prompt_response(prompts[i], result))
+
+        # Serve repeated (document, prompt, model, parameters, context) combinations from the answer cache
+        if self.answer_cache is not None:
+            # Answers from a truncated, retrieved or map-reduced context differ; so does a changed budget
+            cache_context = {
+                'query_mode': self.query_mode,
+                'context_strategy': get_context_strategy() if page_texts else 'full_text',
+                'budget': assembler.describe(),
+            }
+            if self.map_reducer is not None:
+                cache_context['map_reduce'] = {'chunk_tokens': self.map_reducer.chunk_tokens,
+                                               'confidence_threshold': self.map_reducer.confidence_threshold}
+            for i, prompt in enumerate(prompts):
+                cache_keys[i] = make_answer_key(
+                    content_hash, prompt.get("prompt", ""), self.ai_client.model,
+                    self.ai_client.max_tokens, self.ai_client.temperature, cache_context
+                )
+                cached = self.answer_cache.get(cache_keys[i])
+                if cached is not None:
+                    complete(i, {
+                        "success": True,
+                        "question": prompt.get("prompt", ""),
+                        "answer": cached["answer"],
+                        "explanation": cached["explanation"],
+                        "timing": {
+                            'download_time': download_time,
+                            'extraction_time': extraction_time,
+                            'ai_query_time': 0.0,
+                            'total_time': round(download_time + extraction_time, 2),
+                            'cached': True,
+                            'cache_age': cached["age"]
+                        }
+                    })
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            logger.info(f"{len(prompts) - len(pending)} answers served from cache, querying {len(pending)}")
+            pending_prompts = [prompts[i] for i in pending]
+            fresh_results = None
+
+            if self.query_mode == "batch":
+                # One statement for the whole prompt list; fall back to per-prompt on failure.
+                # The shared context holds the pages most relevant to all pending prompts.
+                questions = [prompt.get("prompt", "") for prompt in pending_prompts]
+                batch_context = await run_blocking(build_context, " ".join(questions))
+                async with self.executor.semaphore:
+                    batch_result = await run_blocking_statement(
+                        self.ai_client.analyze_batch_with_cached_text,
+                        batch_context['text'],
+                        questions,
+                        download_time=download_time,
+                        extraction_time=extraction_time,
+                        pages_analyzed=pages_analyzed,
+                        text_length=text_length,
+                        workspace_path=pdf_path
+                    )
+                if batch_result.get("success"):
+                    fresh_results = batch_result["results"]
+                    for i, result in zip(pending, fresh_results):
+                        result["context_pages"] = batch_context['pages']
+                        complete(i, result)
+                else:
+                    logger.warning(f"Batch AI query failed, falling back to per-prompt queries: {batch_result.get('error')}")
+
+            def complete_pending(position: int, result: Dict[str, Any]):
+                complete(pending[position], result)
+
+            if self.query_mode == "map_reduce" and page_texts:
+                fresh_results = await self._map_reduce(
+                    pending_prompts, content_hash, page_texts, analyze_prompt,
+                    download_time, extraction_time, pages_analyzed, text_length, pdf_path,
+                    on_result=complete_pending
+                )
+
+            if fresh_results is None:
+                await self.executor.arun(pending_prompts, analyze_prompt, on_result=complete_pending)
+        timer.end('ai_queries')
+
+        responses = [build_prompt_response(prompt, result) for prompt, result in zip(prompts, results)]
+
+        for r in responses:
+            if isinstance(r.get("answer"), (list, dict)):
+                logger.warning(f"Answer for '{r.get('prompt')}' returned a {type(r.get('answer')).__name__}")
+
+        merged_summary = " ".join(
+            [
+                normalize_answer(r.get("answer"))
+                for r in responses
+                if r.get("success")
+            ]
+        )
+
+        # Calculate total processing time across all prompts
+        total_processing_time = round(sum(
+            r.get("timing", {}).get("total_time", 0) for r in responses
+        ), 2)
+
+        return {
+            'success': True,
+            'responses': responses,
+            'merged_summary': merged_summary,
+            'total_processing_time': total_processing_time,
+            'prompts_wall_time': timer.stages['ai_queries']['duration'],
+            'max_concurrency': self.executor.max_concurrency,
+            'query_mode': self.query_mode,
+            'content_hash': content_hash,
+            'extraction_method': extraction_result.get('method'),
+            'context_strategy': ', '.join(sorted(context_strategies)) or None,
+            'context_budget': assembler.describe(),
+            'cached_answers': sum(1 for r in results if r.get("timing", {}).get("cached")),
+        }
+
+    async def _map_reduce(self, prompts: List[Dict[str, Any]], content_hash: str,
+                          page_texts: List[Dict[str, Any]], analyze_prompt: Callable,
+                          download_time: float, extraction_time: float, pages_analyzed: int,
+                          text_length: int, pdf_path: str,
+                          on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None
+                          ) -> List[Dict[str, Any]]:
+        """Answer prompts chunk by chunk; prompts whose document fits one chunk take the normal path."""
+        analyzer = self.map_reducer
+        # The executor's slots, shared with every document in the batch
+        semaphore = self.executor.semaphore
+
+        async def run_one(index: int, prompt: Dict[str, Any]) -> Dict[str, Any]:
+            result = await analyze_one(prompt)
+            if on_result is not None:
+                on_result(index, result)
+            return result
+
+        async def analyze_one(prompt: Dict[str, Any]) -> Dict[str, Any]:
+            question = prompt.get("prompt", "")
+            chunks = await run_blocking(analyzer.chunk, content_hash, page_texts, question)
+            async with semaphore:
+                if len(chunks) <= 1:
+                    return await run_blocking_statement(self.executor.run_one, analyze_prompt, prompt)
+                result = await analyzer.analyze(chunks, question)
+            ai_query_time = result['map_reduce']['total_time']
+            result['pdf_path'] = pdf_path
+            result['pages_analyzed'] = pages_analyzed
+            result['text_length'] = text_length
+            result['timing'] = {
+                'download_time': download_time,
+                'extraction_time': extraction_time,
+                'ai_query_time': ai_query_time,
+                'total_time': round(download_time + extraction_time + ai_query_time, 2),
+                'map_reduce': result.pop('map_reduce')
+            }
+            return result
+
+        logger.info(f"Running {len(prompts)} prompts in map_reduce mode "
+                    f"(chunk concurrency {analyzer.max_concurrency})")
+        return list(await asyncio.gather(*(run_one(i, prompt) for i, prompt in enumerate(prompts))))
@@ -0,0 +1,283 @@
+"""
+Background, batched audit notebooks for direct AI queries.
+
+Every direct AI query used to build a notebook embedding the whole PDF text
+and upload it before answering, one notebook per question. The writer only
+records the question and answer; a background thread writes one notebook per
+document per session, with the document text once and every distinct
+question and answer asked about it, rewriting it when new answers arrive.
+Answers never wait for the upload, and audit notebooks are off unless enabled.
+
+    AI_AUDIT_NOTEBOOKS         write audit notebooks (default false)
+    AI_AUDIT_NOTEBOOK_PATH     workspace folder for them (default /Workspace/Shared/ai_queries)
+    AI_AUDIT_FLUSH_SECONDS     how often pending answers are written (default 30)
+    AI_AUDIT_MAX_DOCUMENTS     documents kept in memory for rewrites (default 100)
+"""
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUDIT_PATH = "/Workspace/Shared/ai_queries"
+# Longest shutdown waits for the final write
+STOP_FLUSH_TIMEOUT = 15.0
+
+
+def audit_notebooks_enabled() -> bool:
+    """Return True if AI_AUDIT_NOTEBOOKS is set to true."""
+    return os.getenv('AI_AUDIT_NOTEBOOKS', 'false').lower() in ('1', 'true', 'yes')
+
+
+def _env_number(name: str, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+class _AuditDocument:
+    """Questions and answers recorded for one document in this session."""
+
+    def __init__(self, key: str, path: str, text: str):
+        self.key = key
+        self.path = path
+        self.text = text
+        self.entries: List[Dict[str, Any]] = []
+        self.seen = set()
+        self.dirty = False
+        self.written_at: Optional[float] = None
+
+
+def render_audit_notebook(document: _AuditDocument, model: str) -> str:
+    """
+    Build the notebook source for a document: its text once, then every answer.
+
+    Args:
+        document: The document and its recorded questions and answers
+        model: Model the answers came from
+
+    Returns:
+        Notebook content in Databricks source format
+    """
+    cells = [
+        "# Databricks notebook source\n"
+        "# MAGIC %md\n"
+        "# MAGIC # PDF AI Query Audit\n"
+        "# MAGIC \n"
+        f"# MAGIC **Document:** `{document.key[:16]}` ({len(document.text):,} characters)\n"
+        "# MAGIC \n"
+        f"# MAGIC **Model:** {model}\n"
+        "# MAGIC \n"
+        f"# MAGIC **Questions:** {len(document.entries)}\n",
+
+        "# PDF text content\n"
+        f"pdf_text = {document.text!r}\n"
+        "\n"
+        "print(f\"PDF text length: {len(pdf_text)} characters\")\n",
+    ]
+    for i, entry in enumerate(document.entries, 1):
+        cells.append(
+            "# MAGIC %md\n"
+            f"# MAGIC ## Question {i}\n"
+            "# MAGIC \n"
+            f"# MAGIC **Asked:** {entry['timestamp']}"
+            f"{' (with conversation context)' if entry.get('context_used') else ''}\n"
+        )
+        cells.append(
+            f"question_{i} = {entry['question']!r}\n"
+            f"answer_{i} = {entry['answer']!r}\n"
+            "\n"
+            f"print(question_{i})\n"
+            f"print(answer_{i})\n"
+        )
+    return "\n# COMMAND ----------\n\n".join(cells)
+
+
+class AuditNotebookWriter:
+    """Collects direct-query answers per document and writes them as notebooks in the background."""
+
+    def __init__(self, databricks_client: Any, model: str = "", base_path: Optional[str] = None,
+                 flush_interval: Optional[float] = None, max_documents: Optional[int] = None,
+                 enabled: Optional[bool] = None):
+        """
+        Initialize the writer.
+
+        Args:
+            databricks_client: DatabricksClient used to upload the notebooks
+            model: Model name shown in the notebooks
+            base_path: Workspace folder (AI_AUDIT_NOTEBOOK_PATH)
+            flush_interval: Seconds between writes (AI_AUDIT_FLUSH_SECONDS, default 30)
+            max_documents: Documents kept for rewrites (AI_AUDIT_MAX_DOCUMENTS, default 100)
+            enabled: Write notebooks at all (AI_AUDIT_NOTEBOOKS, default false)
+        """
+        self.databricks_client = databricks_client
+        self.model = model
+        self.enabled = enabled if enabled is not None else audit_notebooks_enabled()
+        self.base_path = (base_path or os.getenv('AI_AUDIT_NOTEBOOK_PATH') or DEFAULT_AUDIT_PATH).rstrip('/')
+        self.flush_interval = flush_interval if flush_interval is not None else _env_number(
+            'AI_AUDIT_FLUSH_SECONDS', 30.0, float)
+        self.max_documents = max_documents or _env_number('AI_AUDIT_MAX_DOCUMENTS', 100)
+        # One folder per process, so a document gets one notebook per session
+        self.session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._documents: "OrderedDict[str, _AuditDocument]" = OrderedDict()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'recorded': 0, 'duplicates': 0, 'notebooks_written': 0, 'write_errors': 0,
+                       'documents_evicted': 0}
+
+    def record(self, pdf_text: str, question: str, answer: Any, context_used: bool = False) -> Optional[str]:
+        """
+        Queue an answer for the document's audit notebook; never blocks on the upload.
+
+        Returns:
+            Workspace path the notebook will be written to, or None when disabled
+        """
+        if not self.enabled:
+            return None
+
+        key = hashlib.sha256(pdf_text.encode('utf-8')).hexdigest()
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None:
+                path = f"{self.base_path}/{self.session_id}/ai_query_{key[:16]}"
+                document = self._documents[key] = _AuditDocument(key, path, pdf_text)
+            self._documents.move_to_end(key)
+
+            entry_key = (question, str(answer))
+            if entry_key in document.seen:
+                self._stats['duplicates'] += 1
+                return document.path
+            document.seen.add(entry_key)
+            document.entries.append({'question': question, 'answer': str(answer), 'context_used': context_used,
+                                     'timestamp': datetime.now().isoformat(timespec='seconds')})
+            document.dirty = True
+            self._stats['recorded'] += 1
+            self._evict()
+
+        self._ensure_thread()
+        return document.path
+
+    def _evict(self):
+        """Drop the least recently used written documents beyond max_documents (called with the lock held)."""
+        for key in list(self._documents):
+            if len(self._documents) <= self.max_documents:
+                return
+            if not self._documents[key].dirty:
+                del self._documents[key]
+                self._stats['documents_evicted'] += 1
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-notebooks", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write every document with new answers.
+
+        Returns:
+            Number of notebooks written
+        """
+        # One flush at a time, so a notebook is never written twice concurrently
+        with self._flush_lock:
+            with self._lock:
+                pending = []
+                for document in self._documents.values():
+                    if document.dirty:
+                        document.dirty = False
+                        pending.append((document, render_audit_notebook(document, self.model)))
+
+            written = 0
+            for document, content in pending:
+                result = self.databricks_client.create_notebook_from_template(
+                    notebook_path=document.path, template_content=content, overwrite=True
+                )
+                with self._lock:
+                    if result.get('success'):
+                        written += 1
+                        document.written_at = time.time()
+                        self._stats['notebooks_written'] += 1
+                    else:
+                        # Retried with the next flush
+                        document.dirty = True
+                        self._stats['write_errors'] += 1
+                if not result.get('success'):
+                    logger.warning(f"Audit notebook write failed for {document.path}: {result.get('error')}")
+            return written
+
+    def _final_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"Final audit notebook flush failed: {e}")
+
+    def stop(self, flush: bool = True):
+        """Stop the background thread, writing pending answers first (for up to STOP_FLUSH_TIMEOUT) unless flush is False."""
+        self._stop_event.set()
+        if flush and self.enabled:
+            # Shutdown must not hang on a slow or retrying workspace upload
+            final = threading.Thread(target=self._final_flush, name="audit-notebooks-flush", daemon=True)
+            final.start()
+            final.join(STOP_FLUSH_TIMEOUT)
+            if final.is_alive():
+                logger.warning("Audit notebooks still being written at shutdown, pending answers may be lost")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'session_id': self.session_id,
+                'documents': len(self._documents),
+                'pending': sum(1 for d in self._documents.values() if d.dirty),
+                **self._stats
+            }
+
+
+_writers: Dict[str, AuditNotebookWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_audit_notebook_writer(databricks_client: Any, model: str = "") -> AuditNotebookWriter:
+    """Return the shared writer for a workspace, creating it on first use."""
+    key = databricks_client.host.rstrip('/')
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = AuditNotebookWriter(databricks_client, model)
+        return writer
+
+
+def audit_notebook_metrics() -> Dict[str, Any]:
+    """Return metrics for every writer, keyed by workspace."""
+    with _writers_lock:
+        writers = dict(_writers)
+    return {key: writer.metrics() for key, writer in writers.items()}
+
+
+def stop_audit_notebook_writers():
+    """Write pending answers and stop every writer (called from the application lifespan)."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
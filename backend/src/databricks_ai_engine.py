@@ -4,20 +4,30 @@ This replaces the OpenAI API with Databricks' built-in AI capabilities.
 """
 import os
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Union
 from datetime import datetime
-from io import BytesIO
-import PyPDF2
 
 # Add current directory to path for imports
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from backend.src.audit_notebooks import get_audit_notebook_writer
 from backend.src.databricks_client import DatabricksClient
+from backend.src.statement_waiter import statement_parameter
+from backend.utils.pdf_document import PDFDocument, as_pdf_document
 from backend.utils.pdf_processor import PDFProcessor
+from backend.utils.pdf_text_extractor import PDFTextExtractor, format_pages
+from backend.utils.token_budget import chunk_text
 
 logger = logging.getLogger(__name__)
 
+# Constant statement text; the prompt, PDF text and model settings are bound as named parameters
+DIRECT_AI_QUERY_SQL = """SELECT ai_query(
+    :model,
+    CONCAT(:prompt, :pdf_text),
+    modelParameters => named_struct('max_tokens', :max_tokens, 'temperature', :temperature)
+) AS ai_response"""
+
 
 class DatabricksAIEngine:
     """Engine for querying PDF content using Databricks AI functions."""
@@ -44,13 +54,16 @@ class DatabricksAIEngine:
         
         # Conversation context storage
         self.conversation_contexts = {}
+
+        # Shared background writer for audit notebooks (off unless AI_AUDIT_NOTEBOOKS=true)
+        self.audit_notebooks = get_audit_notebook_writer(databricks_client, model)
     
-    def extract_full_text_from_pdf(self, file_content: bytes) -> Dict[str, Any]:
+    def extract_full_text_from_pdf(self, file_content: Union[bytes, PDFDocument]) -> Dict[str, Any]:
         """
         Extract text from PDF content with multiple fallback methods.
 
         Args:
-            file_content: PDF file content as bytes
+            file_content: PDF file content as bytes, or an already parsed PDFDocument
 
         Returns:
             Dict with extracted text and metadata
@@ -64,35 +77,21 @@ class DatabricksAIEngine:
             'extraction_method': None
         }
 
-        # Method 1: Try PyPDF2 (primary method)
+        document = as_pdf_document(file_content)
+        file_content = document.content
+
+        # Method 1: Try PyPDF2 (primary method, long documents use the extraction pool)
         try:
             logger.info(f"Attempting PyPDF2 text extraction from {len(file_content)} bytes")
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-            result['total_pages'] = len(pdf_reader.pages)
-
-            text_parts = []
-            page_texts = []
-
-            for i, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        page_info = {
-                            'page_number': i + 1,
-                            'text': page_text,
-                            'char_count': len(page_text)
-                        }
-                        page_texts.append(page_info)
-                        text_parts.append(f"--- Page {i+1} ---\n{page_text}\n")
-                except Exception as e:
-                    logger.warning(f"Failed to extract text from page {i+1}: {str(e)}")
-
-            if len(text_parts) > 0:
-                result['text'] = '\n'.join(text_parts)
-                result['pages'] = page_texts
+            extraction = PDFTextExtractor().extract_pages(document)
+            result['total_pages'] = extraction['total_pages']
+
+            if len(extraction['pages']) > 0:
+                result['text'] = format_pages(extraction['pages'])
+                result['pages'] = extraction['pages']
                 result['extraction_successful'] = True
                 result['extraction_method'] = 'PyPDF2'
-                logger.info(f"PyPDF2 extraction successful: {len(result['text'])} characters")
+                logger.info(f"PyPDF2 extraction successful: {len(result['text'])} characters ({extraction['method']})")
                 return result
             else:
                 logger.warning("PyPDF2 extracted no text, trying fallback methods")
@@ -149,29 +148,7 @@ File information:
         Returns:
             List of text chunks
         """
-        if len(text) <= max_chunk_size:
-            return [text]
-        
-        chunks = []
-        words = text.split()
-        current_chunk = []
-        current_length = 0
-        
-        for word in words:
-            word_length = len(word) + 1  # +1 for space
-            
-            if current_length + word_length > max_chunk_size and current_chunk:
-                chunks.append(' '.join(current_chunk))
-                current_chunk = [word]
-                current_length = word_length
-            else:
-                current_chunk.append(word)
-                current_length += word_length
-        
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
-        
-        return chunks
+        return chunk_text(text, max_chunk_size)
     
     def create_databricks_notebook_for_query(self, pdf_text: str, question: str, 
                                            context: List[Dict] = None) -> str:
@@ -392,26 +369,17 @@ Please answer this question based on the provided PDF text. Be comprehensive and
 
 PDF Text: """
 
-            # Combine prompt with PDF text
-            full_prompt = ai_prompt + pdf_text
-
-            # Escape single quotes for SQL safety
-            full_prompt_escaped = full_prompt.replace("'", "''")
-
-            # Execute AI query using SQL warehouse
-            sql_query = f"""
-            SELECT ai_query(
-                '{self.model}',
-                '{full_prompt_escaped}',
-                named_struct(
-                    'max_tokens', {self.max_tokens},
-                    'temperature', {self.temperature}
-                )
-            ) as ai_response
-            """
+            # The prompt and PDF text are concatenated server-side, never escaped into the SQL
+            parameters = [
+                statement_parameter("model", self.model),
+                statement_parameter("prompt", ai_prompt),
+                statement_parameter("pdf_text", pdf_text),
+                statement_parameter("max_tokens", self.max_tokens, "INT"),
+                statement_parameter("temperature", self.temperature, "DOUBLE"),
+            ]
 
             # Execute the query using Databricks SQL
-            result = self.databricks_client.execute_sql_query(sql_query)
+            result = self.databricks_client.execute_sql_query(DIRECT_AI_QUERY_SQL, parameters=parameters)
 
             if result['success'] and result['data']:
                 # Handle different column name formats
@@ -428,20 +396,8 @@ PDF Text: """
                     # Fallback: use the first value in the row
                     ai_response = list(row_data.values())[0] if row_data else "No response received"
 
-                # Also create notebook for reference (optional)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                notebook_name = f"ai_query_{timestamp}"
-                notebook_path = f"/Workspace/Shared/ai_queries/{notebook_name}"
-
-                notebook_content = self.create_databricks_notebook_for_query(
-                    pdf_text, question, context
-                )
-
-                self.databricks_client.create_notebook_from_template(
-                    notebook_path=notebook_path,
-                    template_content=notebook_content,
-                    overwrite=True
-                )
+                # Audit notebook (AI_AUDIT_NOTEBOOKS): queued, one per document, written in the background
+                notebook_path = self.audit_notebooks.record(pdf_text, question, ai_response, bool(context_str))
 
                 return {
                     'success': True,
@@ -450,7 +406,7 @@ PDF Text: """
                     'notebook_path': notebook_path,
                     'model_used': self.model,
                     'processing_time': datetime.now().isoformat(),
-                    'prompt_length': len(full_prompt),
+                    'prompt_length': len(ai_prompt) + len(pdf_text),
                     'context_used': bool(context_str)
                 }
             else:
@@ -2,13 +2,22 @@
 Databricks client module for handling connections and file operations.
 """
 import os
+import time
 import base64
 import logging
 from typing import Optional, Dict, Any, List
 from databricks.sdk import WorkspaceClient
 from databricks.sdk.core import Config
 from databricks.sdk.service import workspace
-import requests
+
+from backend.src.http_session import get_http_session
+from backend.src.statement_waiter import get_statement_waiter, server_wait_timeout
+from backend.src.warehouse_limiter import get_warehouse_limiter
+from backend.src.warehouse_pool import get_warehouse_pool
+from backend.src.warehouse_resolver import get_warehouse_resolver
+from backend.src.warehouse_warmer import get_warehouse_warmer
+from backend.utils.request_context import deadline_stage, stage_timeout
+from backend.utils.retry_helper import WarehouseStartingError, classify_error_code, error_fields
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +48,12 @@ class DatabricksClient:
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json'
         }
+
+        # Shared, TTL-cached SQL warehouse choice
+        self.warehouse_resolver = get_warehouse_resolver(self.host, self.token)
+        self.warehouse_warmer = get_warehouse_warmer(self.host, self.token)
+        self.warehouse_pool = get_warehouse_pool(self.host, self.token)
+        self.statement_waiter = get_statement_waiter(self.host, self.token)
     
     def test_connection(self) -> Dict[str, Any]:
         """
@@ -409,7 +424,7 @@ class DatabricksClient:
                         'format': format_type
                     }
 
-                    response = requests.get(url, headers=headers, params=payload)
+                    response = get_http_session().get(url, headers=headers, params=payload)
 
                     if response.status_code == 200:
                         result = response.json()
@@ -432,44 +447,77 @@ class DatabricksClient:
             logger.error(f"REST API download failed for {workspace_path}: {str(e)}")
             return None
 
-    def execute_sql_query(self, sql_query: str, warehouse_id: str = None) -> Dict[str, Any]:
+    def execute_sql_query(self, sql_query: str, warehouse_id: str = None,
+                          parameters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Execute a SQL query using Databricks SQL warehouse.
 
+        Without a warehouse_id the warehouse pool picks the least loaded
+        warehouse. The statement takes a slot in that warehouse's shared adaptive
+        limiter (failing fast while its circuit breaker is open) and reports its
+        outcome back to it.
+
         Args:
             sql_query: SQL query to execute
-            warehouse_id: Optional warehouse ID (uses default if not provided)
+            warehouse_id: Optional warehouse ID (picked by the warehouse pool if not provided)
+            parameters: Named parameters for :name markers in sql_query, as built by
+                statement_parameter (name, value, type)
 
         Returns:
             Dict with execution results
         """
+        # An explicit warehouse bypasses the pool but still takes a slot in its limiter
+        limiter = get_warehouse_limiter(warehouse_id) if warehouse_id else None
+        try:
+            with deadline_stage("queue"):
+                if limiter is None:
+                    warehouse_id = self.warehouse_pool.acquire(stage_timeout("queue"))
+                elif not limiter.acquire(stage_timeout("queue")):
+                    raise TimeoutError(f"Timed out waiting for a statement slot on warehouse {warehouse_id}")
+        except Exception as e:
+            logger.error(f"Failed to execute SQL query: {str(e)}")
+            return {'success': False, 'error': str(e), **error_fields(e)}
+        logger.info(f"Using warehouse: {warehouse_id}")
+
+        started_at = time.time()
+        result: Dict[str, Any] = {}
+        try:
+            result = self._execute_sql_query(sql_query, warehouse_id, parameters)
+            return result
+        finally:
+            self.warehouse_pool.release(warehouse_id, None if result.get('success') else result.get('error_type'),
+                                        started_at)
+
+    def _execute_sql_query(self, sql_query: str, warehouse_id: str,
+                           parameters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         try:
             # Import SQL execution client
             from databricks.sdk.service import sql
 
-            # Get available warehouses if no warehouse_id provided
+            # Resolve the warehouse from the shared TTL cache if no warehouse_id provided
             if not warehouse_id:
-                warehouses = list(self.workspace_client.warehouses.list())
-                if not warehouses:
+                try:
+                    warehouse_id = self.warehouse_resolver.resolve()
+                except RuntimeError as resolve_error:
                     return {
                         'success': False,
-                        'error': 'No SQL warehouses available'
+                        'error': str(resolve_error)
                     }
-                warehouse_id = warehouses[0].id
                 logger.info(f"Using warehouse: {warehouse_id}")
 
-            # Check warehouse status and start if needed
+            # Start the warehouse if the cached state says it is stopped
             try:
-                warehouse_info = self.workspace_client.warehouses.get(warehouse_id)
-                logger.info(f"Warehouse state: {warehouse_info.state}")
+                warehouse_state = self.warehouse_resolver.get_state(warehouse_id)
+                logger.info(f"Warehouse state (cached): {warehouse_state}")
 
-                if warehouse_info.state == sql.State.STOPPED:
+                if warehouse_state == sql.State.STOPPED.value:
+                    # Normally already started at setup or upload; the warmer sends one start at most
                     logger.info("Warehouse is stopped, starting it...")
-                    self.workspace_client.warehouses.start(warehouse_id)
-                    logger.info("Warehouse start command sent. It may take 1-2 minutes to start.")
-                elif warehouse_info.state == sql.State.STARTING:
+                    self.warehouse_warmer.request_warm("query")
+                    logger.info("Warehouse start requested. It may take 1-2 minutes to start.")
+                elif warehouse_state == sql.State.STARTING.value:
                     logger.info("Warehouse is already starting up...")
-                elif warehouse_info.state == sql.State.RUNNING:
+                elif warehouse_state == sql.State.RUNNING.value:
                     logger.info("Warehouse is running and ready")
 
             except Exception as warehouse_error:
@@ -479,11 +527,12 @@ class DatabricksClient:
             # Execute the query
             logger.info(f"Executing SQL query on warehouse {warehouse_id}")
 
-            # Create a statement execution with maximum allowed timeout
+            # Wait server-side as long as allowed, within the request's deadline budget
             statement = self.workspace_client.statement_execution.execute_statement(
                 warehouse_id=warehouse_id,
                 statement=sql_query,
-                wait_timeout="50s"  # Maximum allowed timeout
+                parameters=[sql.StatementParameterListItem(**p) for p in parameters] if parameters else None,
+                wait_timeout=server_wait_timeout("50s", stage_timeout("submit"))
             )
 
             # Check statement status and handle different states
@@ -531,42 +580,31 @@ class DatabricksClient:
                     'statement_id': statement.statement_id,
                     'warehouse_id': warehouse_id
                 }
-            elif statement.status.state == sql.StatementState.PENDING:
+            elif statement.status.state in (sql.StatementState.PENDING, sql.StatementState.RUNNING):
                 # Handle pending state - warehouse might be starting up
                 logger.warning(f"Query is still pending after timeout. This usually means the warehouse is starting up.")
                 logger.info(f"Statement ID: {statement.statement_id}")
 
-                # Try to wait a bit more for warehouse startup
-                import time
-                max_additional_wait = 60  # Additional 60 seconds
-                wait_interval = 5  # Check every 5 seconds
-
-                for i in range(0, max_additional_wait, wait_interval):
-                    logger.info(f"Waiting for warehouse startup... ({i+wait_interval}s)")
-                    time.sleep(wait_interval)
-
-                    # Check status again
+                # Wait on the shared statement waiter (backoff polling) instead of sleeping here
+                waited = self.statement_waiter.track(statement.statement_id, timeout=60).result()
+                if waited.get('state') in ('SUCCEEDED', 'FAILED', 'CANCELED', 'CLOSED'):
                     try:
-                        updated_statement = self.workspace_client.statement_execution.get_statement(statement.statement_id)
-                        if updated_statement.status.state == sql.StatementState.SUCCEEDED:
+                        statement = self.workspace_client.statement_execution.get_statement(statement.statement_id)
+                        if statement.status.state == sql.StatementState.SUCCEEDED:
                             logger.info("Query completed after additional wait!")
-                            statement = updated_statement
-                            break
-                        elif updated_statement.status.state in [sql.StatementState.FAILED, sql.StatementState.CANCELED]:
-                            logger.error(f"Query failed during additional wait: {updated_statement.status.state}")
-                            statement = updated_statement
-                            break
+                        else:
+                            logger.error(f"Query failed during additional wait: {statement.status.state}")
                     except Exception as e:
-                        logger.warning(f"Failed to check statement status: {e}")
-                        continue
+                        logger.warning(f"Failed to fetch finished statement: {e}")
 
                 # If still pending after additional wait, return error
-                if statement.status.state == sql.StatementState.PENDING:
+                if statement.status.state in (sql.StatementState.PENDING, sql.StatementState.RUNNING):
                     error_msg = "Query timed out - warehouse may be starting up. Please try again in a few minutes."
                     logger.error(error_msg)
                     return {
                         'success': False,
                         'error': error_msg,
+                        'error_type': WarehouseStartingError.kind,
                         'statement_id': statement.statement_id,
                         'suggestion': 'The SQL warehouse might be starting up. Please wait a few minutes and try again.'
                     }
@@ -607,13 +645,17 @@ class DatabricksClient:
 
             # Handle other failure states
             error_msg = f"Query failed with state: {statement.status.state}"
+            error_code = None
             if statement.status.error:
                 error_msg += f", Error: {statement.status.error.message}"
+                error_code = statement.status.error.error_code
+                self.warehouse_resolver.report_error(statement.status.error.message, error_code)
 
             logger.error(error_msg)
             return {
                 'success': False,
                 'error': error_msg,
+                **error_fields(classify_error_code(error_code, None, error_msg)),
                 'statement_id': statement.statement_id
             }
 
@@ -621,7 +663,8 @@ class DatabricksClient:
             logger.error(f"Failed to execute SQL query: {str(e)}")
             return {
                 'success': False,
-                'error': str(e)
+                'error': str(e),
+                **error_fields(e)
             }
 
     def get_clusters(self) -> List[Dict[str, Any]]:
@@ -0,0 +1,216 @@
+"""
+Shared, pooled HTTP session for Databricks REST calls.
+
+Every REST call path (AI statements, workspace import/export, warehouse lookups)
+goes through one keep-alive connection pool instead of opening a new TLS
+connection per call. The pool is created by the application lifespan and can be
+tuned through environment variables:
+
+    DATABRICKS_HTTP_POOL_SIZE         max connections kept per host (default 32)
+    DATABRICKS_HTTP_POOL_CONNECTIONS  number of host pools to cache (default 4)
+    DATABRICKS_HTTP_KEEPALIVE         reuse connections between calls (default true)
+    DATABRICKS_HTTP_KEEPALIVE_EXPIRY  idle seconds before a connection is dropped (HTTP/2 client only)
+    DATABRICKS_HTTP2                  use an HTTP/2 client when httpx[http2] is installed (default false)
+"""
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class DatabricksHTTPSession:
+    """Thread-safe wrapper around a pooled HTTP client with usage counters."""
+
+    def __init__(self, pool_size: int = 32, pool_connections: int = 4,
+                 keepalive: bool = True, keepalive_expiry: float = 30.0,
+                 http2: bool = False):
+        """
+        Initialize the pooled session.
+
+        Args:
+            pool_size: Maximum connections kept open per host
+            pool_connections: Number of per-host pools to cache
+            keepalive: Whether connections are reused between calls
+            keepalive_expiry: Idle seconds before a pooled connection is closed (HTTP/2 client only)
+            http2: Use httpx with HTTP/2 if available, otherwise fall back to requests
+        """
+        self.pool_size = pool_size
+        self.pool_connections = pool_connections
+        self.keepalive = keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = False
+
+        self._lock = threading.Lock()
+        self._counters = {
+            'requests_total': 0,
+            'in_flight': 0,
+            'max_in_flight': 0,
+            'errors_total': 0,
+        }
+
+        self._client = None
+        if http2:
+            self._client = self._create_http2_client()
+        if self._client is None:
+            self._client = self._create_requests_session()
+
+    @classmethod
+    def from_env(cls) -> 'DatabricksHTTPSession':
+        """Build a session from the DATABRICKS_HTTP_* environment variables."""
+        return cls(
+            pool_size=_env_int('DATABRICKS_HTTP_POOL_SIZE', 32),
+            pool_connections=_env_int('DATABRICKS_HTTP_POOL_CONNECTIONS', 4),
+            keepalive=_env_bool('DATABRICKS_HTTP_KEEPALIVE', True),
+            keepalive_expiry=float(_env_int('DATABRICKS_HTTP_KEEPALIVE_EXPIRY', 30)),
+            http2=_env_bool('DATABRICKS_HTTP2', False),
+        )
+
+    def _create_requests_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_size,
+            pool_block=False
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keepalive:
+            session.headers['Connection'] = 'close'
+        logger.info(f"Created pooled HTTP session (pool_size={self.pool_size}, keepalive={self.keepalive})")
+        return session
+
+    def _create_http2_client(self):
+        try:
+            import httpx
+            import h2  # noqa: F401 - httpx needs the h2 package for HTTP/2
+        except ImportError:
+            logger.warning("DATABRICKS_HTTP2 requested but httpx[http2] is not installed, using HTTP/1.1")
+            return None
+
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size if self.keepalive else 0,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        self.http2 = True
+        logger.info(f"Created pooled HTTP/2 client (pool_size={self.pool_size})")
+        return httpx.Client(http2=True, limits=limits)
+
+    def request(self, method: str, url: str, **kwargs) -> Any:
+        """
+        Send a request through the shared pool.
+
+        Accepts the same keyword arguments as requests (headers, params, json, timeout).
+        """
+        with self._lock:
+            self._counters['requests_total'] += 1
+            self._counters['in_flight'] += 1
+            self._counters['max_in_flight'] = max(self._counters['max_in_flight'], self._counters['in_flight'])
+        try:
+            return self._client.request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                self._counters['errors_total'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._counters['in_flight'] -= 1
+
+    def get(self, url: str, **kwargs) -> Any:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> Any:
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Return request counters and connection pool statistics.
+
+        Returns:
+            Dict with configuration, counters and per-host pool usage
+        """
+        with self._lock:
+            metrics = dict(self._counters)
+
+        metrics.update({
+            'backend': 'httpx-http2' if self.http2 else 'requests',
+            'pool_size': self.pool_size,
+            'pool_connections': self.pool_connections,
+            'keepalive': self.keepalive,
+            'hosts': []
+        })
+
+        try:
+            if isinstance(self._client, requests.Session):
+                adapter = self._client.get_adapter('https://')
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    metrics['hosts'].append({
+                        'host': f"{key.key_scheme}://{key.key_host}:{key.key_port}",
+                        'connections_opened': pool.num_connections,
+                        'requests_served': pool.num_requests,
+                        # The urllib3 queue is pre-filled with None placeholders
+                        'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                    })
+            else:
+                connections = self._client._transport._pool.connections
+                metrics['hosts'].append({
+                    'host': '*',
+                    'connections_open': len(connections),
+                    'idle_connections': sum(1 for c in connections if c.is_idle()),
+                })
+        except Exception as e:
+            logger.debug(f"Could not read connection pool stats: {e}")
+
+        return metrics
+
+    def close(self):
+        """Close all pooled connections."""
+        self._client.close()
+
+
+_session: Optional[DatabricksHTTPSession] = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> DatabricksHTTPSession:
+    """Return the process-wide Databricks HTTP session, creating it from env on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = DatabricksHTTPSession.from_env()
+    return _session
+
+
+def close_http_session():
+    """Close the process-wide HTTP session (called from the application lifespan)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+            logger.info("Closed pooled HTTP session")
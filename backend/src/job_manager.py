@@ -0,0 +1,225 @@
+"""
+In-process analysis jobs with per-prompt result streaming.
+
+A long prompt list used to run inside one blocking HTTP request, which proxies
+and the frontend's axios client time out. A job is started in the background
+and returns its ID straight away; each prompt result is recorded as soon as it
+completes, so clients can poll the partial responses or follow them as an
+NDJSON stream.
+
+    JOB_TTL_SECONDS   how long finished jobs stay queryable (default 3600)
+    JOB_MAX_JOBS      most jobs kept in memory before the oldest finished ones are dropped (default 200)
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class AnalysisJob:
+    """State of one background analysis: partial responses plus an event log for streaming."""
+
+    def __init__(self, name: str, prompts: List[Dict[str, Any]], query_mode: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.prompts = prompts
+        self.query_mode = query_mode
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.responses: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+        self._events: List[Dict[str, Any]] = []
+        self._changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def completed_prompts(self) -> int:
+        return sum(1 for r in self.responses if r is not None)
+
+    def _emit(self, event: Dict[str, Any]):
+        event['job_id'] = self.id
+        event['timestamp'] = time.time()
+        self._events.append(event)
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        if status in FINISHED_STATUSES:
+            self.finished_at = time.time()
+        self.error = error
+        self._emit({'type': 'status', 'status': status, 'error': error})
+
+    def record_response(self, index: int, response: Dict[str, Any]):
+        """Store one prompt's response (called on the event loop as it completes)."""
+        self.responses[index] = response
+        self._emit({'type': 'prompt_result', 'index': index, 'response': response,
+                    'completed': self.completed_prompts, 'total': len(self.prompts)})
+
+    def complete(self, result: Dict[str, Any]):
+        self.result = result
+        self._emit({'type': 'result', 'result': result})
+        self.set_status("completed")
+
+    def to_dict(self, include_responses: bool = True) -> Dict[str, Any]:
+        """Return the job status; 'responses' holds the completed ones with their prompt index."""
+        data = {
+            'job_id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'query_mode': self.query_mode,
+            'total_prompts': len(self.prompts),
+            'completed_prompts': self.completed_prompts,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+        }
+        if include_responses:
+            data['responses'] = [
+                {'index': i, **response} for i, response in enumerate(self.responses) if response is not None
+            ]
+            data['result'] = self.result
+        return data
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every event from the start of the job, then new ones until it finishes."""
+        position = 0
+        while True:
+            while position < len(self._events):
+                event = self._events[position]
+                position += 1
+                yield event
+            if self.finished:
+                return
+            async with self._changed:
+                if position >= len(self._events) and not self.finished:
+                    await self._changed.wait()
+
+
+class JobManager:
+    """Starts analysis jobs as background tasks and keeps them queryable for a while."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_jobs: Optional[int] = None):
+        """
+        Initialize the manager.
+
+        Args:
+            ttl_seconds: Seconds finished jobs are kept (defaults to JOB_TTL_SECONDS)
+            max_jobs: Jobs kept in memory (defaults to JOB_MAX_JOBS)
+        """
+        try:
+            self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv('JOB_TTL_SECONDS', 3600))
+            self.max_jobs = max_jobs if max_jobs is not None else int(os.getenv('JOB_MAX_JOBS', 200))
+        except ValueError:
+            logger.warning("Invalid JOB_* values, using defaults")
+            self.ttl_seconds, self.max_jobs = 3600, 200
+        self._jobs: "OrderedDict[str, AnalysisJob]" = OrderedDict()
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at and now - job.finished_at > self.ttl_seconds:
+                del self._jobs[job_id]
+
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        while len(self._jobs) > self.max_jobs and finished:
+            del self._jobs[finished.pop(0)]
+
+    def start(self, name: str, prompts: List[Dict[str, Any]], query_mode: str,
+              runner: Callable[[AnalysisJob], Awaitable[Dict[str, Any]]]) -> AnalysisJob:
+        """
+        Create a job and run it in the background.
+
+        Args:
+            name: Document name shown in status responses
+            prompts: The prompt list being analyzed
+            query_mode: Query mode the job runs with
+            runner: Coroutine function that performs the analysis, feeding
+                job.record_response, and returns the final response body
+
+        Returns:
+            The new job (already scheduled)
+        """
+        self._prune()
+        job = AnalysisJob(name, prompts, query_mode)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, runner))
+        logger.info(f"Started analysis job {job.id} for {name} ({len(prompts)} prompts)")
+        return job
+
+    async def _run(self, job: AnalysisJob, runner: Callable[[AnalysisJob], Awaitable[Dict[str, Any]]]):
+        job.set_status("running")
+        try:
+            result = await runner(job)
+            if result.get("success"):
+                job.complete(result)
+            else:
+                job.set_status("failed", result.get("error", "Analysis failed"))
+        except asyncio.CancelledError:
+            job.set_status("cancelled", "Job cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Analysis job {job.id} failed: {str(e)}")
+            job.set_status("failed", str(e))
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        self._prune()
+        return [job.to_dict(include_responses=False) for job in self._jobs.values()]
+
+    async def cancel(self, job: AnalysisJob):
+        """Cancel a job that is still running and wait for it to stop."""
+        if job.task and not job.task.done():
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+            logger.info(f"Cancelled analysis job {job.id}")
+
+    async def stream(self, job: AnalysisJob) -> AsyncIterator[str]:
+        """Yield the job's events as NDJSON lines."""
+        async for event in job.events():
+            yield json.dumps(event, default=str) + "\n"
+
+    async def shutdown(self):
+        """Cancel running jobs (called from the application lifespan)."""
+        running = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+            logger.info(f"Cancelled {len(running)} running analysis jobs")
+
+
+_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """Return the process-wide job manager."""
+    global _manager
+    if _manager is None:
+        _manager = JobManager()
+    return _manager
@@ -0,0 +1,176 @@
+"""
+Map-reduce analysis for documents larger than one context window.
+
+Each prompt is run against every page-aligned chunk of the document
+concurrently (map), each chunk answering with structured JSON
+{answer, explanation, found, confidence}. A final ai_query consolidates the
+partial answers (reduce). As soon as one chunk returns a confident answer the
+remaining chunks are skipped, their in-flight statements are cancelled, and
+the reduce step is not needed.
+
+    MAP_REDUCE_CONCURRENCY    chunk statements in flight across all prompts (default 8)
+    MAP_REDUCE_CHUNK_TOKENS   maximum document tokens per chunk (default 8000)
+    MAP_REDUCE_CONFIDENCE     confidence that short-circuits the map step (default 0.9)
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from backend.databricks_ai import MAP_PROMPT_PREFIX, MAP_PROMPT_SUFFIX
+from backend.utils.async_io import run_blocking_statement
+from backend.utils.request_context import RequestContext, current_request, use_request
+from backend.utils.token_budget import get_prompt_assembler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAP_CONCURRENCY = 8
+MAX_MAP_CONCURRENCY = 32
+DEFAULT_CHUNK_TOKENS = 8000
+DEFAULT_CONFIDENCE_THRESHOLD = 0.9
+
+NOT_FOUND_ANSWER = "Not found in document"
+
+
+def _env_number(name: str, default, cast):
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+class MapReduceAnalyzer:
+    """Answers prompts over chunked documents with a concurrent map and a single reduce."""
+
+    def __init__(self, ai_client, max_concurrency: Optional[int] = None,
+                 chunk_tokens: Optional[int] = None, confidence_threshold: Optional[float] = None):
+        """
+        Initialize the analyzer.
+
+        Args:
+            ai_client: DatabricksAI instance used for the map and reduce statements
+            max_concurrency: Chunk statements in flight (defaults to MAP_REDUCE_CONCURRENCY)
+            chunk_tokens: Maximum document tokens per chunk (defaults to MAP_REDUCE_CHUNK_TOKENS)
+            confidence_threshold: Confidence that stops the map step early
+                (defaults to MAP_REDUCE_CONFIDENCE)
+        """
+        if max_concurrency is None:
+            max_concurrency = _env_number('MAP_REDUCE_CONCURRENCY', DEFAULT_MAP_CONCURRENCY, int)
+        if chunk_tokens is None:
+            chunk_tokens = _env_number('MAP_REDUCE_CHUNK_TOKENS', DEFAULT_CHUNK_TOKENS, int)
+        if confidence_threshold is None:
+            confidence_threshold = _env_number('MAP_REDUCE_CONFIDENCE', DEFAULT_CONFIDENCE_THRESHOLD, float)
+
+        self.ai_client = ai_client
+        self.max_concurrency = max(1, min(max_concurrency, MAX_MAP_CONCURRENCY))
+        self.chunk_tokens = chunk_tokens
+        self.confidence_threshold = confidence_threshold
+        self.assembler = get_prompt_assembler(
+            ai_client.model, template_text=MAP_PROMPT_PREFIX + MAP_PROMPT_SUFFIX,
+            max_output_tokens=ai_client.max_tokens
+        )
+        # Shared by every prompt of a request so total warehouse load stays bounded
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def chunk(self, content_hash: str, pages: List[Dict[str, Any]], question: str) -> List[Dict[str, Any]]:
+        """Split a document into chunks sized for the map prompt."""
+        return self.assembler.chunk_pages(content_hash, pages, question, self.chunk_tokens)
+
+    async def analyze(self, chunks: List[Dict[str, Any]], question: str) -> Dict[str, Any]:
+        """
+        Answer one question over a chunked document.
+
+        Args:
+            chunks: Output of chunk()
+            question: The question to answer
+
+        Returns:
+            Dict with success flag, 'answer', 'explanation', 'context_pages' (pages
+            that contributed to the answer) and 'map_reduce' statistics
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        semaphore = self._semaphore
+
+        start_time = time.time()
+        partials: List[Optional[Dict[str, Any]]] = [None] * len(chunks)
+
+        async def map_one(index: int) -> Dict[str, Any]:
+            async with semaphore:
+                result = await run_blocking_statement(
+                    self.ai_client.query_chunk_with_databricks_ai, chunks[index]['text'], question
+                )
+            result['pages'] = chunks[index]['pages']
+            partials[index] = result
+            return result
+
+        # The map statements run in a child context so a short-circuit can cancel them on the warehouse
+        map_context = RequestContext(f"map step of {question[:40]!r}", parent=current_request())
+        confident = None
+        with use_request(map_context):
+            tasks = [asyncio.create_task(map_one(i)) for i in range(len(chunks))]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    if (result.get('success') and result.get('found')
+                            and result.get('confidence', 0) >= self.confidence_threshold):
+                        confident = result
+                        break
+            finally:
+                pending = [task for task in tasks if not task.done()]
+                if pending:
+                    # Cancel in-flight statements server-side and skip chunks not sent yet
+                    map_context.cancel("map step finished early")
+                    for task in pending:
+                        task.cancel()
+        map_time = round(time.time() - start_time, 2)
+
+        completed = [p for p in partials if p is not None]
+        found = [p for p in completed if p.get('success') and p.get('found')]
+        stats = {
+            'chunks': len(chunks),
+            'chunks_completed': len(completed),
+            'chunks_failed': sum(1 for p in completed if not p.get('success')),
+            'chunks_found': len(found),
+            'short_circuited': confident is not None,
+            'reduced': False,
+            'map_time': map_time,
+        }
+
+        def finish(result: Dict[str, Any], pages: Optional[List[int]]) -> Dict[str, Any]:
+            stats['total_time'] = round(time.time() - start_time, 2)
+            result['question'] = question
+            result['context_pages'] = pages
+            result['map_reduce'] = stats
+            return result
+
+        if confident is not None:
+            logger.info(f"Map step short-circuited after {len(completed)}/{len(chunks)} chunks")
+            return finish({'success': True, 'answer': confident['answer'],
+                           'explanation': confident['explanation']}, confident['pages'])
+
+        if not found:
+            if any(p.get('success') for p in completed):
+                return finish({'success': True, 'answer': NOT_FOUND_ANSWER,
+                               'explanation': "None of the document excerpts contained the requested information."},
+                              None)
+            error = next((p.get('error') for p in completed if p.get('error')), 'All chunk queries failed')
+            return finish({'success': False, 'error': error}, None)
+
+        pages = sorted({page for p in found for page in p['pages']})
+        if len(found) == 1:
+            return finish({'success': True, 'answer': found[0]['answer'],
+                           'explanation': found[0]['explanation']}, pages)
+
+        stats['reduced'] = True
+        async with semaphore:
+            reduced = await run_blocking_statement(self.ai_client.reduce_with_databricks_ai, question, found)
+        if not reduced.get('success'):
+            # Fall back to the most confident partial answer rather than failing the prompt
+            logger.warning(f"Reduce step failed, using best partial answer: {reduced.get('error')}")
+            best = max(found, key=lambda p: p.get('confidence', 0))
+            return finish({'success': True, 'answer': best['answer'],
+                           'explanation': best['explanation']}, best['pages'])
+        return finish(reduced, pages)
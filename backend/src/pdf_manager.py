@@ -1,8 +1,12 @@
 """
 PDF Manager for handling uploaded PDFs and their content for querying.
+
+    PDF_CONTENT_CACHE_MAX_MB   total size of cached PDF bytes, least recently used evicted first (default 128)
 """
 import os
 import logging
+import threading
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
@@ -11,6 +15,7 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.src.databricks_client import DatabricksClient
+from backend.utils.pdf_processor import compute_content_hash
 
 logger = logging.getLogger(__name__)
 
@@ -28,8 +33,19 @@ class PDFManager:
         self.databricks_client = databricks_client
         self.upload_base_path = os.getenv('DATABRICKS_UPLOAD_PATH', '/Workspace/Shared/pdf_uploads')
         
-        # Cache for PDF content to avoid re-downloading
-        self.pdf_content_cache = {}
+        # Cache for PDF content to avoid re-downloading (least recently used first)
+        self.pdf_content_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        # SHA-256 of each cached entry, so callers can tell stale content apart
+        self.pdf_content_hashes = {}
+        # Every upload is written through, so the cache is bounded by total size
+        try:
+            max_mb = int(os.getenv('PDF_CONTENT_CACHE_MAX_MB', 128))
+        except ValueError:
+            logger.warning("Invalid PDF_CONTENT_CACHE_MAX_MB value, using default")
+            max_mb = 128
+        self.max_cache_bytes = max(0, max_mb) * 1024 * 1024
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
     
     def list_available_pdfs(self) -> List[Dict[str, Any]]:
         """
@@ -64,21 +80,33 @@ class PDFManager:
             logger.error(f"Failed to list PDFs: {str(e)}")
             return []
     
-    def get_pdf_content(self, workspace_path: str, use_cache: bool = True) -> Optional[bytes]:
+    def get_pdf_content(self, workspace_path: str, use_cache: bool = True,
+                        content_hash: Optional[str] = None) -> Optional[bytes]:
         """
         Get PDF content from workspace.
         
         Args:
             workspace_path: Path to PDF in workspace
             use_cache: Whether to use cached content
+            content_hash: Expected SHA-256 of the content; a cached entry with a
+                different hash is treated as stale and re-downloaded
             
         Returns:
             PDF content as bytes or None if failed
         """
         # Check cache first
-        if use_cache and workspace_path in self.pdf_content_cache:
-            logger.info(f"Using cached content for {workspace_path}")
-            return self.pdf_content_cache[workspace_path]
+        if use_cache:
+            with self._cache_lock:
+                cached = self.pdf_content_cache.get(workspace_path)
+                fresh = cached is not None and (
+                    content_hash is None or self.pdf_content_hashes.get(workspace_path) == content_hash)
+                if fresh:
+                    self.pdf_content_cache.move_to_end(workspace_path)
+            if fresh:
+                logger.info(f"Using cached content for {workspace_path}")
+                return cached
+            if cached is not None:
+                logger.info(f"Cached content for {workspace_path} is stale, re-downloading")
         
         try:
             # Download PDF content from workspace using export API
@@ -90,7 +118,7 @@ class PDFManager:
             if content:
                 # Cache the downloaded content
                 if use_cache:
-                    self.pdf_content_cache[workspace_path] = content
+                    self.cache_pdf_content(workspace_path, content)
                 logger.info(f"Successfully downloaded PDF content from {workspace_path} ({len(content)} bytes)")
                 return content
             else:
@@ -101,16 +129,44 @@ class PDFManager:
             logger.error(f"Failed to get PDF content from {workspace_path}: {str(e)}")
             return None
     
-    def cache_pdf_content(self, workspace_path: str, content: bytes):
+    def cache_pdf_content(self, workspace_path: str, content: bytes,
+                          content_hash: Optional[str] = None) -> str:
         """
         Cache PDF content for faster access.
+
+        Used write-through by the upload path so analysis starts from the bytes
+        already in memory instead of exporting the file back from the workspace.
+        Least recently used entries are evicted beyond PDF_CONTENT_CACHE_MAX_MB;
+        content larger than the whole cache is not stored.
         
         Args:
             workspace_path: Path to PDF in workspace
             content: PDF content as bytes
+            content_hash: Precomputed SHA-256 of content (computed if omitted)
+
+        Returns:
+            SHA-256 of the cached content
         """
-        self.pdf_content_cache[workspace_path] = content
+        content_hash = content_hash or compute_content_hash(content)
+        with self._cache_lock:
+            self._evict(workspace_path)
+            if len(content) > self.max_cache_bytes:
+                logger.info(f"Not caching {workspace_path}: {len(content)} bytes exceeds the cache size")
+                return content_hash
+            self.pdf_content_cache[workspace_path] = content
+            self.pdf_content_hashes[workspace_path] = content_hash
+            self._cache_bytes += len(content)
+            while self._cache_bytes > self.max_cache_bytes:
+                self._evict(next(iter(self.pdf_content_cache)))
         logger.info(f"Cached PDF content for {workspace_path} ({len(content)} bytes)")
+        return content_hash
+
+    def _evict(self, workspace_path: str):
+        """Drop one cache entry (caller holds _cache_lock)."""
+        content = self.pdf_content_cache.pop(workspace_path, None)
+        self.pdf_content_hashes.pop(workspace_path, None)
+        if content is not None:
+            self._cache_bytes -= len(content)
     
     def get_cached_pdf_content(self, workspace_path: str) -> Optional[bytes]:
         """
@@ -122,11 +178,18 @@ class PDFManager:
         Returns:
             Cached PDF content or None
         """
-        return self.pdf_content_cache.get(workspace_path)
+        with self._cache_lock:
+            content = self.pdf_content_cache.get(workspace_path)
+            if content is not None:
+                self.pdf_content_cache.move_to_end(workspace_path)
+            return content
     
     def clear_cache(self):
         """Clear all cached PDF content."""
-        self.pdf_content_cache.clear()
+        with self._cache_lock:
+            self.pdf_content_cache.clear()
+            self.pdf_content_hashes.clear()
+            self._cache_bytes = 0
         logger.info("Cleared PDF content cache")
     
     def get_pdf_info(self, workspace_path: str) -> Dict[str, Any]:
@@ -140,18 +203,21 @@ class PDFManager:
             Dict with PDF information
         """
         filename = os.path.basename(workspace_path)
+        with self._cache_lock:
+            content = self.pdf_content_cache.get(workspace_path)
+            content_hash = self.pdf_content_hashes.get(workspace_path)
         
         info = {
             'filename': filename,
             'workspace_path': workspace_path,
             'display_name': filename.replace('.pdf', ''),
-            'cached': workspace_path in self.pdf_content_cache,
-            'cache_size': len(self.pdf_content_cache.get(workspace_path, b''))
+            'cached': content is not None,
+            'cache_size': len(content or b''),
+            'content_hash': content_hash
         }
         
         # Try to get additional info from cached content
-        if workspace_path in self.pdf_content_cache:
-            content = self.pdf_content_cache[workspace_path]
+        if content is not None:
             info['file_size'] = len(content)
             info['file_size_mb'] = len(content) / 1024 / 1024
         
@@ -0,0 +1,409 @@
+"""
+Shared waiter for Databricks SQL statements.
+
+Each prompt used to hold a thread that polled its statement every 2 s for up to
+two minutes. The waiter submits statements with a server-side wait_timeout, so
+fast statements finish in the submit call, and tracks every statement still
+running in one table. A single poller thread checks them with exponential
+backoff and resolves a future per statement as it reaches a terminal state.
+
+    STATEMENT_WAIT_TIMEOUT       server-side wait on submit, 0 or 5s-50s (default 10s)
+    STATEMENT_POLL_INITIAL       first poll interval after the server-side wait (default 0.5s)
+    STATEMENT_POLL_MAX           backoff cap (default 5s)
+    STATEMENT_TIMEOUT            total time before a statement is given up and cancelled (default 120s)
+    STATEMENT_POLL_THREADS       concurrent status requests (default 4)
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+from backend.src.http_session import DatabricksHTTPSession, get_http_session
+from backend.utils.deadline import DeadlineExceeded
+from backend.utils.request_context import check_cancelled, current_deadline, current_request, stage_timeout
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELED", "CLOSED")
+BACKOFF_FACTOR = 1.5
+SUBMIT_HTTP_TIMEOUT = 60
+
+
+class StatementSubmitError(Exception):
+    """The statements API rejected a submission; carries the HTTP status, response body and error code."""
+
+    def __init__(self, status_code: int, body: str, retry_after: Optional[float] = None):
+        super().__init__(f"{status_code} error submitting statement: {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+        try:
+            self.error_code = json.loads(body).get("error_code")
+        except (ValueError, AttributeError):
+            self.error_code = None
+
+
+def parse_retry_after(value: Any) -> Optional[float]:
+    """Parse a Retry-After header (seconds or an HTTP date) into seconds."""
+    if value in (None, ""):
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def server_wait_timeout(preferred: str, budget: Optional[float] = None) -> str:
+    """
+    Clamp a server-side wait_timeout ('10s') to a time budget.
+
+    The statements API accepts 0 (return immediately) or 5-50 seconds.
+    """
+    try:
+        seconds = int(str(preferred).strip().rstrip('s') or 0)
+    except ValueError:
+        seconds = 10
+    if budget is not None:
+        seconds = min(seconds, int(budget))
+    return "0s" if seconds < 5 else f"{min(seconds, 50)}s"
+
+
+def statement_parameter(name: str, value: Any, sql_type: str = "STRING") -> Dict[str, Any]:
+    """
+    Build a named parameter (:name in the statement) for the statements API.
+
+    Args:
+        name: Parameter marker name, without the colon
+        value: Value to bind; sent as a string and cast to sql_type server-side (None binds NULL)
+        sql_type: SQL type of the value, e.g. STRING, INT, DOUBLE
+    """
+    parameter = {"name": name, "type": sql_type}
+    if value is not None:
+        parameter["value"] = str(value)
+    return parameter
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+class _PendingStatement:
+    __slots__ = ('statement_id', 'future', 'deadline', 'next_poll', 'interval', 'polls', 'submitted_at', 'polling',
+                 'budget')
+
+    def __init__(self, statement_id: str, future: Future, timeout: float, first_interval: float, budget=None):
+        now = time.time()
+        self.statement_id = statement_id
+        self.future = future
+        self.deadline = now + timeout
+        self.next_poll = now + first_interval
+        self.interval = first_interval
+        self.polls = 0
+        self.submitted_at = now
+        self.polling = False
+        # The request Deadline when it, rather than the statement timeout, bounds the wait
+        self.budget = budget
+
+
+class StatementWaiter:
+    """Submits statements and resolves one future per statement from a single poller thread."""
+
+    def __init__(self, host: str, token: str, session: Optional[DatabricksHTTPSession] = None,
+                 wait_timeout: Optional[str] = None, initial_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None, timeout: Optional[float] = None,
+                 poll_threads: Optional[int] = None):
+        """
+        Initialize the waiter.
+
+        Args:
+            host: Databricks workspace URL
+            token: Databricks access token
+            session: Shared HTTP session (defaults to the process-wide one)
+            wait_timeout: Server-side wait on submit (defaults to STATEMENT_WAIT_TIMEOUT)
+            initial_interval: First poll interval in seconds (defaults to STATEMENT_POLL_INITIAL)
+            max_interval: Poll interval cap in seconds (defaults to STATEMENT_POLL_MAX)
+            timeout: Seconds before a statement is abandoned (defaults to STATEMENT_TIMEOUT)
+            poll_threads: Status requests in flight at once (defaults to STATEMENT_POLL_THREADS)
+        """
+        self.host = host.rstrip('/')
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.session = session or get_http_session()
+        self.wait_timeout = wait_timeout or os.getenv('STATEMENT_WAIT_TIMEOUT', '10s')
+        self.initial_interval = initial_interval if initial_interval is not None else _env_float('STATEMENT_POLL_INITIAL', 0.5)
+        self.max_interval = max_interval if max_interval is not None else _env_float('STATEMENT_POLL_MAX', 5.0)
+        self.timeout = timeout if timeout is not None else _env_float('STATEMENT_TIMEOUT', 120.0)
+        poll_threads = poll_threads or int(_env_float('STATEMENT_POLL_THREADS', 4))
+
+        self._pending: Dict[str, _PendingStatement] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._poll_pool = ThreadPoolExecutor(max_workers=max(1, poll_threads), thread_name_prefix="statement-poll")
+        self._stats = {'submitted': 0, 'completed_on_submit': 0, 'completed': 0, 'polls': 0,
+                       'poll_errors': 0, 'timeouts': 0, 'cancelled': 0, 'max_outstanding': 0}
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._condition:
+            self._stats[stat] += amount
+
+    def submit(self, warehouse_id: str, statement: str, parameters: Optional[List[Dict[str, Any]]] = None,
+               timeout: Optional[float] = None) -> Future:
+        """
+        Submit a statement and return a future for its result.
+
+        The future resolves to a dict with 'success', 'state', 'statement_id' and
+        either 'rows' or 'error'. Submit failures are raised from future.result()
+        (StatementSubmitError for HTTP errors, RequestCancelled if the current
+        request was already cancelled).
+        """
+        check_cancelled()
+        # Both the HTTP call and the server-side wait come out of the request's deadline
+        http_timeout = stage_timeout("submit", SUBMIT_HTTP_TIMEOUT)
+        future: Future = Future()
+        payload = {
+            "warehouse_id": warehouse_id,
+            "statement": statement,
+            "wait_timeout": server_wait_timeout(self.wait_timeout, http_timeout - 1),
+            "on_wait_timeout": "CONTINUE"
+        }
+        if parameters:
+            payload["parameters"] = parameters
+
+        self._count('submitted')
+        try:
+            res = self.session.post(f"{self.host}/api/2.0/sql/statements", headers=self.headers,
+                                    json=payload, timeout=http_timeout)
+            if res.status_code >= 400:
+                raise StatementSubmitError(res.status_code, res.text,
+                                           parse_retry_after(res.headers.get("Retry-After")))
+            body = res.json()
+        except Exception as e:
+            future.set_exception(e)
+            return future
+
+        statement_id = body.get("statement_id")
+        if not statement_id:
+            future.set_result({"success": False, "error": "No statement_id returned from Databricks"})
+            return future
+
+        result = self._result_from_status(statement_id, body)
+        if result is not None:
+            self._count('completed_on_submit')
+            future.set_result(result)
+            return future
+
+        self._register(statement_id, future, timeout, self.initial_interval)
+        return future
+
+    def track(self, statement_id: str, timeout: Optional[float] = None) -> Future:
+        """Wait for a statement submitted elsewhere (e.g. through the SDK)."""
+        future: Future = Future()
+        self._register(statement_id, future, timeout, 0.0)
+        return future
+
+    def _register(self, statement_id: str, future: Future, timeout: Optional[float], first_interval: float):
+        requested = timeout or self.timeout
+        try:
+            timeout = stage_timeout("poll", requested)
+        except DeadlineExceeded as e:
+            # Nobody will wait for this statement, so don't leave it running
+            self._poll_pool.submit(self._send_cancel, statement_id)
+            future.set_exception(e)
+            return
+        budget = current_deadline() if timeout < requested else None
+        pending = _PendingStatement(statement_id, future, timeout, first_interval, budget)
+        with self._condition:
+            self._pending[statement_id] = pending
+            self._stats['max_outstanding'] = max(self._stats['max_outstanding'], len(self._pending))
+            self._ensure_thread()
+            self._condition.notify_all()
+
+        # Let the current request cancel the statement if it goes away
+        context = current_request()
+        if context is not None:
+            context.register_statement(statement_id, self.cancel)
+            future.add_done_callback(lambda _: context.unregister_statement(statement_id))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="statement-waiter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                now = time.time()
+                due, expired = [], []
+                for pending in self._pending.values():
+                    if pending.polling:
+                        continue
+                    if now >= pending.deadline:
+                        expired.append(pending)
+                    elif now >= pending.next_poll:
+                        pending.polling = True
+                        due.append(pending)
+
+                for pending in expired:
+                    del self._pending[pending.statement_id]
+                    self._stats['timeouts'] += 1
+
+                if not due and not expired:
+                    # Sleep until the next poll is due or a statement is registered/finishes
+                    idle = [min(p.next_poll, p.deadline) for p in self._pending.values() if not p.polling]
+                    wait = max(0.0, min(min(idle) - now, 1.0)) if idle else None
+                    self._condition.wait(wait)
+                    continue
+
+            for pending in due:
+                self._poll_pool.submit(self._poll, pending)
+            for pending in expired:
+                logger.warning(f"Statement {pending.statement_id} timed out after {round(now - pending.submitted_at, 1)}s")
+                error = str(pending.budget.exhaust("poll")) if pending.budget is not None else "AI query timeout"
+                pending.future.set_result({"success": False, "error": error,
+                                           "statement_id": pending.statement_id, "state": "TIMEOUT"})
+                # Stop paying for a statement nobody is waiting for
+                self._poll_pool.submit(self._send_cancel, pending.statement_id)
+
+    def _poll(self, pending: _PendingStatement):
+        result = None
+        try:
+            res = self.session.get(f"{self.host}/api/2.0/sql/statements/{pending.statement_id}",
+                                   headers=self.headers, timeout=30)
+            res.raise_for_status()
+            result = self._result_from_status(pending.statement_id, res.json())
+        except Exception as e:
+            # Transient status errors are retried with backoff until the deadline
+            self._count('poll_errors')
+            logger.warning(f"Status check for statement {pending.statement_id} failed: {str(e)}")
+
+        with self._condition:
+            self._stats['polls'] += 1
+            pending.polls += 1
+            pending.polling = False
+            if result is None:
+                pending.next_poll = time.time() + pending.interval
+                pending.interval = min(self.max_interval, max(pending.interval, 0.25) * BACKOFF_FACTOR)
+                self._condition.notify_all()
+                return
+            if self._pending.get(pending.statement_id) is not pending:
+                # Cancelled or timed out while the request was in flight
+                return
+            del self._pending[pending.statement_id]
+            self._stats['completed'] += 1
+
+        pending.future.set_result(result)
+
+    def _result_from_status(self, statement_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Turn a statement status response into a result dict, or None if still running."""
+        status = body.get("status", {}) or {}
+        state = status.get("state")
+        if state not in TERMINAL_STATES:
+            return None
+
+        if state == "SUCCEEDED":
+            result_data = body.get("result", {}) or {}
+            rows = list(result_data.get("data_array", []) or [])
+
+            # Larger result sets are split into chunks
+            next_link = result_data.get("next_chunk_internal_link")
+            while next_link:
+                chunk_res = self.session.get(f"{self.host}{next_link}", headers=self.headers, timeout=30)
+                chunk_res.raise_for_status()
+                chunk = chunk_res.json()
+                rows.extend(chunk.get("data_array", []) or [])
+                next_link = chunk.get("next_chunk_internal_link")
+
+            return {"success": True, "state": state, "rows": rows, "statement_id": statement_id}
+
+        error = status.get("error") or body.get("error") or {}
+        error_msg = error.get("message") or "Unknown error"
+        return {"success": False, "state": state, "error": f"AI query failed: {error_msg}",
+                "error_message": error_msg, "error_code": error.get("error_code"), "statement_id": statement_id}
+
+    def _send_cancel(self, statement_id: str) -> bool:
+        try:
+            res = self.session.post(f"{self.host}/api/2.0/sql/statements/{statement_id}/cancel",
+                                    headers=self.headers, timeout=10)
+            res.raise_for_status()
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to cancel statement {statement_id}: {str(e)}")
+            return False
+
+    def cancel(self, statement_id: str) -> bool:
+        """Cancel a statement server-side and resolve its future as cancelled."""
+        with self._condition:
+            pending = self._pending.pop(statement_id, None)
+            self._stats['cancelled'] += 1
+
+        cancelled = self._send_cancel(statement_id)
+        if pending is not None and not pending.future.done():
+            pending.future.set_result({"success": False, "state": "CANCELED", "error": "Statement cancelled",
+                                       "statement_id": statement_id})
+        return cancelled
+
+    def outstanding(self) -> List[str]:
+        with self._condition:
+            return list(self._pending)
+
+    def stop(self):
+        """Stop the poller thread; outstanding futures resolve as cancelled."""
+        with self._condition:
+            self._stopped = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._condition.notify_all()
+        for p in pending:
+            if not p.future.done():
+                p.future.set_result({"success": False, "state": "CANCELED", "error": "Statement waiter stopped",
+                                     "statement_id": p.statement_id})
+        self._poll_pool.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._stats)
+            stats['outstanding'] = len(self._pending)
+
+        finished = stats['completed']
+        stats['avg_polls_per_statement'] = round(stats['polls'] / finished, 2) if finished else 0.0
+        stats['wait_timeout'] = self.wait_timeout
+        stats['max_interval'] = self.max_interval
+        return stats
+
+
+_waiters: Dict[tuple, StatementWaiter] = {}
+_waiters_lock = threading.Lock()
+
+
+def get_statement_waiter(host: str, token: str) -> StatementWaiter:
+    """Return the shared waiter for a workspace, creating it on first use."""
+    key = (host.rstrip('/'), token)
+    with _waiters_lock:
+        waiter = _waiters.get(key)
+        if waiter is None:
+            waiter = _waiters[key] = StatementWaiter(host, token)
+        return waiter
+
+
+def stop_statement_waiters():
+    """Stop every waiter (called from the application lifespan)."""
+    with _waiters_lock:
+        waiters = list(_waiters.values())
+        _waiters.clear()
+    for waiter in waiters:
+        waiter.stop()
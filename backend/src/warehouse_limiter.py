@@ -0,0 +1,279 @@
+"""
+Per-warehouse adaptive statement concurrency with a circuit breaker.
+
+Prompt-level concurrency is set per request, so several requests (or a batch of
+files) can together queue more statements on one SQL warehouse than it runs at
+once, and the excess just waits server-side while holding HTTP connections. A
+limiter per warehouse caps statements in flight across the whole process and
+keeps the rest queued locally, first come first served.
+
+The cap adapts (AIMD): every statement that completes normally raises it by
+1/limit, so it grows by about one per round of statements, and an overload
+signal (rate limiting, statement timeouts, a starting warehouse) halves it.
+Throughput settles at what the warehouse actually sustains. After
+consecutive overload failures the circuit breaker opens and statements fail
+fast with CircuitOpenError until a cool-down has passed; then one probe
+statement decides whether it closes again.
+
+    DATABRICKS_WAREHOUSE_MAX_CONCURRENCY   initial statements in flight per warehouse (default 8)
+    DATABRICKS_WAREHOUSE_MAX_LIMIT         ceiling the adaptive limit can grow to (default 32)
+    DATABRICKS_WAREHOUSE_MIN_LIMIT         floor the adaptive limit can shrink to (default 1)
+    WAREHOUSE_BREAKER_FAILURES             consecutive failures that open the breaker (default 5)
+    WAREHOUSE_BREAKER_COOLDOWN             seconds the breaker stays open (default 30)
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WAREHOUSE_CONCURRENCY = 8
+DEFAULT_MAX_LIMIT = 32
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+DECREASE_FACTOR = 0.5
+LATENCY_SMOOTHING = 0.2
+
+# Error types (see retry_helper) that mean the warehouse is overloaded or unavailable
+OVERLOAD_ERROR_TYPES = ("rate_limited", "timeout", "warehouse_starting", "transient")
+# Error types that say nothing about warehouse health
+NEUTRAL_ERROR_TYPES = ("cancelled", "circuit_open")
+
+
+class CircuitOpenError(Exception):
+    """The warehouse's circuit breaker is open; statements fail fast until retry_after passes."""
+
+    def __init__(self, warehouse_id: str, retry_after: float):
+        super().__init__(f"Warehouse {warehouse_id} is unhealthy, not submitting statements "
+                         f"for another {retry_after:.0f}s")
+        self.warehouse_id = warehouse_id
+        self.retry_after = retry_after
+
+
+class WarehouseLimiter:
+    """Thread-safe FIFO queue in front of one warehouse, with an AIMD limit and a circuit breaker."""
+
+    def __init__(self, warehouse_id: str, max_concurrency: int = DEFAULT_WAREHOUSE_CONCURRENCY,
+                 max_limit: Optional[int] = None, min_limit: int = 1,
+                 breaker_failures: int = DEFAULT_BREAKER_FAILURES,
+                 breaker_cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        """
+        Initialize the limiter.
+
+        Args:
+            warehouse_id: Warehouse the limit applies to
+            max_concurrency: Initial statements allowed in flight at once
+            max_limit: Ceiling for the adaptive limit (defaults to DEFAULT_MAX_LIMIT)
+            min_limit: Floor for the adaptive limit
+            breaker_failures: Consecutive overload failures that open the circuit breaker
+            breaker_cooldown: Seconds the breaker stays open before a probe is let through
+        """
+        self.warehouse_id = warehouse_id
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or DEFAULT_MAX_LIMIT, max_concurrency)
+        self.limit = float(min(self.max_limit, max(self.min_limit, max_concurrency)))
+        self.breaker_failures = max(1, breaker_failures)
+        self.breaker_cooldown = breaker_cooldown
+
+        self._condition = threading.Condition()
+        self._waiters: deque = deque()
+        self._in_flight = 0
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._consecutive_failures = 0
+        self._last_decrease = 0.0
+        self._latency_ewma: Optional[float] = None
+        self._stats = {'acquired': 0, 'timeouts': 0, 'max_in_flight': 0, 'max_queued': 0, 'wait_time_total': 0.0,
+                       'successes': 0, 'failures': 0, 'decreases': 0, 'rejected': 0, 'breaker_opened': 0}
+
+    @property
+    def max_concurrency(self) -> int:
+        """Statements currently allowed in flight."""
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Smoothed duration of recent successful statements in seconds (None until one completes)."""
+        return self._latency_ewma
+
+    def load(self) -> float:
+        """Statements in flight or queued per slot of the current limit."""
+        with self._condition:
+            return (self._in_flight + len(self._waiters)) / self.max_concurrency
+
+    def is_available(self) -> bool:
+        """Return False while the breaker rejects statements (open, or half-open with its probe out)."""
+        with self._condition:
+            if self._state == "open":
+                return time.time() - self._opened_at >= self.breaker_cooldown
+            return not (self._state == "half_open" and self._probe_in_flight)
+
+    def set_max_limit(self, max_limit: int):
+        """Change the ceiling of the adaptive limit, e.g. for a smaller warehouse in a pool."""
+        with self._condition:
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(self.limit, float(self.max_limit))
+            self._condition.notify_all()
+
+    def _check_breaker(self):
+        """Fail fast while the breaker is open (called with the lock held)."""
+        if self._state == "open":
+            remaining = self._opened_at + self.breaker_cooldown - time.time()
+            if remaining > 0:
+                self._stats['rejected'] += 1
+                raise CircuitOpenError(self.warehouse_id, remaining)
+            self._state = "half_open"
+            logger.info(f"Warehouse {self.warehouse_id} breaker half-open, probing")
+        if self._state == "half_open" and self._probe_in_flight:
+            self._stats['rejected'] += 1
+            raise CircuitOpenError(self.warehouse_id, self.breaker_cooldown / 2)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for a slot in arrival order; returns False if timeout expires first.
+
+        Raises:
+            CircuitOpenError: If the warehouse's breaker is open
+        """
+        start = time.time()
+        ticket = object()
+        with self._condition:
+            self._check_breaker()
+            self._waiters.append(ticket)
+            self._stats['max_queued'] = max(self._stats['max_queued'], len(self._waiters))
+            try:
+                while self._waiters[0] is not ticket or self._in_flight >= self.max_concurrency:
+                    remaining = None if timeout is None else timeout - (time.time() - start)
+                    if remaining is not None and remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        return False
+                    self._condition.wait(remaining)
+                    # The breaker may have opened while this statement was queued
+                    self._check_breaker()
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter may now be at the head of the queue
+                self._condition.notify_all()
+
+            if self._state == "half_open":
+                self._probe_in_flight = True
+            self._in_flight += 1
+            self._stats['acquired'] += 1
+            self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._in_flight)
+            self._stats['wait_time_total'] += time.time() - start
+            return True
+
+    def release(self, error_type: Optional[str] = None, started_at: Optional[float] = None):
+        """
+        Free a slot and feed the statement's outcome to the limit and the breaker.
+
+        Args:
+            error_type: None for a statement the warehouse handled (including SQL
+                errors), or the retry_helper error type of a failure
+            started_at: When the statement was submitted; overloads from statements
+                older than the last decrease don't shrink the limit again
+        """
+        with self._condition:
+            self._in_flight = max(0, self._in_flight - 1)
+            if error_type in NEUTRAL_ERROR_TYPES:
+                if self._state == "half_open":
+                    self._probe_in_flight = False
+            elif error_type in OVERLOAD_ERROR_TYPES:
+                self._on_failure(started_at)
+            else:
+                self._on_success(started_at)
+            self._condition.notify_all()
+
+    def _on_success(self, started_at: Optional[float]):
+        self._stats['successes'] += 1
+        if started_at is not None:
+            duration = time.time() - started_at
+            self._latency_ewma = (duration if self._latency_ewma is None
+                                  else self._latency_ewma + LATENCY_SMOOTHING * (duration - self._latency_ewma))
+        self._consecutive_failures = 0
+        if self._state != "closed":
+            logger.info(f"Warehouse {self.warehouse_id} breaker closed")
+        self._state = "closed"
+        self._probe_in_flight = False
+        # Additive increase: about +1 per round of `limit` successful statements
+        self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def _on_failure(self, started_at: Optional[float]):
+        now = time.time()
+        self._stats['failures'] += 1
+        self._consecutive_failures += 1
+
+        # Multiplicative decrease, once per batch of statements that were in flight together
+        if started_at is None or started_at >= self._last_decrease:
+            self.limit = max(float(self.min_limit), self.limit * DECREASE_FACTOR)
+            self._last_decrease = now
+            self._stats['decreases'] += 1
+            logger.warning(f"Warehouse {self.warehouse_id} overloaded, statement limit now {self.max_concurrency}")
+
+        if self._state == "half_open" or self._consecutive_failures >= self.breaker_failures:
+            if self._state != "open":
+                self._stats['breaker_opened'] += 1
+                logger.warning(f"Warehouse {self.warehouse_id} breaker open for {self.breaker_cooldown:.0f}s "
+                               f"after {self._consecutive_failures} consecutive failures")
+            self._state = "open"
+            self._opened_at = now
+            self._probe_in_flight = False
+            # Queued statements fail fast instead of waiting for the cool-down
+            self._condition.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            stats['queued'] = len(self._waiters)
+            stats['limit'] = round(self.limit, 2)
+            stats['breaker_state'] = self._state
+            stats['consecutive_failures'] = self._consecutive_failures
+            stats['latency_ewma'] = round(self._latency_ewma, 3) if self._latency_ewma is not None else None
+
+        stats['warehouse_id'] = self.warehouse_id
+        stats['max_concurrency'] = self.max_concurrency
+        stats['min_limit'] = self.min_limit
+        stats['max_limit'] = self.max_limit
+        stats['avg_wait_time'] = round(stats['wait_time_total'] / stats['acquired'], 3) if stats['acquired'] else 0.0
+        stats['wait_time_total'] = round(stats['wait_time_total'], 2)
+        return stats
+
+
+_limiters: Dict[str, WarehouseLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_number(name: str, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+def get_warehouse_limiter(warehouse_id: str) -> WarehouseLimiter:
+    """Return the shared limiter for a warehouse, creating it on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(warehouse_id)
+        if limiter is None:
+            limiter = _limiters[warehouse_id] = WarehouseLimiter(
+                warehouse_id,
+                max_concurrency=_env_number('DATABRICKS_WAREHOUSE_MAX_CONCURRENCY', DEFAULT_WAREHOUSE_CONCURRENCY),
+                max_limit=_env_number('DATABRICKS_WAREHOUSE_MAX_LIMIT', DEFAULT_MAX_LIMIT),
+                min_limit=_env_number('DATABRICKS_WAREHOUSE_MIN_LIMIT', 1),
+                breaker_failures=_env_number('WAREHOUSE_BREAKER_FAILURES', DEFAULT_BREAKER_FAILURES),
+                breaker_cooldown=_env_number('WAREHOUSE_BREAKER_COOLDOWN', DEFAULT_BREAKER_COOLDOWN, float),
+            )
+        return limiter
+
+
+def warehouse_limiter_metrics() -> Dict[str, Any]:
+    """Return metrics for every warehouse limiter, keyed by warehouse ID."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.warehouse_id: limiter.metrics() for limiter in limiters}
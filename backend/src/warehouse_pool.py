@@ -0,0 +1,195 @@
+"""
+Load balancing of statements across several SQL warehouses.
+
+The resolver picks one warehouse, so every statement used to land on it even
+when the workspace had several. With DATABRICKS_WAREHOUSE_IDS set, each
+statement goes to the pool member with the shortest expected wait: statements
+in flight or queued per slot of its adaptive limit, weighted by how long its
+recent statements took. Members whose circuit breaker is open, or that are
+stopped while others are running, are skipped. Each member keeps its own
+limiter, so adding a warehouse adds its capacity.
+
+    DATABRICKS_WAREHOUSE_IDS   comma-separated warehouse IDs, each optionally with a
+                               concurrency cap, e.g. "abc123:16,def456" (default: the
+                               resolver's single warehouse)
+"""
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.src.warehouse_limiter import CircuitOpenError, WarehouseLimiter, get_warehouse_limiter
+from backend.src.warehouse_resolver import WarehouseResolver, get_warehouse_resolver
+
+logger = logging.getLogger(__name__)
+
+# States that mean a member can't take statements without a cold start
+COLD_STATES = ("STOPPED", "STOPPING", "DELETING", "DELETED")
+
+
+def parse_warehouse_ids(value: Optional[str]) -> List[Tuple[str, Optional[int]]]:
+    """
+    Parse 'id[:cap],id[:cap]' into (warehouse_id, cap) pairs.
+
+    Returns:
+        The pool members in configured order (empty if value is empty)
+    """
+    members = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        warehouse_id, _, cap = part.partition(":")
+        try:
+            members.append((warehouse_id.strip(), int(cap) if cap.strip() else None))
+        except ValueError:
+            logger.warning(f"Ignoring invalid concurrency cap in DATABRICKS_WAREHOUSE_IDS entry '{part}'")
+            members.append((warehouse_id.strip(), None))
+    return members
+
+
+class WarehousePool:
+    """Chooses a warehouse per statement and holds its limiter slot."""
+
+    def __init__(self, resolver: WarehouseResolver, warehouse_ids: Optional[str] = None):
+        """
+        Initialize the pool.
+
+        Args:
+            resolver: Resolver used for warehouse states, and for the warehouse
+                itself when no pool is configured
+            warehouse_ids: Pool members 'id[:cap],...' (DATABRICKS_WAREHOUSE_IDS)
+        """
+        self.resolver = resolver
+        self._members = parse_warehouse_ids(
+            warehouse_ids if warehouse_ids is not None else os.getenv('DATABRICKS_WAREHOUSE_IDS'))
+        for warehouse_id, cap in self._members:
+            if cap:
+                get_warehouse_limiter(warehouse_id).set_max_limit(cap)
+
+        self._lock = threading.Lock()
+        self._selected: Dict[str, int] = {}
+        self._stats = {'selections': 0, 'skipped_unavailable': 0, 'skipped_cold': 0, 'failovers': 0}
+
+    @property
+    def configured(self) -> bool:
+        """True when statements are spread over DATABRICKS_WAREHOUSE_IDS rather than one warehouse."""
+        return bool(self._members)
+
+    def members(self) -> List[str]:
+        """Return the warehouses statements can go to."""
+        if self._members:
+            return [warehouse_id for warehouse_id, _ in self._members]
+        return [self.resolver.resolve()]
+
+    def _expected_wait(self, limiter: WarehouseLimiter, default_latency: float) -> float:
+        # Little's law: queue position per slot times how long a statement holds a slot
+        latency = limiter.latency if limiter.latency is not None else default_latency
+        return (limiter.load() + 1.0 / limiter.max_concurrency) * latency
+
+    def _candidates(self, exclude: Tuple[str, ...] = ()) -> List[str]:
+        """Pool members ordered by expected wait, unavailable and cold ones left out while others remain."""
+        members = [m for m in self.members() if m not in exclude]
+        if len(members) <= 1:
+            return members
+
+        limiters = {m: get_warehouse_limiter(m) for m in members}
+        available = [m for m in members if limiters[m].is_available()]
+        warm = [m for m in available if self.resolver.get_state(m) not in COLD_STATES]
+        with self._lock:
+            self._stats['skipped_unavailable'] += len(members) - len(available)
+            self._stats['skipped_cold'] += len(available) - len(warm) if warm else 0
+        # With every member unavailable, acquiring on the first raises CircuitOpenError for the caller
+        candidates = warm or available or members
+
+        known = [limiters[m].latency for m in candidates if limiters[m].latency is not None]
+        default_latency = sorted(known)[len(known) // 2] if known else 1.0
+        return sorted(candidates, key=lambda m: self._expected_wait(limiters[m], default_latency))
+
+    def acquire(self, timeout: Optional[float] = None) -> str:
+        """
+        Choose a warehouse and take a slot in its limiter.
+
+        Args:
+            timeout: How long to wait for a slot (None to wait indefinitely)
+
+        Returns:
+            The warehouse ID; release it with release()
+
+        Raises:
+            CircuitOpenError: If every member's breaker is open
+            TimeoutError: If no slot frees up within timeout
+            RuntimeError: If no warehouse is available
+        """
+        tried: Tuple[str, ...] = ()
+        last_error: Optional[CircuitOpenError] = None
+        while True:
+            candidates = self._candidates(tried)
+            if not candidates:
+                if last_error is not None:
+                    raise last_error
+                raise RuntimeError("No SQL warehouses available")
+
+            warehouse_id = candidates[0]
+            try:
+                acquired = get_warehouse_limiter(warehouse_id).acquire(timeout)
+            except CircuitOpenError as e:
+                # The breaker opened between choosing and queueing; try the next member
+                last_error = e
+                tried += (warehouse_id,)
+                with self._lock:
+                    self._stats['failovers'] += 1
+                continue
+
+            if not acquired:
+                raise TimeoutError(f"Timed out waiting for a statement slot on warehouse {warehouse_id}")
+            with self._lock:
+                self._stats['selections'] += 1
+                self._selected[warehouse_id] = self._selected.get(warehouse_id, 0) + 1
+            return warehouse_id
+
+    def release(self, warehouse_id: str, error_type: Optional[str] = None, started_at: Optional[float] = None):
+        """Free the slot taken by acquire() and report the statement's outcome to the member's limiter."""
+        get_warehouse_limiter(warehouse_id).release(error_type, started_at)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return per-member utilization, health and share of statements."""
+        # Metrics never trigger a warehouse listing
+        members = self.members() if self.configured else [
+            m for m in [self.resolver.metrics()['chosen_warehouse_id']] if m]
+
+        with self._lock:
+            stats = dict(self._stats)
+            selected = dict(self._selected)
+        total = sum(selected.values())
+
+        warehouses = {}
+        for warehouse_id in members:
+            limiter = get_warehouse_limiter(warehouse_id).metrics()
+            warehouses[warehouse_id] = {
+                'state': self.resolver.get_state(warehouse_id),
+                'breaker_state': limiter['breaker_state'],
+                'in_flight': limiter['in_flight'],
+                'queued': limiter['queued'],
+                'limit': limiter['limit'],
+                'max_limit': limiter['max_limit'],
+                'utilization': round(limiter['in_flight'] / limiter['max_concurrency'], 2),
+                'latency_ewma': limiter['latency_ewma'],
+                'selected': selected.get(warehouse_id, 0),
+                'share': round(selected.get(warehouse_id, 0) / total, 3) if total else 0.0,
+            }
+        return {'configured': self.configured, 'warehouses': warehouses, **stats}
+
+
+_pools: Dict[str, WarehousePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_warehouse_pool(host: str, token: str) -> WarehousePool:
+    """Return the shared pool for a workspace, creating it on first use."""
+    key = host.rstrip('/')
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = WarehousePool(get_warehouse_resolver(host, token))
+        return pool
@@ -0,0 +1,260 @@
+"""
+SQL warehouse resolution with a TTL-cached choice and background state refresh.
+
+Resolving a warehouse used to cost a /api/2.0/sql/warehouses call before every
+ai_query. The resolver keeps the last listing for DATABRICKS_WAREHOUSE_TTL
+seconds, refreshes warehouse states in a background thread, and honours a pinned
+DATABRICKS_WAREHOUSE_ID. The cached choice is only dropped when a statement
+fails with a warehouse error: one naming the warehouse as missing, stopped or
+deleted, not a model endpoint or table error that merely "does not exist".
+"""
+import os
+import re
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from backend.src.http_session import DatabricksHTTPSession, get_http_session
+
+logger = logging.getLogger(__name__)
+
+# Messages naming the warehouse (formerly "SQL endpoint") as gone or not running;
+# serving endpoint, table and function errors don't match
+WAREHOUSE_ERROR_PATTERN = re.compile(
+    r"\b(?:sql\s+)?warehouse\b[^.]{0,80}?\b(?:does not exist|not found|is not running|"
+    r"(?:is|was|has been) (?:stopped|deleted))"
+    r"|\bsql\s+endpoint\b[^.]{0,80}?\b(?:does not exist|not found|is not running|(?:is|was|has been) stopped)",
+    re.IGNORECASE
+)
+# Error codes that point at the warehouse when the message refers to one
+WAREHOUSE_ERROR_CODES = {"RESOURCE_DOES_NOT_EXIST", "NOT_FOUND", "INVALID_STATE"}
+
+# Preference order when no warehouse is pinned
+STATE_PREFERENCE = ["RUNNING", "STARTING", "STOPPING", "STOPPED"]
+
+
+def is_warehouse_error(error: Any, error_code: Optional[str] = None) -> bool:
+    """
+    Return True if an error points at the warehouse rather than the query.
+
+    Args:
+        error: Error message (or response body)
+        error_code: Databricks error code of the failure, when known
+    """
+    if not error:
+        return False
+    message = str(error)
+    if WAREHOUSE_ERROR_PATTERN.search(message):
+        return True
+    code = str(getattr(error_code, 'value', error_code) or "").upper()
+    return code in WAREHOUSE_ERROR_CODES and "warehouse" in message.lower()
+
+
+class WarehouseResolver:
+    """Resolves and caches the SQL warehouse used for statements."""
+
+    def __init__(self, host: str, token: str, session: Optional[DatabricksHTTPSession] = None,
+                 ttl_seconds: float = None, refresh_interval: float = None,
+                 pinned_warehouse_id: str = None):
+        """
+        Initialize the resolver.
+
+        Args:
+            host: Databricks workspace URL
+            token: Personal access token
+            session: Shared HTTP session (defaults to the process-wide session)
+            ttl_seconds: How long a warehouse listing is trusted (DATABRICKS_WAREHOUSE_TTL, default 300)
+            refresh_interval: Background state refresh period (DATABRICKS_WAREHOUSE_REFRESH, default 60)
+            pinned_warehouse_id: Always use this warehouse (DATABRICKS_WAREHOUSE_ID)
+        """
+        self.host = host.rstrip('/')
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.session = session
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv('DATABRICKS_WAREHOUSE_TTL', 300))
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(os.getenv('DATABRICKS_WAREHOUSE_REFRESH', 60))
+        self.pinned_warehouse_id = pinned_warehouse_id or os.getenv('DATABRICKS_WAREHOUSE_ID') or None
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._warehouses: List[Dict[str, Any]] = []
+        self._chosen_id: Optional[str] = None
+        self._fetched_at = 0.0
+        self._stop_event = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stats = {'hits': 0, 'refreshes': 0, 'invalidations': 0, 'refresh_errors': 0}
+
+    def _session(self) -> DatabricksHTTPSession:
+        return self.session or get_http_session()
+
+    def _fetch_warehouses(self) -> List[Dict[str, Any]]:
+        url = f"{self.host}/api/2.0/sql/warehouses"
+        res = self._session().get(url, headers=self.headers, timeout=10)
+        res.raise_for_status()
+        return res.json().get("warehouses", [])
+
+    def _choose(self, warehouses: List[Dict[str, Any]]) -> Optional[str]:
+        if self.pinned_warehouse_id:
+            return self.pinned_warehouse_id
+        if not warehouses:
+            return None
+
+        # Keep the current choice while it is still healthy to avoid flapping
+        for w in warehouses:
+            if w.get("id") == self._chosen_id and w.get("state") in ("RUNNING", "STARTING"):
+                return self._chosen_id
+
+        for state in STATE_PREFERENCE:
+            for w in warehouses:
+                if w.get("state") == state:
+                    return w["id"]
+
+        # Fallback to first
+        return warehouses[0]["id"]
+
+    def refresh(self) -> Optional[str]:
+        """
+        Re-list warehouses and update the cached states and choice.
+
+        Returns:
+            The chosen warehouse ID (or None if none are available)
+        """
+        warehouses = self._fetch_warehouses()
+        with self._lock:
+            self._warehouses = warehouses
+            self._chosen_id = self._choose(warehouses)
+            self._fetched_at = time.time()
+            self._stats['refreshes'] += 1
+            return self._chosen_id
+
+    def resolve(self) -> str:
+        """
+        Return the warehouse ID to run statements on.
+
+        Uses the pinned ID or the cached choice while it is fresh, and only lists
+        warehouses when the cache is empty, expired or invalidated.
+        """
+        self._ensure_background_refresh()
+
+        if self.pinned_warehouse_id:
+            return self.pinned_warehouse_id
+
+        cached_id = self._cached_choice()
+        if cached_id:
+            return cached_id
+
+        # Single-flight: concurrent callers wait for one listing instead of each making one
+        with self._refresh_lock:
+            cached_id = self._cached_choice()
+            if cached_id:
+                return cached_id
+            warehouse_id = self.refresh()
+
+        if not warehouse_id:
+            raise RuntimeError("No SQL warehouses available")
+        return warehouse_id
+
+    def _cached_choice(self) -> Optional[str]:
+        with self._lock:
+            if self._chosen_id and time.time() - self._fetched_at < self.ttl_seconds:
+                self._stats['hits'] += 1
+                return self._chosen_id
+        return None
+
+    def is_fresh(self) -> bool:
+        """Return True if the cached listing is younger than the TTL and not invalidated."""
+        with self._lock:
+            return self._fetched_at > 0 and time.time() - self._fetched_at < self.ttl_seconds
+
+    def get_state(self, warehouse_id: str) -> Optional[str]:
+        """Return the last known state of a warehouse from the cached listing."""
+        with self._lock:
+            for w in self._warehouses:
+                if w.get("id") == warehouse_id:
+                    return w.get("state")
+        return None
+
+    def invalidate(self, reason: str = ""):
+        """Drop the cached choice so the next resolve() lists warehouses again."""
+        with self._lock:
+            self._chosen_id = None
+            self._fetched_at = 0.0
+            self._stats['invalidations'] += 1
+        logger.warning(f"Warehouse cache invalidated: {reason}")
+
+    def report_error(self, error: Any, error_code: Optional[str] = None) -> bool:
+        """
+        Invalidate the cache if a statement error points at the warehouse.
+
+        Args:
+            error: Error message (or response body)
+            error_code: Databricks error code of the failure, when known
+
+        Returns:
+            True if the cache was invalidated
+        """
+        if is_warehouse_error(error, error_code):
+            self.invalidate(str(error))
+            return True
+        return False
+
+    def _ensure_background_refresh(self):
+        if self.refresh_interval <= 0:
+            return
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_loop, name="warehouse-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                with self._lock:
+                    self._stats['refresh_errors'] += 1
+                logger.debug(f"Background warehouse refresh failed: {e}")
+
+    def stop(self):
+        """Stop the background refresh thread."""
+        self._stop_event.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return the cached choice, warehouse states and cache counters."""
+        with self._lock:
+            return {
+                'chosen_warehouse_id': self.pinned_warehouse_id or self._chosen_id,
+                'pinned': bool(self.pinned_warehouse_id),
+                'cache_age_seconds': round(time.time() - self._fetched_at, 1) if self._fetched_at else None,
+                'ttl_seconds': self.ttl_seconds,
+                'warehouses': [{'id': w.get('id'), 'state': w.get('state')} for w in self._warehouses],
+                **self._stats
+            }
+
+
+_resolvers: Dict[str, WarehouseResolver] = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_warehouse_resolver(host: str, token: str) -> WarehouseResolver:
+    """Return the shared resolver for a workspace, creating it on first use."""
+    key = host.rstrip('/')
+    with _resolvers_lock:
+        resolver = _resolvers.get(key)
+        if resolver is None:
+            resolver = WarehouseResolver(host, token)
+            _resolvers[key] = resolver
+        return resolver
+
+
+def stop_warehouse_resolvers():
+    """Stop all background refresh threads (called from the application lifespan)."""
+    with _resolvers_lock:
+        for resolver in _resolvers.values():
+            resolver.stop()
@@ -0,0 +1,472 @@
+"""
+Warehouse pre-warming and keep-warm probes.
+
+A stopped SQL warehouse used to be discovered only when the first statement of
+the day ran, and that user waited out the cold start. The warmer starts the
+warehouse (every member of the warehouse pool, if one is configured) as soon
+as the app is set up or an upload begins, follows it until it is RUNNING
+(refreshing the resolver's cached state so statements see it), and during
+business hours sends a cheap SELECT 1 now and then so auto-stop doesn't shut
+it down between users. Probes take a slot in the warehouse's limiter like any
+statement, and are skipped while its circuit breaker is open or statements
+are already keeping it busy. Warm-up requests are handled by one background
+thread and never block the caller.
+
+    WAREHOUSE_KEEPALIVE_HOURS      business hours for keep-alive probes, e.g. 08:00-18:00 (default off, 00:00-00:00 all day)
+    WAREHOUSE_KEEPALIVE_DAYS       days the hours apply to, e.g. mon-fri or mon,wed (default mon-fri)
+    WAREHOUSE_KEEPALIVE_INTERVAL   seconds between keep-alive probes (default 300)
+    WAREHOUSE_START_POLL           seconds between state checks while the warehouse starts (default 5)
+    WAREHOUSE_START_TIMEOUT        how long to follow a start before giving up (default 600)
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, time as dt_time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from backend.src.http_session import DatabricksHTTPSession, get_http_session
+from backend.src.statement_waiter import get_statement_waiter
+from backend.src.warehouse_limiter import CircuitOpenError, get_warehouse_limiter
+from backend.src.warehouse_pool import get_warehouse_pool
+from backend.src.warehouse_resolver import WarehouseResolver, get_warehouse_resolver
+from backend.utils.retry_helper import classify_error, classify_statement_result
+
+logger = logging.getLogger(__name__)
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+WARM_STATES = ("RUNNING",)
+STARTING_STATES = ("STARTING",)
+# Polls a warehouse may still report STOPPED after a start was queued behind its stop
+START_GRACE_POLLS = 2
+PROBE_TIMEOUT = 60.0
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+def parse_business_hours(hours: Optional[str]) -> Optional[Tuple[dt_time, dt_time]]:
+    """
+    Parse 'HH:MM-HH:MM' into (start, end) times.
+
+    Returns:
+        The window, or None if hours is empty or malformed (keep-alive disabled)
+    """
+    if not hours or not hours.strip():
+        return None
+    try:
+        start, end = (part.strip() for part in hours.split("-", 1))
+        return (datetime.strptime(start, "%H:%M").time(), datetime.strptime(end, "%H:%M").time())
+    except ValueError:
+        logger.warning(f"Invalid WAREHOUSE_KEEPALIVE_HOURS '{hours}', keep-alive disabled")
+        return None
+
+
+def parse_business_days(days: Optional[str]) -> Set[int]:
+    """Parse 'mon-fri' or 'mon,wed,fri' into weekday numbers (Monday is 0)."""
+    result: Set[int] = set()
+    for part in (days or "mon-fri").lower().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = (DAY_NAMES.index(p.strip()[:3]) for p in part.split("-", 1))
+                result.update(range(first, last + 1) if first <= last else list(range(first, 7)) + list(range(0, last + 1)))
+            else:
+                result.add(DAY_NAMES.index(part[:3]))
+        except ValueError:
+            logger.warning(f"Ignoring invalid day '{part}' in WAREHOUSE_KEEPALIVE_DAYS")
+    return result
+
+
+class WarehouseWarmer:
+    """Starts the warehouses statements go to ahead of queries and keeps them warm during business hours."""
+
+    def __init__(self, host: str, token: str, resolver: Optional[WarehouseResolver] = None,
+                 session: Optional[DatabricksHTTPSession] = None, business_hours: Optional[str] = None,
+                 business_days: Optional[str] = None, keepalive_interval: Optional[float] = None,
+                 start_poll: Optional[float] = None, start_timeout: Optional[float] = None):
+        """
+        Initialize the warmer.
+
+        Args:
+            host: Databricks workspace URL
+            token: Personal access token
+            resolver: Warehouse resolver whose choice and cached states are used
+            session: Shared HTTP session (defaults to the process-wide session)
+            business_hours: Keep-alive window 'HH:MM-HH:MM' (WAREHOUSE_KEEPALIVE_HOURS, default off)
+            business_days: Days the window applies to (WAREHOUSE_KEEPALIVE_DAYS, default mon-fri)
+            keepalive_interval: Seconds between keep-alive probes (WAREHOUSE_KEEPALIVE_INTERVAL, default 300)
+            start_poll: Seconds between state checks while starting (WAREHOUSE_START_POLL, default 5)
+            start_timeout: How long to follow a start (WAREHOUSE_START_TIMEOUT, default 600)
+        """
+        self.host = host.rstrip('/')
+        self.token = token
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.resolver = resolver or get_warehouse_resolver(host, token)
+        self.session = session
+        self.business_hours = parse_business_hours(
+            business_hours if business_hours is not None else os.getenv('WAREHOUSE_KEEPALIVE_HOURS'))
+        self.business_days = parse_business_days(
+            business_days if business_days is not None else os.getenv('WAREHOUSE_KEEPALIVE_DAYS'))
+        self.keepalive_interval = (keepalive_interval if keepalive_interval is not None
+                                   else _env_float('WAREHOUSE_KEEPALIVE_INTERVAL', 300))
+        self.start_poll = start_poll if start_poll is not None else _env_float('WAREHOUSE_START_POLL', 5)
+        self.start_timeout = start_timeout if start_timeout is not None else _env_float('WAREHOUSE_START_TIMEOUT', 600)
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pending_reason: Optional[str] = None
+        self._warming_since: Optional[float] = None
+        self._states: Dict[str, Optional[str]] = {}
+        self._last_warm_request: Optional[float] = None
+        self._last_start_sent: Optional[float] = None
+        self._last_running: Optional[float] = None
+        self._last_probe: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._stats = {'warm_requests': 0, 'starts_sent': 0, 'probes': 0, 'probe_errors': 0,
+                       'probes_skipped': 0, 'cold_starts': 0, 'cold_start_seconds_total': 0.0}
+
+    def _session(self) -> DatabricksHTTPSession:
+        return self.session or get_http_session()
+
+    def request_warm(self, reason: str = "") -> Dict[str, Any]:
+        """
+        Ask for the warehouse to be started if it isn't running; returns immediately.
+
+        Args:
+            reason: Why warming was requested (setup, upload, ...), used in logs
+
+        Returns:
+            The current warm/cold status
+        """
+        with self._lock:
+            self._stats['warm_requests'] += 1
+            self._last_warm_request = time.time()
+            self._pending_reason = reason or self._pending_reason or "request"
+        self._ensure_thread()
+        self._wake.set()
+        return self.status()
+
+    def keepalive_active(self, now: Optional[datetime] = None) -> bool:
+        """Return True if keep-alive probes are configured and now is within business hours."""
+        if self.business_hours is None or self.keepalive_interval <= 0:
+            return False
+        now = now or datetime.now()
+        if now.weekday() not in self.business_days:
+            return False
+        start, end = self.business_hours
+        current = now.time()
+        if start == end:
+            # e.g. 00:00-00:00, all day
+            return True
+        if start < end:
+            return start <= current < end
+        # Window wraps past midnight
+        return current >= start or current < end
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="warehouse-warmer", daemon=True)
+            self._thread.start()
+
+    def start_keepalive(self):
+        """Start the background thread so keep-alive probes run without waiting for a warm request."""
+        if self.business_hours is not None:
+            self._ensure_thread()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # Cleared before reading the pending request so a request_warm() arriving mid-work isn't slept through
+            self._wake.clear()
+            with self._lock:
+                reason = self._pending_reason
+                self._pending_reason = None
+            failed = False
+            try:
+                if reason:
+                    self._warm(reason)
+                elif self.keepalive_active() and self._probe_due():
+                    self._probe()
+            except Exception as e:
+                failed = True
+                with self._lock:
+                    self._last_error = str(e)
+                    # Nothing follows the start any more; the next warm request retries it
+                    self._warming_since = None
+                logger.warning(f"Warehouse warm-up failed: {e}")
+
+            self._wake.wait(self._next_wait(failed))
+
+    def _next_wait(self, failed: bool = False) -> float:
+        with self._lock:
+            warming = self._warming_since is not None
+            last_probe = self._last_probe
+        if warming:
+            wait = self.start_poll
+        elif self.keepalive_active():
+            wait = 0.0 if last_probe is None else last_probe + self.keepalive_interval - time.time()
+        else:
+            # Re-check business hours every minute
+            wait = 60.0
+        # Back off after an error instead of listing warehouses again straight away
+        return max(wait, self.start_poll if failed else 0.0, 1.0)
+
+    def _probe_due(self) -> bool:
+        with self._lock:
+            return self._last_probe is None or time.time() - self._last_probe >= self.keepalive_interval
+
+    def _refresh_state(self, use_cache: bool = False) -> Dict[str, Optional[str]]:
+        """
+        Return the state of every warehouse statements can go to.
+
+        Args:
+            use_cache: Trust the resolver's fresh listing when every warehouse in it
+                is RUNNING; otherwise (and by default) re-list warehouses
+        """
+        pool = get_warehouse_pool(self.host, self.token)
+        states = None
+        if use_cache and self.resolver.is_fresh():
+            # resolve() answers from the fresh cache without a listing
+            warehouse_ids = pool.members() if pool.configured else [self.resolver.resolve()]
+            states = {warehouse_id: self.resolver.get_state(warehouse_id) for warehouse_id in warehouse_ids}
+            if not all(state in WARM_STATES for state in states.values()):
+                states = None
+
+        if states is None:
+            # Also updates the cached states every statement checks before it runs
+            chosen = self.resolver.refresh()
+            warehouse_ids = pool.members() if pool.configured else [chosen] if chosen else []
+            if not warehouse_ids:
+                raise RuntimeError("No SQL warehouses available")
+            states = {warehouse_id: self.resolver.get_state(warehouse_id) for warehouse_id in warehouse_ids}
+        with self._lock:
+            self._states = states
+            if any(state in WARM_STATES for state in states.values()):
+                self._last_running = time.time()
+        return states
+
+    def _send_start(self, warehouse_id: str):
+        url = f"{self.host}/api/2.0/sql/warehouses/{warehouse_id}/start"
+        res = self._session().post(url, headers=self.headers, timeout=10)
+        res.raise_for_status()
+        with self._lock:
+            self._stats['starts_sent'] += 1
+            self._last_start_sent = time.time()
+
+    def _warm(self, reason: str):
+        """Start every warehouse that isn't running and follow them until they are."""
+        # Warm requests come with every upload; only list when the cache isn't fresh and RUNNING
+        states = self._refresh_state(use_cache=True)
+        cold = {w: state for w, state in states.items() if state not in WARM_STATES}
+        if not cold:
+            with self._lock:
+                self._warming_since = None
+            return
+
+        with self._lock:
+            first = self._warming_since is None
+            if first:
+                self._warming_since = time.time()
+        if first:
+            logger.info(f"Warming warehouses {cold} for {reason}")
+
+        for warehouse_id, state in cold.items():
+            if state not in STARTING_STATES:
+                # STOPPED, or STOPPING: a start queued behind the stop brings it straight back
+                self._send_start(warehouse_id)
+        # _follow re-lists on its first poll, which updates the resolver's cached states
+        self._follow()
+
+    def _follow(self):
+        """Poll warehouse states until all are RUNNING, one stops again or start_timeout passes."""
+        with self._lock:
+            warming_since = self._warming_since
+        grace: Dict[str, int] = {}
+        while warming_since is not None and not self._stop_event.is_set():
+            if self._stop_event.wait(self.start_poll):
+                return
+            states = self._refresh_state()
+            cold = {w: state for w, state in states.items() if state not in WARM_STATES}
+            if not cold:
+                elapsed = time.time() - warming_since
+                with self._lock:
+                    self._warming_since = None
+                    self._stats['cold_starts'] += 1
+                    self._stats['cold_start_seconds_total'] += elapsed
+                logger.info(f"Warehouses {list(states)} warm after {elapsed:.0f}s")
+                return
+            failed = {}
+            for warehouse_id, state in cold.items():
+                if state in STARTING_STATES:
+                    continue
+                if state == "STOPPING":
+                    # The queued start runs once the stop finishes
+                    grace[warehouse_id] = START_GRACE_POLLS
+                    continue
+                remaining = grace.get(warehouse_id, START_GRACE_POLLS)
+                if state == "STOPPED" and remaining > 0:
+                    grace[warehouse_id] = remaining - 1
+                    continue
+                failed[warehouse_id] = state
+            if failed or time.time() - warming_since > self.start_timeout:
+                with self._lock:
+                    self._warming_since = None
+                    self._last_error = f"Warehouses did not start: {failed or cold}"
+                logger.warning(f"Warehouses did not become warm: {failed or cold}")
+                return
+
+    def _probe(self):
+        """Run SELECT 1 on every warehouse so their auto-stop idle timers restart."""
+        # Set before listing, so a failing listing waits keepalive_interval like a probe
+        with self._lock:
+            self._last_probe = time.time()
+            self._stats['probes'] += 1
+        states = self._refresh_state()
+        if any(state not in WARM_STATES for state in states.values()):
+            # Outside a cold start there is nothing to keep warm; start them for the day
+            self._warm("keep-alive")
+            return
+
+        pool = get_warehouse_pool(self.host, self.token)
+        waiter = get_statement_waiter(self.host, self.token)
+        probes = {}
+        for warehouse_id in states:
+            limiter = get_warehouse_limiter(warehouse_id)
+            if limiter.load() > 0:
+                # Statements in flight already restart the idle timer
+                self._probe_skipped(warehouse_id, "statements are running")
+                continue
+            try:
+                if not limiter.acquire(PROBE_TIMEOUT):
+                    raise TimeoutError(f"Timed out waiting for a statement slot on warehouse {warehouse_id}")
+            except CircuitOpenError as e:
+                self._probe_skipped(warehouse_id, str(e))
+                continue
+            except Exception as e:
+                self._probe_failed(warehouse_id, e)
+                continue
+            started_at = time.time()
+            try:
+                probes[warehouse_id] = (started_at, waiter.submit(warehouse_id, "SELECT 1", timeout=PROBE_TIMEOUT))
+            except Exception as e:
+                pool.release(warehouse_id, classify_error(e).kind, started_at)
+                self._probe_failed(warehouse_id, e)
+
+        for warehouse_id, (started_at, future) in probes.items():
+            # Probe outcomes feed the adaptive limit and circuit breaker like any statement
+            error_type = None
+            try:
+                result = future.result(timeout=PROBE_TIMEOUT)
+                if not result.get('success'):
+                    error_type = classify_statement_result(result, self.resolver.get_state(warehouse_id)).kind
+                    raise RuntimeError(result.get('error'))
+            except Exception as e:
+                error_type = error_type or classify_error(e).kind
+                self._probe_failed(warehouse_id, e)
+            finally:
+                pool.release(warehouse_id, error_type, started_at)
+
+    def _probe_skipped(self, warehouse_id: str, reason: str):
+        with self._lock:
+            self._stats['probes_skipped'] += 1
+        logger.info(f"Skipping keep-alive probe on warehouse {warehouse_id}: {reason}")
+
+    def _probe_failed(self, warehouse_id: str, error: Exception):
+        with self._lock:
+            self._stats['probe_errors'] += 1
+            self._last_error = str(error)
+        logger.warning(f"Keep-alive probe on warehouse {warehouse_id} failed: {error}")
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Return whether the warehouses are warm, for the frontend and metrics.
+
+        'status' is 'warm' (a warehouse is RUNNING), 'warming' (a start is being
+        followed or a warehouse is STARTING), 'cold' (all stopped) or 'unknown'
+        (not checked yet).
+        """
+        with self._lock:
+            states = dict(self._states)
+            warming_since = self._warming_since
+            stats = dict(self._stats)
+            info = {
+                'last_warm_request': self._last_warm_request,
+                'last_start_sent': self._last_start_sent,
+                'last_running': self._last_running,
+                'last_probe': self._last_probe,
+                'last_error': self._last_error,
+            }
+
+        # The resolver's background refresh may have seen newer states
+        states = {w: self.resolver.get_state(w) or state for w, state in states.items()}
+
+        if any(state in WARM_STATES for state in states.values()):
+            status = "warm"
+        elif warming_since is not None or any(state in STARTING_STATES for state in states.values()):
+            status = "warming"
+        elif any(states.values()):
+            status = "cold"
+        else:
+            status = "unknown"
+
+        stats['cold_start_seconds_total'] = round(stats['cold_start_seconds_total'], 1)
+        return {
+            'warehouse_id': next(iter(states), None),
+            'state': next(iter(states.values()), None),
+            'warehouses': states,
+            'status': status,
+            'warm': status == "warm",
+            'warming_for_seconds': round(time.time() - warming_since, 1) if warming_since else None,
+            'keepalive': {
+                'enabled': self.business_hours is not None,
+                'active': self.keepalive_active(),
+                'hours': ("-".join(t.strftime("%H:%M") for t in self.business_hours)
+                          if self.business_hours else None),
+                'days': [DAY_NAMES[d] for d in sorted(self.business_days)],
+                'interval_seconds': self.keepalive_interval,
+            },
+            **{k: (datetime.fromtimestamp(v).isoformat() if isinstance(v, float) else v) for k, v in info.items()},
+            **stats
+        }
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stop_event.set()
+        self._wake.set()
+
+
+_warmers: Dict[str, WarehouseWarmer] = {}
+_warmers_lock = threading.Lock()
+
+
+def get_warehouse_warmer(host: str, token: str) -> WarehouseWarmer:
+    """Return the shared warmer for a workspace, creating it on first use."""
+    key = host.rstrip('/')
+    with _warmers_lock:
+        warmer = _warmers.get(key)
+        if warmer is None:
+            warmer = _warmers[key] = WarehouseWarmer(host, token)
+        return warmer
+
+
+def stop_warehouse_warmers():
+    """Stop every warmer's background thread (called from the application lifespan)."""
+    with _warmers_lock:
+        warmers = list(_warmers.values())
+        _warmers.clear()
+    for warmer in warmers:
+        warmer.stop()
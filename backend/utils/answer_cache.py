@@ -0,0 +1,135 @@
+"""
+In-process cache of AI answers.
+
+Users re-run the same prompt sets against the same documents, so successful
+{answer, explanation} results are cached by document content hash, normalized
+prompt text, model name, model parameters and how the document context was
+built (query mode, context strategy and token budget), so an answer from a
+truncated context is never served to a full-context or map-reduce run. Entries expire after a TTL and
+the cache evicts least-recently-used entries beyond its size bound.
+
+    ANSWER_CACHE_ENABLED       turn the cache on/off (default true)
+    ANSWER_CACHE_TTL_SECONDS   entry lifetime (default 86400)
+    ANSWER_CACHE_MAX_ENTRIES   LRU bound (default 5000)
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so trivially different prompts share an entry."""
+    return " ".join((prompt or "").split()).casefold()
+
+
+def make_answer_key(content_hash: str, prompt: str, model: str,
+                    max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                    context: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the cache key for one (document, prompt, model, parameters, context) combination.
+
+    Args:
+        context: How the document context is built, e.g. query mode, context
+            strategy and token budget; answers built differently never share a key
+    """
+    raw = json.dumps([content_hash, normalize_prompt(prompt), model, max_tokens, temperature, context],
+                     sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """Thread-safe TTL + LRU cache of successful AI answers."""
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 86400):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum cached answers before LRU eviction
+            ttl_seconds: Seconds an answer stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached answer.
+
+        Returns:
+            Dict with 'answer', 'explanation' and 'age' in seconds, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            age = time.time() - entry['stored_at']
+            if age > self.ttl_seconds:
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return {'answer': entry['answer'], 'explanation': entry['explanation'], 'age': round(age, 1)}
+
+    def put(self, key: str, answer: Any, explanation: str):
+        """Store a successful answer."""
+        with self._lock:
+            self._entries[key] = {'answer': answer, 'explanation': explanation, 'stored_at': time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        """Drop every cached answer."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        return stats
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Return the process-wide answer cache, or None if disabled."""
+    global _cache
+    if os.getenv('ANSWER_CACHE_ENABLED', 'true').strip().lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    max_entries = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 5000))
+                    ttl_seconds = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', 86400))
+                except ValueError:
+                    logger.warning("Invalid ANSWER_CACHE_* values, using defaults")
+                    max_entries, ttl_seconds = 5000, 86400
+                _cache = AnswerCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return _cache
@@ -0,0 +1,137 @@
+"""
+Awaitable wrappers for blocking Databricks I/O.
+
+The Databricks SDK, requests and PyPDF2 are all synchronous. Endpoints hand that
+work to a dedicated, sized thread pool through run_blocking() so the asyncio
+event loop stays free to serve other requests.
+
+Statement work holds its thread while it queues for a warehouse slot and while
+the statement runs, so a batch or map-reduce fan-out could occupy every thread
+and starve uploads and text extraction. run_blocking_statement() waits for one
+of a bounded number of statement slots before taking a thread, leaving
+DATABRICKS_IO_RESERVED_THREADS threads for everything else.
+
+    DATABRICKS_IO_THREADS            I/O pool size (default 32)
+    DATABRICKS_IO_RESERVED_THREADS   threads statement work never takes (default 4, at most half the pool)
+"""
+import os
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IO_THREADS = 32
+DEFAULT_RESERVED_THREADS = 4
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_io_workers = 0
+_io_pool_lock = threading.Lock()
+# One semaphore per event loop (asyncio primitives are bound to their loop)
+_statement_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def get_io_pool() -> ThreadPoolExecutor:
+    """
+    Return the shared blocking-I/O thread pool, creating it on first use.
+
+    The pool size comes from the DATABRICKS_IO_THREADS env var.
+    """
+    global _io_pool, _io_workers
+    if _io_pool is None:
+        with _io_pool_lock:
+            if _io_pool is None:
+                try:
+                    workers = int(os.getenv('DATABRICKS_IO_THREADS', DEFAULT_IO_THREADS))
+                except ValueError:
+                    logger.warning("Invalid DATABRICKS_IO_THREADS value, using default")
+                    workers = DEFAULT_IO_THREADS
+                workers = max(1, workers)
+                _io_workers = workers
+                _io_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="databricks-io")
+                logger.info(f"Started Databricks I/O pool with {workers} threads")
+    return _io_pool
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking callable on the I/O pool and await its result.
+
+    Context variables are copied into the worker thread so request-scoped state
+    follows the call.
+
+    Args:
+        func: Blocking callable
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        Whatever func returns
+    """
+    return await _submit(func, *args, **kwargs)
+
+
+def _submit(func: Callable[..., Any], *args, **kwargs) -> "asyncio.Future[Any]":
+    """Start func on the I/O pool under a copy of the caller's context."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return loop.run_in_executor(get_io_pool(), call)
+
+
+def statement_slot_count() -> int:
+    """Return how many I/O threads statement work may hold at once."""
+    get_io_pool()
+    try:
+        reserved = int(os.getenv('DATABRICKS_IO_RESERVED_THREADS', DEFAULT_RESERVED_THREADS))
+    except ValueError:
+        logger.warning("Invalid DATABRICKS_IO_RESERVED_THREADS value, using default")
+        reserved = DEFAULT_RESERVED_THREADS
+    reserved = max(0, min(reserved, _io_workers // 2))
+    return max(1, _io_workers - reserved)
+
+
+async def run_blocking_statement(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    run_blocking() for calls that submit statements and wait on them.
+
+    Waits on the event loop for a statement slot before taking an I/O thread,
+    so queued statements never hold the threads uploads and extraction need.
+    The slot is held until the worker thread returns: cancelling the caller
+    (e.g. a short-circuited map step) does not stop the thread, so releasing
+    the slot earlier would let statement work take the reserved threads.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _statement_slots.get(loop)
+    if slots is None:
+        slots = _statement_slots[loop] = asyncio.Semaphore(statement_slot_count())
+    await slots.acquire()
+    try:
+        future = _submit(func, *args, **kwargs)
+    except BaseException:
+        slots.release()
+        raise
+
+    def release(done: "asyncio.Future[Any]"):
+        slots.release()
+        # Nobody awaits the result of a cancelled caller; retrieve it so it is not logged
+        if not done.cancelled():
+            done.exception()
+
+    future.add_done_callback(release)
+    return await asyncio.shield(future)
+
+
+def shutdown_io_pool(wait: bool = True):
+    """Shut down the I/O pool (called from the application lifespan)."""
+    global _io_pool
+    with _io_pool_lock:
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=wait)
+            _io_pool = None
+            logger.info("Databricks I/O pool shut down")
@@ -0,0 +1,105 @@
+"""
+Per-request deadline budgets.
+
+Each stage of an analysis (download, upload, extraction, queueing for a
+warehouse slot, statement submit and polling, retry waits) used to have its own
+fixed timeout, so one slow prompt with retries could run far past any sane
+response time. A Deadline is created once per request; stages take their
+timeouts from what is left of it, and the first stage that runs out of budget
+is recorded so the response can report it.
+"""
+import time
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """A stage could not run because the request's deadline budget is used up."""
+
+    def __init__(self, stage: str, budget: float):
+        super().__init__(f"Request deadline of {budget:g}s exhausted during {stage}")
+        self.stage = stage
+        self.budget = budget
+
+
+class Deadline:
+    """Time budget shared by every stage of one request."""
+
+    def __init__(self, seconds: float):
+        """
+        Initialize the deadline.
+
+        Args:
+            seconds: Total budget for the request
+        """
+        self.budget = seconds
+        self.started_at = time.time()
+        self.expires_at = self.started_at + seconds
+        self.exhausted_stage: Optional[str] = None
+        self._lock = threading.Lock()
+        self._active: List[str] = []
+        self._skipped: Dict[str, int] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        """The most recently entered stage that is still running."""
+        with self._lock:
+            return self._active[-1] if self._active else None
+
+    def timeout(self, stage: str, cap: Optional[float] = None) -> float:
+        """
+        Return how long a stage may take: the remaining budget, optionally capped.
+
+        Args:
+            stage: Stage name, recorded if the budget is already used up
+            cap: Upper bound for the stage (its old fixed timeout)
+
+        Raises:
+            DeadlineExceeded: If no budget is left
+        """
+        remaining = self.expires_at - time.time()
+        if remaining <= 0:
+            raise self.exhaust(stage)
+        return remaining if cap is None else min(cap, remaining)
+
+    def exhaust(self, stage: str) -> DeadlineExceeded:
+        """Record stage as the one that ran out of budget (the first one wins) and return the error."""
+        with self._lock:
+            if self.exhausted_stage is None:
+                self.exhausted_stage = stage
+        return DeadlineExceeded(stage, self.budget)
+
+    def skip(self, stage: str):
+        """Count work that was not started because it could not finish in time (e.g. a retry)."""
+        with self._lock:
+            self._skipped[stage] = self._skipped.get(stage, 0) + 1
+
+    def enter(self, stage: str):
+        with self._lock:
+            self._active.append(stage)
+
+    def leave(self, stage: str):
+        with self._lock:
+            # Remove the most recent entry; stages of concurrent prompts interleave
+            for i in range(len(self._active) - 1, -1, -1):
+                if self._active[i] == stage:
+                    del self._active[i]
+                    break
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            skipped = dict(self._skipped)
+        return {
+            'budget': self.budget,
+            'elapsed': round(time.time() - self.started_at, 2),
+            'remaining': round(self.remaining(), 2),
+            'exhausted_stage': self.exhausted_stage,
+            'skipped': skipped,
+        }
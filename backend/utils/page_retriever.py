@@ -0,0 +1,151 @@
+"""
+Lexical page retrieval for building per-prompt document context.
+
+Long policies used to be cut at 15,000 characters, so answers on late pages
+(endorsements, premium schedules) were never sent to the model. A BM25 index is
+built once per document over the extracted pages, and each prompt receives its
+top-scoring pages, in page order, up to the context budget.
+
+    AI_CONTEXT_STRATEGY    'retrieval' (default) or 'truncate'
+"""
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_STRATEGIES = ("retrieval", "truncate")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how if in is it its of on or
+that the this to was were what when where which who whom whose why will with within
+document policy mentioned listed stated provided please
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+class PageIndex:
+    """BM25 index over a document's pages."""
+
+    def __init__(self, pages: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        """
+        Build the index.
+
+        Args:
+            pages: Page dicts with 'page_number' and 'text' (as produced by extraction)
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+        """
+        self.pages = pages
+        self.k1 = k1
+        self.b = b
+
+        self._term_freqs = [Counter(tokenize(p['text'])) for p in pages]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+        document_freq = Counter()
+        for tf in self._term_freqs:
+            document_freq.update(tf.keys())
+        n = len(pages)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_freq.items()
+        }
+
+    def score(self, query: str) -> List[float]:
+        """Return the BM25 score of every page for a query."""
+        terms = set(tokenize(query))
+        scores = []
+        for tf, length in zip(self._term_freqs, self._lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * (length / self._avg_length if self._avg_length else 0))
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            scores.append(score)
+        return scores
+
+    def select_pages(self, query: str, budget: int,
+                     cost: Optional[Callable[[Dict[str, Any]], int]] = None) -> List[Dict[str, Any]]:
+        """
+        Pick the best-scoring pages that fit in the budget.
+
+        Pages are returned in document order. If nothing matches the query the
+        leading pages are used, which matches the old truncation behaviour.
+
+        Args:
+            query: Question to score pages against
+            budget: Total cost allowed for the selected pages
+            cost: Cost of one page (defaults to characters including its page marker)
+        """
+        if cost is None:
+            # Page marker and separators cost roughly this much on top of the text
+            cost = lambda page: len(page['text']) + 24
+
+        scores = self.score(query)
+        if any(scores):
+            order = sorted(range(len(self.pages)), key=lambda i: (-scores[i], i))
+        else:
+            order = list(range(len(self.pages)))
+
+        selected = []
+        used = 0
+        for i in order:
+            page = self.pages[i]
+            page_cost = cost(page)
+            if used + page_cost > budget:
+                if not selected:
+                    # Always send something; the caller trims an oversized best page
+                    selected.append(page)
+                    used += page_cost
+                continue
+            selected.append(page)
+            used += page_cost
+
+        selected.sort(key=lambda p: p['page_number'])
+        return selected
+
+
+def get_context_strategy() -> str:
+    """Return the configured context strategy."""
+    strategy = os.getenv('AI_CONTEXT_STRATEGY', 'retrieval').strip().lower()
+    if strategy not in CONTEXT_STRATEGIES:
+        logger.warning(f"Unknown AI_CONTEXT_STRATEGY '{strategy}', using retrieval")
+        strategy = 'retrieval'
+    return strategy
+
+
+_indexes: "OrderedDict[str, PageIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+MAX_CACHED_INDEXES = 32
+
+
+def get_page_index(content_hash: Optional[str], pages: List[Dict[str, Any]]) -> PageIndex:
+    """Return the index for a document, reusing one built for the same content hash."""
+    if not content_hash:
+        return PageIndex(pages)
+
+    with _indexes_lock:
+        index = _indexes.get(content_hash)
+        if index is not None:
+            _indexes.move_to_end(content_hash)
+            return index
+
+    index = PageIndex(pages)
+    with _indexes_lock:
+        _indexes[content_hash] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,117 @@
+"""
+A parsed PDF shared by validation, metadata and text extraction.
+
+Validation, metadata extraction, the text preview and the text extractors each
+used to build their own PyPDF2.PdfReader over the same bytes. A PDFDocument is
+created once per upload and handed to every stage; the reader, page count,
+encryption flag, metadata, content hash and per-page text are computed on
+first use and then reused. Documents served from the text cache are never
+parsed at all.
+"""
+import hashlib
+import threading
+from io import BytesIO
+from typing import Any, Dict, Optional, Union
+
+import PyPDF2
+
+
+def compute_content_hash(file_content: bytes) -> str:
+    """Return the SHA-256 hex digest used to identify a document's content."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+class PDFDocument:
+    """PDF bytes plus a lazily parsed reader and the values derived from it."""
+
+    def __init__(self, content: bytes, content_hash: Optional[str] = None):
+        """
+        Wrap PDF bytes without parsing them.
+
+        Args:
+            content: PDF file content as bytes
+            content_hash: Precomputed SHA-256 of content (computed on first use if omitted)
+        """
+        self.content = content
+        self._content_hash = content_hash
+        # PdfReader is not thread-safe; stages may run on different threads
+        self._lock = threading.RLock()
+        self._reader: Optional[PyPDF2.PdfReader] = None
+        self._parse_error: Optional[Exception] = None
+        self._page_count: Optional[int] = None
+        self._is_encrypted: Optional[bool] = None
+        self._metadata: Optional[Dict[str, Any]] = None
+        self._page_texts: Dict[int, str] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    @property
+    def content_hash(self) -> str:
+        if self._content_hash is None:
+            self._content_hash = compute_content_hash(self.content)
+        return self._content_hash
+
+    @property
+    def reader(self) -> PyPDF2.PdfReader:
+        """
+        The parsed reader, created on first access.
+
+        Raises:
+            Exception: The parse error, on this and every later access
+        """
+        with self._lock:
+            if self._reader is None:
+                if self._parse_error is not None:
+                    raise self._parse_error
+                try:
+                    self._reader = PyPDF2.PdfReader(BytesIO(self.content))
+                except Exception as e:
+                    self._parse_error = e
+                    raise
+            return self._reader
+
+    @property
+    def page_count(self) -> int:
+        with self._lock:
+            if self._page_count is None:
+                self._page_count = len(self.reader.pages)
+            return self._page_count
+
+    @property
+    def is_encrypted(self) -> bool:
+        with self._lock:
+            if self._is_encrypted is None:
+                self._is_encrypted = bool(self.reader.is_encrypted)
+            return self._is_encrypted
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """The document information dictionary ('/Title', '/Author', ...), empty if there is none."""
+        with self._lock:
+            if self._metadata is None:
+                self._metadata = dict(self.reader.metadata or {})
+            return self._metadata
+
+    def page_text(self, index: int) -> str:
+        """
+        Return the text of a page (0-based), extracting it on first request.
+
+        Raises:
+            Exception: If the page cannot be extracted (not cached, so a retry re-extracts)
+        """
+        with self._lock:
+            text = self._page_texts.get(index)
+            if text is None:
+                text = self._page_texts[index] = self.reader.pages[index].extract_text() or ""
+            return text
+
+
+def as_pdf_document(source: Union[bytes, PDFDocument], content_hash: Optional[str] = None) -> PDFDocument:
+    """Return source as a PDFDocument, wrapping raw bytes (callers may pass either)."""
+    if isinstance(source, PDFDocument):
+        if content_hash and source._content_hash is None:
+            source._content_hash = content_hash
+        return source
+    return PDFDocument(source, content_hash)
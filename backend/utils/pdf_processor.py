@@ -3,10 +3,10 @@ PDF processing utilities for validation, metadata extraction, and text processin
 """
 import os
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union
 from datetime import datetime
-import PyPDF2
-from io import BytesIO
+
+from backend.utils.pdf_document import PDFDocument, as_pdf_document, compute_content_hash
 
 logger = logging.getLogger(__name__)
 
@@ -23,17 +23,19 @@ class PDFProcessor:
         """
         self.max_file_size_bytes = max_file_size_mb * 1024 * 1024
     
-    def validate_pdf(self, file_content: bytes, filename: str) -> Dict[str, Any]:
+    def validate_pdf(self, file_content: Union[bytes, PDFDocument], filename: str) -> Dict[str, Any]:
         """
         Validate PDF file.
         
         Args:
-            file_content: PDF file content as bytes
+            file_content: PDF file content as bytes, or an already parsed PDFDocument
             filename: Original filename
             
         Returns:
             Dict with validation results
         """
+        document = as_pdf_document(file_content)
+        file_content = document.content
         validation_result = {
             'is_valid': False,
             'errors': [],
@@ -60,16 +62,14 @@ class PDFProcessor:
         
         # Try to read PDF content
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-            
             # Check if PDF has pages
-            if len(pdf_reader.pages) == 0:
+            if document.page_count == 0:
                 validation_result['errors'].append("PDF has no pages")
             else:
-                validation_result['page_count'] = len(pdf_reader.pages)
+                validation_result['page_count'] = document.page_count
             
             # Check if PDF is encrypted
-            if pdf_reader.is_encrypted:
+            if document.is_encrypted:
                 validation_result['warnings'].append("PDF is encrypted/password protected")
             
         except Exception as e:
@@ -80,16 +80,17 @@ class PDFProcessor:
         
         return validation_result
     
-    def extract_metadata(self, file_content: bytes) -> Dict[str, Any]:
+    def extract_metadata(self, file_content: Union[bytes, PDFDocument]) -> Dict[str, Any]:
         """
         Extract metadata from PDF file.
         
         Args:
-            file_content: PDF file content as bytes
+            file_content: PDF file content as bytes, or an already parsed PDFDocument
             
         Returns:
             Dict with extracted metadata
         """
+        document = as_pdf_document(file_content)
         metadata = {
             'title': None,
             'author': None,
@@ -99,20 +100,18 @@ class PDFProcessor:
             'creation_date': None,
             'modification_date': None,
             'page_count': 0,
-            'file_size': len(file_content),
+            'file_size': document.size,
             'is_encrypted': False
         }
         
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-            
             # Basic info
-            metadata['page_count'] = len(pdf_reader.pages)
-            metadata['is_encrypted'] = pdf_reader.is_encrypted
+            metadata['page_count'] = document.page_count
+            metadata['is_encrypted'] = document.is_encrypted
             
             # Document metadata
-            if pdf_reader.metadata:
-                pdf_metadata = pdf_reader.metadata
+            if document.metadata:
+                pdf_metadata = document.metadata
                 metadata['title'] = pdf_metadata.get('/Title')
                 metadata['author'] = pdf_metadata.get('/Author')
                 metadata['subject'] = pdf_metadata.get('/Subject')
@@ -144,17 +143,18 @@ class PDFProcessor:
         
         return metadata
     
-    def extract_text_preview(self, file_content: bytes, max_pages: int = 3) -> Dict[str, Any]:
+    def extract_text_preview(self, file_content: Union[bytes, PDFDocument], max_pages: int = 3) -> Dict[str, Any]:
         """
         Extract text preview from first few pages of PDF.
         
         Args:
-            file_content: PDF file content as bytes
+            file_content: PDF file content as bytes, or an already parsed PDFDocument
             max_pages: Maximum number of pages to extract text from
             
         Returns:
             Dict with extracted text and page information
         """
+        document = as_pdf_document(file_content)
         result = {
             'text_preview': '',
             'pages_processed': 0,
@@ -163,16 +163,14 @@ class PDFProcessor:
         }
         
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-            result['total_pages'] = len(pdf_reader.pages)
+            result['total_pages'] = document.page_count
             
             text_parts = []
-            pages_to_process = min(max_pages, len(pdf_reader.pages))
+            pages_to_process = min(max_pages, document.page_count)
             
             for i in range(pages_to_process):
                 try:
-                    page = pdf_reader.pages[i]
-                    page_text = page.extract_text()
+                    page_text = document.page_text(i)
                     if page_text.strip():
                         text_parts.append(f"--- Page {i+1} ---\n{page_text}\n")
                         result['pages_processed'] += 1
@@ -187,21 +185,25 @@ class PDFProcessor:
         
         return result
     
-    def prepare_for_upload(self, file_content: bytes, filename: str, 
+    def prepare_for_upload(self, file_content: Union[bytes, PDFDocument], filename: str, 
                           workspace_path: str = None) -> Dict[str, Any]:
         """
         Prepare PDF file for upload to Databricks.
         
         Args:
-            file_content: PDF file content as bytes
+            file_content: PDF file content as bytes, or an already parsed PDFDocument
             filename: Original filename
             workspace_path: Target workspace path
             
         Returns:
             Dict with preparation results and upload information
         """
+        # Parse once; validation and metadata share the reader
+        document = as_pdf_document(file_content)
+        file_content = document.content
+
         # Validate the PDF
-        validation = self.validate_pdf(file_content, filename)
+        validation = self.validate_pdf(document, filename)
         if not validation['is_valid']:
             return {
                 'ready_for_upload': False,
@@ -209,7 +211,7 @@ class PDFProcessor:
             }
         
         # Extract metadata
-        metadata = self.extract_metadata(file_content)
+        metadata = self.extract_metadata(document)
         
         # Generate workspace path if not provided
         if not workspace_path:
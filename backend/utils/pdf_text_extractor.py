@@ -0,0 +1,190 @@
+"""
+Page-level PDF text extraction with an optional process pool.
+
+PyPDF2's page.extract_text() is pure Python and GIL-bound, so long documents
+are split into page ranges that are extracted in worker processes and then
+reassembled in page order. Small documents stay on the in-process path, where
+starting work in another process would cost more than it saves.
+
+    PDF_EXTRACTION_WORKERS   worker processes (default: CPU count)
+    PDF_PARALLEL_MIN_PAGES   smallest page count sent to the pool (default 40)
+"""
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import PyPDF2
+
+from backend.utils.pdf_document import PDFDocument, as_pdf_document
+from backend.utils.text_cache import get_text_cache
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction output changes so cached text is not reused across versions
+EXTRACTOR_VERSION = f"pypdf2-{PyPDF2.__version__}-1"
+
+DEFAULT_MIN_PARALLEL_PAGES = 40
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _extract_page_range(file_content: bytes, start: int, end: int) -> List[Tuple[int, str, Optional[str]]]:
+    """
+    Extract pages [start, end) from a PDF (runs inside a worker process).
+
+    Returns:
+        List of (page_index, text, error) tuples
+    """
+    document = PDFDocument(file_content)
+    return [_extract_one(document, i) for i in range(start, end)]
+
+
+def _extract_one(document: PDFDocument, index: int) -> Tuple[int, str, Optional[str]]:
+    try:
+        return index, document.page_text(index), None
+    except Exception as e:
+        return index, "", str(e)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+def get_extraction_pool() -> Tuple[ProcessPoolExecutor, int]:
+    """Return the shared extraction process pool and its size, creating it on first use."""
+    global _pool, _pool_workers
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool_workers = max(1, _env_int('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1))
+                # spawn avoids forking a process that already runs I/O threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=_pool_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                logger.info(f"Started PDF extraction pool with {_pool_workers} processes")
+    return _pool, _pool_workers
+
+
+def shutdown_extraction_pool(wait: bool = True):
+    """Shut down the extraction pool (called from the application lifespan)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+            _pool = None
+            logger.info("PDF extraction pool shut down")
+
+
+def format_pages(pages: List[Dict[str, Any]]) -> str:
+    """Join page dicts into the '--- Page N ---' text layout sent to the model."""
+    return '\n'.join(f"--- Page {p['page_number']} ---\n{p['text']}\n" for p in pages)
+
+
+class PDFTextExtractor:
+    """Extracts per-page text, fanning long documents out over the process pool."""
+
+    def __init__(self, min_parallel_pages: Optional[int] = None):
+        """
+        Initialize the extractor.
+
+        Args:
+            min_parallel_pages: Smallest page count that uses the process pool
+                (defaults to PDF_PARALLEL_MIN_PAGES)
+        """
+        if min_parallel_pages is None:
+            min_parallel_pages = _env_int('PDF_PARALLEL_MIN_PAGES', DEFAULT_MIN_PARALLEL_PAGES)
+        self.min_parallel_pages = min_parallel_pages
+
+    def extract_pages(self, file_content: Union[bytes, PDFDocument], content_hash: Optional[str] = None,
+                      use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Extract text from every page, reusing the on-disk text cache when possible.
+
+        Args:
+            file_content: PDF file content as bytes, or the upload's PDFDocument
+                (a cache hit never parses it)
+            content_hash: Precomputed SHA-256 of file_content (computed if omitted)
+            use_cache: Whether to read/write the persistent text cache
+
+        Returns:
+            Dict with 'total_pages', 'pages' (non-empty pages as {page_number, text,
+            char_count}, in page order), 'content_hash' and 'method'
+            ('cache', 'in_process' or 'process_pool').
+            Raises if the PDF cannot be parsed at all.
+        """
+        document = as_pdf_document(file_content, content_hash)
+        text_cache = get_text_cache() if use_cache else None
+        if text_cache is not None:
+            content_hash = document.content_hash
+            cached = text_cache.get(content_hash, EXTRACTOR_VERSION)
+            if cached is not None:
+                logger.info(f"Extracted text cache hit for {content_hash[:12]}")
+                return {**cached, 'content_hash': content_hash, 'method': 'cache'}
+
+        extraction = self._extract_uncached(document)
+        extraction['content_hash'] = content_hash
+
+        if text_cache is not None and extraction['pages']:
+            text_cache.put(content_hash, EXTRACTOR_VERSION, extraction['total_pages'], extraction['pages'])
+
+        return extraction
+
+    def _extract_uncached(self, document: PDFDocument) -> Dict[str, Any]:
+        total_pages = document.page_count
+
+        if total_pages >= self.min_parallel_pages and self.min_parallel_pages > 0:
+            try:
+                raw_pages = self._extract_parallel(document.content, total_pages)
+                method = 'process_pool'
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # Recreate the pool on the next call instead of failing forever
+                    shutdown_extraction_pool(wait=False)
+                logger.warning(f"Parallel extraction failed, falling back to in-process: {str(e)}")
+                raw_pages = [_extract_one(document, i) for i in range(total_pages)]
+                method = 'in_process'
+        else:
+            raw_pages = [_extract_one(document, i) for i in range(total_pages)]
+            method = 'in_process'
+
+        pages = []
+        for index, page_text, error in raw_pages:
+            if error:
+                logger.warning(f"Failed to extract text from page {index+1}: {error}")
+                continue
+            if page_text.strip():
+                pages.append({
+                    'page_number': index + 1,
+                    'text': page_text,
+                    'char_count': len(page_text)
+                })
+
+        return {'total_pages': total_pages, 'pages': pages, 'method': method}
+
+    def _extract_parallel(self, file_content: bytes, total_pages: int) -> List[Tuple[int, str, Optional[str]]]:
+        pool, workers = get_extraction_pool()
+
+        # A couple of ranges per worker keeps workers busy when page costs differ
+        range_count = min(total_pages, workers * 2)
+        range_size = -(-total_pages // range_count)
+        ranges = [(start, min(start + range_size, total_pages))
+                  for start in range(0, total_pages, range_size)]
+
+        logger.info(f"Extracting {total_pages} pages in {len(ranges)} ranges on {workers} processes")
+        futures = [pool.submit(_extract_page_range, file_content, start, end) for start, end in ranges]
+
+        raw_pages = []
+        for future in futures:
+            raw_pages.extend(future.result())
+        return raw_pages
@@ -0,0 +1,140 @@
+"""
+Bounded-concurrency executor for fanning prompts out to the SQL warehouse.
+"""
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.utils.async_io import run_blocking_statement
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT_CONCURRENCY = 4
+MAX_PROMPT_CONCURRENCY = 32
+
+
+def resolve_concurrency(requested: Optional[int] = None) -> int:
+    """
+    Resolve the number of prompts that may run at the same time.
+
+    Args:
+        requested: Per-request override (falls back to PROMPT_CONCURRENCY env var)
+
+    Returns:
+        Concurrency clamped to [1, MAX_PROMPT_CONCURRENCY]
+    """
+    if requested is None:
+        try:
+            requested = int(os.getenv('PROMPT_CONCURRENCY', DEFAULT_PROMPT_CONCURRENCY))
+        except ValueError:
+            logger.warning("Invalid PROMPT_CONCURRENCY value, using default")
+            requested = DEFAULT_PROMPT_CONCURRENCY
+
+    return max(1, min(int(requested), MAX_PROMPT_CONCURRENCY))
+
+
+class PromptExecutor:
+    """Runs one callable per prompt on a bounded thread pool, preserving input order."""
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        """
+        Initialize the prompt executor.
+
+        Args:
+            max_concurrency: Maximum prompts in flight (defaults to PROMPT_CONCURRENCY env var)
+        """
+        self.max_concurrency = resolve_concurrency(max_concurrency)
+        # Shared across arun() calls, so one executor can bound several documents at once
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """
+        The slots arun() draws from, created on first use (inside the event loop).
+
+        Callers that query outside arun() (batch statements, map-reduce prompts)
+        acquire it too, so every document sharing this executor stays within
+        max_concurrency.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def run(self, prompts: List[Dict[str, Any]],
+            handler: Callable[[Dict[str, Any]], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Execute handler for every prompt and collect the results.
+
+        Args:
+            prompts: List of prompt dicts ({title, prompt})
+            handler: Callable that analyzes a single prompt and returns a result dict
+
+        Returns:
+            List of result dicts in the same order as prompts
+        """
+        if not prompts:
+            return []
+
+        workers = min(self.max_concurrency, len(prompts))
+        logger.info(f"Running {len(prompts)} prompts with concurrency {workers}")
+
+        if workers == 1:
+            return [self.run_one(handler, prompt) for prompt in prompts]
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prompt") as pool:
+            futures = [pool.submit(self.run_one, handler, prompt) for prompt in prompts]
+            return [future.result() for future in futures]
+
+    async def arun(self, prompts: List[Dict[str, Any]],
+                   handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                   on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Awaitable variant of run() for use inside async endpoints.
+
+        Each prompt is dispatched to the shared I/O pool, with at most
+        max_concurrency prompts in flight, so the event loop never blocks.
+
+        Args:
+            prompts: List of prompt dicts ({title, prompt})
+            handler: Blocking callable that analyzes a single prompt
+            on_result: Optional callback(index, result) invoked on the event loop
+                as soon as each prompt finishes
+
+        Returns:
+            List of result dicts in the same order as prompts
+        """
+        if not prompts:
+            return []
+
+        semaphore = self.semaphore
+        logger.info(f"Running {len(prompts)} prompts with concurrency {min(self.max_concurrency, len(prompts))}")
+
+        async def run_with_limit(index, prompt):
+            async with semaphore:
+                result = await run_blocking_statement(self.run_one, handler, prompt)
+            if on_result is not None:
+                on_result(index, result)
+            return result
+
+        return list(await asyncio.gather(*(run_with_limit(i, prompt) for i, prompt in enumerate(prompts))))
+
+    @staticmethod
+    def run_one(handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                prompt: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run handler for a single prompt, converting unexpected failures into result dicts.
+
+        Blocking; callers outside run()/arun() are responsible for their own concurrency bound.
+        """
+        try:
+            result = handler(prompt)
+        except Exception as e:
+            logger.error(f"Prompt '{prompt.get('title', '')}' failed: {str(e)}")
+            result = {"success": False, "error": str(e), "timing": {}}
+
+        if not isinstance(result, dict):
+            result = {"success": False, "error": f"Unexpected non-dict result: {result}", "timing": {}}
+
+        return result
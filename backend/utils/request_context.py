@@ -0,0 +1,354 @@
+"""
+Request-scoped cancellation of Databricks statements.
+
+ai_query statements keep running on the warehouse (and keep being billed) after
+the client closes the tab or the request gives up. Each analysis request runs
+inside a request_scope(); every statement submitted on its behalf registers
+its ID with the scope, and when the client disconnects, the deadline passes or
+the request fails, the scope cancels the statements still in flight. Prompts
+that have not been submitted yet, and retry waits, stop immediately.
+
+The scope lives in a context variable, so it follows asyncio tasks and
+run_blocking() calls into worker threads. Part of a request (one document's
+analysis) can run in a child context that is cancelled on its own, and with
+its parent. It also carries the request's
+Deadline: stages wrap their work in deadline_stage() and size their timeouts
+with stage_timeout(), so every stage draws on one budget.
+
+    REQUEST_TIMEOUT_SECONDS   deadline budget for synchronous analysis requests, 0 disables (default 300)
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from backend.utils.deadline import Deadline, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST_TIMEOUT = 300.0
+DISCONNECT_POLL_INTERVAL = 0.5
+
+_current: contextvars.ContextVar[Optional["RequestContext"]] = contextvars.ContextVar("request_context", default=None)
+
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'cancelled_requests': 0, 'statements_registered': 0, 'statements_cancelled': 0,
+          'disconnects': 0, 'deadlines': 0, 'errors': 0}
+
+
+def _count(stat: str, amount: int = 1):
+    with _stats_lock:
+        _stats[stat] += amount
+
+
+class RequestCancelled(Exception):
+    """Raised when work is started for a request that has already been cancelled."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+
+
+class RequestContext:
+    """Statements in flight for one request, and whether the request is still wanted."""
+
+    def __init__(self, name: str = "", timeout: Optional[float] = None,
+                 parent: Optional["RequestContext"] = None):
+        """
+        Initialize the context.
+
+        Args:
+            name: Label used in log messages
+            timeout: Deadline budget in seconds; the request is cancelled when it
+                runs out (None for no deadline, or the parent's deadline)
+            parent: Request this context is part of; cancelling the parent cancels it too
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name or self.id
+        self.deadline: Optional[Deadline] = Deadline(timeout) if timeout else (
+            parent.deadline if parent is not None else None)
+        self.reason: Optional[str] = None
+        self.parent = parent
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._statements: Dict[str, Callable[[str], Any]] = {}
+        self._children: List["RequestContext"] = []
+        if parent is not None:
+            parent._add_child(self)
+
+    def _add_child(self, child: "RequestContext"):
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._children.append(child)
+                return
+        child.cancel(self.reason or "cancelled")
+
+    def detach(self):
+        """Stop following the parent's cancellation (once this part of the request is done)."""
+        if self.parent is not None:
+            with self.parent._lock:
+                if self in self.parent._children:
+                    self.parent._children.remove(self)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Raise RequestCancelled if the request has been cancelled."""
+        if self._cancelled.is_set():
+            raise RequestCancelled(self.reason or "cancelled")
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep for up to seconds; returns True as soon as the request is cancelled."""
+        return self._cancelled.wait(max(0.0, seconds))
+
+    def register_statement(self, statement_id: str, cancel: Callable[[str], Any]):
+        """
+        Record a statement running for this request.
+
+        Args:
+            statement_id: Databricks statement ID
+            cancel: Callable that cancels the statement server-side
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._statements[statement_id] = cancel
+                _count('statements_registered')
+                return
+
+        # Submitted after the request was cancelled (the submit call was already in flight)
+        self._cancel_statement(statement_id, cancel)
+
+    def unregister_statement(self, statement_id: str):
+        with self._lock:
+            self._statements.pop(statement_id, None)
+
+    def outstanding(self) -> int:
+        with self._lock:
+            return len(self._statements)
+
+    def _cancel_statement(self, statement_id: str, cancel: Callable[[str], Any]):
+        try:
+            cancel(statement_id)
+            _count('statements_cancelled')
+        except Exception as e:
+            logger.warning(f"Failed to cancel statement {statement_id} for request {self.name}: {str(e)}")
+
+    def cancel(self, reason: str) -> int:
+        """
+        Cancel the request, its child contexts and every statement still running for them.
+
+        Returns:
+            Number of statements a cancel was sent for
+        """
+        with self._lock:
+            first = not self._cancelled.is_set()
+            if first:
+                self.reason = reason
+                self._cancelled.set()
+            statements = list(self._statements.items())
+            self._statements.clear()
+            children = list(self._children)
+            self._children.clear()
+
+        if first:
+            if self.parent is None:
+                _count('cancelled_requests')
+            logger.warning(f"Cancelling request {self.name}: {reason} ({len(statements)} statements in flight)")
+        for statement_id, cancel in statements:
+            self._cancel_statement(statement_id, cancel)
+        return len(statements) + sum(child.cancel(reason) for child in children)
+
+    def release(self) -> int:
+        """Cancel statements nobody is waiting for any more (e.g. after a short-circuit), keeping the request live."""
+        with self._lock:
+            statements = list(self._statements.items())
+            self._statements.clear()
+
+        for statement_id, cancel in statements:
+            self._cancel_statement(statement_id, cancel)
+        return len(statements)
+
+
+def current_request() -> Optional[RequestContext]:
+    """Return the request context of the running task or thread, if any."""
+    return _current.get()
+
+
+@contextmanager
+def use_request(context: RequestContext) -> Iterator[RequestContext]:
+    """
+    Run the block as part of context (usually a child of the current request).
+
+    Statements still registered when the block ends are cancelled, and the
+    context stops following its parent.
+    """
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        context.release()
+        context.detach()
+        _current.reset(token)
+
+
+def check_cancelled():
+    """Raise RequestCancelled if the current request has been cancelled."""
+    context = _current.get()
+    if context is not None:
+        context.check()
+
+
+def wait_or_cancelled(seconds: float, stage: str = "retry_wait") -> bool:
+    """
+    Sleep before another attempt; returns True if the caller should give up instead.
+
+    That is the case when the current request is cancelled during the wait, or
+    when the wait would not leave any of the request's deadline budget.
+    """
+    context = _current.get()
+    if context is None:
+        time.sleep(seconds)
+        return False
+    if context.deadline is not None and seconds >= context.deadline.remaining():
+        context.deadline.skip(stage)
+        return True
+    return context.wait(seconds)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the current request, if it has one."""
+    context = _current.get()
+    return context.deadline if context is not None else None
+
+
+def stage_timeout(stage: str, cap: Optional[float] = None) -> Optional[float]:
+    """
+    Return the timeout for a stage: the remaining deadline budget, capped by cap.
+
+    Without a request deadline this is just cap (None meaning no timeout).
+
+    Raises:
+        DeadlineExceeded: If the budget is already used up
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return cap
+    return deadline.timeout(stage, cap)
+
+
+@contextmanager
+def deadline_stage(stage: str) -> Iterator[None]:
+    """
+    Mark a stage as running for the current request's deadline.
+
+    An error raised inside the block after the budget ran out is re-raised as
+    DeadlineExceeded for this stage, so the response can report where the time went.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        yield
+        return
+
+    deadline.enter(stage)
+    try:
+        yield
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if deadline.expired:
+            raise deadline.exhaust(stage) from e
+        raise
+    finally:
+        deadline.leave(stage)
+
+
+@contextmanager
+def track_statement(statement_id: str, cancel: Callable[[str], Any]) -> Iterator[None]:
+    """Register a statement with the current request for the duration of the block."""
+    context = _current.get()
+    if context is None:
+        yield
+        return
+
+    context.register_statement(statement_id, cancel)
+    try:
+        yield
+    finally:
+        context.unregister_statement(statement_id)
+
+
+def get_request_timeout() -> Optional[float]:
+    """Return the REQUEST_TIMEOUT_SECONDS deadline, or None when disabled."""
+    try:
+        timeout = float(os.getenv('REQUEST_TIMEOUT_SECONDS', DEFAULT_REQUEST_TIMEOUT))
+    except ValueError:
+        logger.warning("Invalid REQUEST_TIMEOUT_SECONDS value, using default")
+        timeout = DEFAULT_REQUEST_TIMEOUT
+    return timeout if timeout > 0 else None
+
+
+async def _watch(context: RequestContext, request: Any):
+    """Cancel the context when the client disconnects or the deadline passes."""
+    deadline = context.deadline
+    while not context.cancelled:
+        if deadline is not None and deadline.expired:
+            _count('deadlines')
+            # Stages that noticed first have already recorded themselves
+            deadline.exhaust(deadline.current_stage or "request")
+            context.cancel(f"deadline of {deadline.budget:g}s exhausted during {deadline.exhausted_stage}")
+            return
+        if request is not None and await request.is_disconnected():
+            _count('disconnects')
+            context.cancel("client disconnected")
+            return
+        interval = DISCONNECT_POLL_INTERVAL
+        if deadline is not None:
+            interval = min(interval, deadline.remaining())
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def request_scope(name: str = "", request: Any = None,
+                        timeout: Optional[float] = None) -> AsyncIterator[RequestContext]:
+    """
+    Run the block as one cancellable request.
+
+    Args:
+        name: Label used in log messages
+        request: Starlette request watched for client disconnects (optional)
+        timeout: Deadline budget in seconds (None for no deadline)
+
+    Yields:
+        The RequestContext, also available through current_request()
+    """
+    context = RequestContext(name, timeout)
+    token = _current.set(context)
+    _count('requests')
+    watcher = asyncio.create_task(_watch(context, request)) if request is not None or timeout else None
+    try:
+        yield context
+    except asyncio.CancelledError:
+        context.cancel("request task cancelled")
+        raise
+    except Exception as e:
+        _count('errors')
+        context.cancel(f"request failed: {str(e)}")
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        # Anything still registered belongs to work that was abandoned
+        context.release()
+        _current.reset(token)
+
+
+def request_context_metrics() -> Dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
@@ -1,174 +1,412 @@
+"""
+Retry policy for AI queries.
+
+Failures are classified into typed errors instead of matching message text:
+TransientError (and its RateLimitedError, WarehouseStartingError,
+StatementTimeoutError and WarehouseUnhealthyError subclasses) may be retried,
+PermanentError (including RequestAbortedError for cancelled requests) may not.
+Producers attach the type to failure dicts with error_fields(), so results
+can be classified after they cross thread and dict boundaries.
+
+RetryPolicy waits with full-jitter exponential backoff, honours Retry-After,
+never waits past the request's deadline, and draws every retry from one
+process-wide RetryBudget so a failing warehouse cannot be hit by a retry
+storm. Outcomes are counted for /api/metrics.
+
+    RETRY_MAX_DELAY               cap on a single backoff wait in seconds (default 30)
+    RETRY_BUDGET_RATIO            retries allowed per first attempt, process-wide (default 0.2)
+    RETRY_BUDGET_MIN_PER_SECOND   retries always allowed per second regardless of traffic (default 1)
+    WAREHOUSE_STARTING_RETRY_AFTER  wait before retrying on a starting warehouse (default 10)
+"""
+import os
 import time
+import random
 import logging
+import threading
 import json
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional
 
-def analyze_with_retries(ai_client, workspace_path: str, question: str,
-                         max_retries: int = 3, base_delay: int = 5) -> Dict[str, Any]:
+import requests
+
+from backend.src.statement_waiter import StatementSubmitError, parse_retry_after
+from backend.src.warehouse_limiter import CircuitOpenError
+from backend.utils.deadline import DeadlineExceeded
+from backend.utils.request_context import RequestCancelled, current_deadline, wait_or_cancelled
+
+try:
+    import httpx
+    _HTTPX_TRANSIENT = (httpx.TimeoutException, httpx.NetworkError)
+except ImportError:
+    _HTTPX_TRANSIENT = ()
+
+# Databricks error codes (REST error_code / statement status.error.error_code)
+RATE_LIMIT_ERROR_CODES = {"RESOURCE_EXHAUSTED", "REQUEST_LIMIT_EXCEEDED", "TOO_MANY_REQUESTS"}
+TRANSIENT_ERROR_CODES = {"TEMPORARILY_UNAVAILABLE", "DEADLINE_EXCEEDED", "ABORTED", "INTERNAL_ERROR",
+                         "UNAVAILABLE", "SERVICE_UNAVAILABLE"}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+WAREHOUSE_STARTING_STATES = ("STARTING", "STOPPED", "STOPPING")
+
+BUDGET_MAX_TOKENS = 20.0
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logging.warning(f"Invalid {name} value, using default {default}")
+        return default
+
+
+class TransientError(Exception):
+    """A failure that may succeed when retried."""
+    kind = "transient"
+    retryable = True
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(TransientError):
+    """HTTP 429 / RESOURCE_EXHAUSTED; retry_after comes from the Retry-After header when present."""
+    kind = "rate_limited"
+
+
+class WarehouseStartingError(TransientError):
+    """The statement could not run because the warehouse is (re)starting."""
+    kind = "warehouse_starting"
+
+
+class StatementTimeoutError(TransientError):
+    """The statement did not finish within its timeout."""
+    kind = "timeout"
+
+
+class WarehouseUnhealthyError(TransientError):
+    """The warehouse's circuit breaker is open."""
+    kind = "circuit_open"
+
+
+class PermanentError(Exception):
+    """A failure that will not go away by retrying (bad SQL, invalid parameters, ...)."""
+    kind = "permanent"
+    retryable = False
+    retry_after = None
+
+
+class RequestAbortedError(PermanentError):
+    """The request was cancelled or ran out of its deadline budget."""
+    kind = "cancelled"
+
+
+ERROR_TYPES = {cls.kind: cls for cls in (TransientError, RateLimitedError, WarehouseStartingError,
+                                         StatementTimeoutError, WarehouseUnhealthyError,
+                                         PermanentError, RequestAbortedError)}
+
+
+def classify_error_code(error_code: Optional[str], status_code: Optional[int] = None,
+                        message: str = "", retry_after: Optional[float] = None) -> Exception:
+    """Map a Databricks error code and/or HTTP status to a typed error."""
+    code = str(getattr(error_code, 'value', error_code) or "").upper()
+    if status_code == 429 or code in RATE_LIMIT_ERROR_CODES:
+        return RateLimitedError(message, retry_after)
+    if code in TRANSIENT_ERROR_CODES or status_code in TRANSIENT_STATUS_CODES:
+        return TransientError(message, retry_after)
+    return PermanentError(message)
+
+
+def classify_error(error: BaseException) -> Exception:
     """
-    Call ai_client.analyze_pdf() with retries on timeouts / transient network errors.
-    Returns the result dict from analyze_pdf on success or the last failure dict/exception info.
+    Return the typed (TransientError / PermanentError) equivalent of an exception.
+
+    Already-typed errors are returned unchanged.
     """
-    last_exception = None
-    timeout_keywords = [
-        "timed out", "timeout", "read timed out", "connection aborted",
-        "connection reset", "failed to establish a new connection",
-        "max retries exceeded", "httpsconnectionpool"
-    ]
+    if isinstance(error, (TransientError, PermanentError)):
+        return error
+    message = str(error)
+    if isinstance(error, (RequestCancelled, DeadlineExceeded)):
+        return RequestAbortedError(message)
+    if isinstance(error, CircuitOpenError):
+        return WarehouseUnhealthyError(message, error.retry_after)
+    if isinstance(error, StatementSubmitError):
+        return classify_error_code(error.error_code, error.status_code, message, error.retry_after)
 
-    for attempt in range(1, max_retries + 1):
-        logging.info(f"[RetryHelper] Starting analyze_pdf attempt {attempt}/{max_retries} for question: {question[:50]}")
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is not None:
+        headers = getattr(response, 'headers', None) or {}
+        return classify_error_code(None, status_code, message, parse_retry_after(headers.get('Retry-After')))
 
-        try:
-            result = ai_client.analyze_pdf(workspace_path, question)
-
-            # If analyze_pdf returns a dict with an error message — check for transient errors
-            if isinstance(result, dict):
-                err = result.get("error")
-                if err:
-                    err_lower = str(err).lower()
-                    if any(k in err_lower for k in timeout_keywords):
-                        if attempt < max_retries:
-                            wait = base_delay * (2 ** (attempt - 1))
-                            logging.warning(
-                                f"analyze_pdf returned timeout-like error "
-                                f"(attempt {attempt}/{max_retries}): {err}. Retrying in {wait}s..."
-                            )
-                            time.sleep(wait)
-                            continue
-                        else:
-                            logging.error(f"analyze_pdf final attempt failed with timeout: {err}")
-                            return result
-
-                    # if not a timeout error, just return
-                    return result
-
-            # No error dict or success response
-            return result
+    # Databricks SDK errors carry the REST error code
+    error_code = getattr(error, 'error_code', None)
+    if error_code:
+        return classify_error_code(error_code, None, message, getattr(error, 'retry_after_secs', None))
 
-        except Exception as e:
-            last_exception = e
-            exc_msg = str(e).lower()
-
-            if any(k in exc_msg for k in timeout_keywords):
-                if attempt < max_retries:
-                    wait = base_delay * (2 ** (attempt - 1))
-                    logging.warning(
-                        f"analyze_pdf exception looks like a timeout "
-                        f"(attempt {attempt}/{max_retries}): {e}. Retrying in {wait}s..."
-                    )
-                    time.sleep(wait)
+    if isinstance(error, (requests.exceptions.Timeout, TimeoutError)) or \
+            (_HTTPX_TRANSIENT and isinstance(error, _HTTPX_TRANSIENT)):
+        return StatementTimeoutError(message)
+    if isinstance(error, (requests.exceptions.ConnectionError, ConnectionError)):
+        return TransientError(message)
+    return PermanentError(message)
+
+
+def classify_statement_result(result: Dict[str, Any], warehouse_state: Optional[str] = None) -> Exception:
+    """
+    Return the typed error for a failed statement result from the statement waiter.
+
+    Args:
+        result: Failure dict with 'state', 'error' and optionally 'error_code'
+        warehouse_state: Last known state of the warehouse the statement ran on
+    """
+    state = result.get("state")
+    message = result.get("error", "Unknown error")
+    deadline = current_deadline()
+    if state == "CANCELED" or (deadline is not None and deadline.expired):
+        return RequestAbortedError(message)
+    if state == "TIMEOUT":
+        if warehouse_state in WAREHOUSE_STARTING_STATES:
+            return WarehouseStartingError(message, _env_float('WAREHOUSE_STARTING_RETRY_AFTER', 10.0))
+        return StatementTimeoutError(message)
+    return classify_error_code(result.get("error_code"), None, message)
+
+
+def classify_result(result: Dict[str, Any]) -> Optional[Exception]:
+    """Return the typed error of a failure dict, or None for a successful result."""
+    if not isinstance(result, dict) or not result.get("error"):
+        return None
+    cls = ERROR_TYPES.get(result.get("error_type"), PermanentError)
+    if cls.retryable:
+        return cls(result["error"], result.get("retry_after"))
+    return cls(result["error"])
+
+
+def error_fields(error: BaseException) -> Dict[str, Any]:
+    """Fields to merge into a failure dict so it can be classified later."""
+    typed = classify_error(error)
+    fields = {"error_type": typed.kind}
+    if typed.retry_after is not None:
+        fields["retry_after"] = round(typed.retry_after, 2)
+    return fields
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {'calls': 0, 'attempts': 0, 'retries': 0, 'succeeded': 0, 'succeeded_after_retry': 0,
+                          'failed_permanent': 0, 'failed_attempts_exhausted': 0, 'budget_denied': 0,
+                          'abandoned': 0, 'errors_by_type': {}}
+
+
+def _count(stat: str, amount: int = 1):
+    with _stats_lock:
+        _stats[stat] += amount
+
+
+def _count_error(kind: str):
+    with _stats_lock:
+        _stats['errors_by_type'][kind] = _stats['errors_by_type'].get(kind, 0) + 1
+
+
+class RetryBudget:
+    """
+    Process-wide token bucket limiting retries to a fraction of first attempts.
+
+    Each call deposits `ratio` tokens and each retry withdraws one, with a
+    floor of `min_per_second` tokens refilled over time, so retries stay
+    bounded while the warehouse is failing everything.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take one retry token; returns False when the budget is spent."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return round(self._tokens, 2)
+
+
+_budget: Optional[RetryBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_retry_budget() -> RetryBudget:
+    """Return the process-wide retry budget."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = RetryBudget(_env_float('RETRY_BUDGET_RATIO', 0.2),
+                                  _env_float('RETRY_BUDGET_MIN_PER_SECOND', 1.0))
+        return _budget
+
+
+class RetryPolicy:
+    """Retries transient failures with full-jitter backoff under the shared retry budget."""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: Optional[float] = None,
+                 budget: Optional[RetryBudget] = None, name: str = "call"):
+        """
+        Initialize the policy.
+
+        Args:
+            max_attempts: Attempts including the first one
+            base_delay: Backoff base in seconds; attempt n waits up to base_delay * 2**(n-1)
+            max_delay: Cap on a single wait (defaults to RETRY_MAX_DELAY)
+            budget: Retry budget (defaults to the process-wide one)
+            name: Label used in log messages
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay if max_delay is not None else _env_float('RETRY_MAX_DELAY', 30.0)
+        self.budget = budget or get_retry_budget()
+        self.name = name
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full jitter: a uniform wait up to the exponential bound, but never less than Retry-After."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Call func until it succeeds, fails permanently or retries are used up.
+
+        func may signal failure by raising or by returning a dict with an 'error'
+        (typed through 'error_type'). The last failure dict is returned, or the
+        last exception re-raised.
+        """
+        _count('calls')
+        self.budget.deposit()
+
+        for attempt in range(1, self.max_attempts + 1):
+            _count('attempts')
+            exception = None
+            try:
+                result = func(*args, **kwargs)
+                error = classify_result(result)
+            except Exception as e:
+                result, exception, error = None, e, classify_error(e)
+
+            if error is None:
+                _count('succeeded')
+                if attempt > 1:
+                    _count('succeeded_after_retry')
+                return result
+
+            _count_error(error.kind)
+            if not error.retryable:
+                _count('failed_permanent')
+            elif attempt == self.max_attempts:
+                _count('failed_attempts_exhausted')
+                logging.error(f"{self.name} failed after {attempt} attempts ({error.kind}): {error}")
+            elif not self.budget.withdraw():
+                _count('budget_denied')
+                logging.warning(f"{self.name} not retried, retry budget exhausted ({error.kind}): {error}")
+            else:
+                wait = self.backoff(attempt, error.retry_after)
+                logging.warning(f"{self.name} attempt {attempt}/{self.max_attempts} failed ({error.kind}): {error}. "
+                                f"Retrying in {wait:.1f}s...")
+                if not wait_or_cancelled(wait):
+                    _count('retries')
                     continue
+                # The request went away or the wait would outlast its deadline
+                _count('abandoned')
 
-            # Non-timeout or no retries left
-            logging.error(f"analyze_pdf failed (attempt {attempt}/{max_retries}): {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "question": question,
-                "pdf_path": workspace_path,
-                "timing": {}
-            }
+            if exception is not None:
+                raise exception
+            return result
 
-    if last_exception:
-        return {"success": False, "error": str(last_exception),
-                "question": question, "pdf_path": workspace_path}
 
-    return {"success": False, "error": "Unknown retry failure",
-            "question": question, "pdf_path": workspace_path}
+def retry_metrics() -> Dict[str, Any]:
+    """Return retry outcome counters and the remaining retry budget."""
+    with _stats_lock:
+        stats = dict(_stats)
+        stats['errors_by_type'] = dict(_stats['errors_by_type'])
+    stats['budget_tokens'] = get_retry_budget().tokens()
+    return stats
+
+
+def analyze_with_retries(ai_client, workspace_path: str, question: str,
+                         max_retries: int = 3, base_delay: int = 5) -> Dict[str, Any]:
+    """
+    Call ai_client.analyze_pdf() with retries on transient failures.
+    Returns the result dict from analyze_pdf on success or the last failure dict/exception info.
+    """
+    logging.info(f"[RetryHelper] Starting analyze_pdf for question: {question[:50]}")
+    policy = RetryPolicy(max_attempts=max_retries, base_delay=base_delay, name="analyze_pdf")
+    try:
+        return policy.call(ai_client.analyze_pdf, workspace_path, question)
+    except Exception as e:
+        logging.error(f"analyze_pdf failed: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            **error_fields(e),
+            "question": question,
+            "pdf_path": workspace_path,
+            "timing": {}
+        }
 
 
 def analyze_with_cached_text_retries(ai_client, extracted_text: str, question: str,
                                    download_time: float, extraction_time: float,
                                    pages_analyzed: int, text_length: int, workspace_path: str,
                                    max_retries: int = 3, base_delay: int = 5) -> Dict[str, Any]:
-    last_exception = None
-    timeout_keywords = [
-        "timed out", "timeout", "read timed out", "connection aborted",
-        "connection reset", "failed to establish a new connection",
-        "max retries exceeded", "httpsconnectionpool"
-    ]
-
-    for attempt in range(1, max_retries + 1):
-        logging.info(f"[RetryHelper] Starting analyze_with_cached_text attempt {attempt}/{max_retries} for question: {question[:50]}")
-
-        try:
-            # Time the entire analyze_with_cached_text call
-            call_start = time.time()
-            result = ai_client.analyze_with_cached_text(
-                extracted_text=extracted_text,
-                question=question,
-                download_time=download_time,
-                extraction_time=extraction_time,
-                pages_analyzed=pages_analyzed,
-                text_length=text_length,
-                workspace_path=workspace_path
-            )
-            call_time = round(time.time() - call_start, 2)
-
-            # If analyze_with_cached_text returns a dict with an error message — check for transient errors
-            if isinstance(result, dict):
-                err = result.get("error")
-                if err:
-                    err_lower = str(err).lower()
-                    if any(k in err_lower for k in timeout_keywords):
-                        if attempt < max_retries:
-                            wait = base_delay * (2 ** (attempt - 1))
-                            logging.warning(
-                                f"analyze_with_cached_text returned timeout-like error "
-                                f"(attempt {attempt}/{max_retries}): {err}. Retrying in {wait}s..."
-                            )
-                            time.sleep(wait)
-                            continue
-                        else:
-                            logging.error(f"analyze_with_cached_text final attempt failed with timeout: {err}")
-                            return result
-
-                    # if not a timeout error, just return
-                    return result
-
-            # Success case - ensure timing is properly set
-            if isinstance(result, dict) and 'timing' in result:
-                # If timing doesn't have ai_query_time, use our measured call_time
-                if result['timing'].get('ai_query_time', 0) == 0:
-                    result['timing']['ai_query_time'] = call_time
-                    result['timing']['total_time'] = round(download_time + extraction_time + call_time, 2)
-
-            return result
+    logging.info(f"[RetryHelper] Starting analyze_with_cached_text for question: {question[:50]}")
+    policy = RetryPolicy(max_attempts=max_retries, base_delay=base_delay, name="analyze_with_cached_text")
 
-        except Exception as e:
-            last_exception = e
-            exc_msg = str(e).lower()
-
-            if any(k in exc_msg for k in timeout_keywords):
-                if attempt < max_retries:
-                    wait = base_delay * (2 ** (attempt - 1))
-                    logging.warning(
-                        f"analyze_with_cached_text exception looks like a timeout "
-                        f"(attempt {attempt}/{max_retries}): {e}. Retrying in {wait}s..."
-                    )
-                    time.sleep(wait)
-                    continue
+    def attempt():
+        # Time the entire analyze_with_cached_text call
+        call_start = time.time()
+        result = ai_client.analyze_with_cached_text(
+            extracted_text=extracted_text,
+            question=question,
+            download_time=download_time,
+            extraction_time=extraction_time,
+            pages_analyzed=pages_analyzed,
+            text_length=text_length,
+            workspace_path=workspace_path
+        )
+        call_time = round(time.time() - call_start, 2)
 
-            # Non-timeout or no retries left
-            logging.error(f"analyze_with_cached_text failed (attempt {attempt}/{max_retries}): {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "question": question,
-                "pdf_path": workspace_path,
-                "timing": {
-                    'download_time': download_time,
-                    'extraction_time': extraction_time,
-                    'ai_query_time': 0.0,
-                    'total_time': download_time + extraction_time
-                }
-            }
+        # Success case - ensure timing is properly set
+        if isinstance(result, dict) and not result.get("error") and 'timing' in result:
+            # If timing doesn't have ai_query_time, use our measured call_time
+            if result['timing'].get('ai_query_time', 0) == 0:
+                result['timing']['ai_query_time'] = call_time
+                result['timing']['total_time'] = round(download_time + extraction_time + call_time, 2)
+        return result
 
-    if last_exception:
+    try:
+        return policy.call(attempt)
+    except Exception as e:
+        logging.error(f"analyze_with_cached_text failed: {e}")
         return {
             "success": False,
-            "error": str(last_exception),
+            "error": str(e),
+            **error_fields(e),
             "question": question,
             "pdf_path": workspace_path,
             "timing": {
@@ -179,19 +417,6 @@ def analyze_with_cached_text_retries(ai_client, extracted_text: str, question: s
             }
         }
 
-    return {
-        "success": False,
-        "error": "Unknown retry failure",
-        "question": question,
-        "pdf_path": workspace_path,
-        "timing": {
-            'download_time': download_time,
-            'extraction_time': extraction_time,
-            'ai_query_time': 0.0,
-            'total_time': download_time + extraction_time
-        }
-    }
-
 
 def normalize_answer(answer):
     if answer is None:
@@ -0,0 +1,190 @@
+"""
+Persistent, content-addressed cache of extracted PDF text.
+
+Entries are keyed by the SHA-256 of the PDF bytes plus the extractor version
+and stored in a sqlite file as zlib-compressed JSON pages, so identical
+documents skip extraction across processes and restarts. The file is bounded
+in size and evicts least-recently-used entries.
+
+    TEXT_CACHE_ENABLED   turn the cache on/off (default true)
+    TEXT_CACHE_PATH      sqlite file location (default backend/.cache/extracted_text.sqlite)
+    TEXT_CACHE_MAX_MB    size bound before LRU eviction (default 512)
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'extracted_text.sqlite'
+)
+
+
+class ExtractedTextCache:
+    """sqlite-backed store of per-page text keyed by (content hash, extractor version)."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Initialize the cache, creating the sqlite file if needed.
+
+        Args:
+            path: sqlite file location
+            max_bytes: Total compressed payload size before LRU eviction
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS extracted_text (
+                    content_hash TEXT NOT NULL,
+                    extractor_version TEXT NOT NULL,
+                    total_pages INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (content_hash, extractor_version)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extracted_text_access ON extracted_text (last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per operation keeps the cache safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get(self, content_hash: str, extractor_version: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up extracted pages for a document.
+
+        Returns:
+            Dict with 'total_pages' and 'pages', or None on a miss
+        """
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT total_pages, payload FROM extracted_text WHERE content_hash = ? AND extractor_version = ?",
+                    (content_hash, extractor_version)
+                ).fetchone()
+                if row is None:
+                    self._count('misses')
+                    return None
+
+                conn.execute(
+                    "UPDATE extracted_text SET last_access = ? WHERE content_hash = ? AND extractor_version = ?",
+                    (time.time(), content_hash, extractor_version)
+                )
+
+            self._count('hits')
+            return {'total_pages': row[0], 'pages': json.loads(zlib.decompress(row[1]))}
+
+        except Exception as e:
+            self._count('errors')
+            logger.warning(f"Extracted text cache read failed: {e}")
+            return None
+
+    def put(self, content_hash: str, extractor_version: str, total_pages: int, pages: list):
+        """Store extracted pages for a document and evict old entries if over budget."""
+        try:
+            payload = zlib.compress(json.dumps(pages, ensure_ascii=False).encode('utf-8'))
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO extracted_text VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (content_hash, extractor_version, total_pages, payload, len(payload), now, now)
+                )
+                self._evict(conn)
+            self._count('writes')
+
+        except Exception as e:
+            self._count('errors')
+            logger.warning(f"Extracted text cache write failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extracted_text").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT content_hash, extractor_version, size FROM extracted_text ORDER BY last_access ASC"
+        ).fetchall()
+        for content_hash, extractor_version, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute(
+                "DELETE FROM extracted_text WHERE content_hash = ? AND extractor_version = ?",
+                (content_hash, extractor_version)
+            )
+            total -= size
+            self._count('evictions')
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and on-disk usage."""
+        with self._lock:
+            stats = dict(self._stats)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['path'] = self.path
+        stats['max_bytes'] = self.max_bytes
+
+        try:
+            with self._connect() as conn:
+                entries, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extracted_text"
+                ).fetchone()
+            stats['entries'] = entries
+            stats['bytes'] = size
+        except Exception as e:
+            logger.debug(f"Could not read cache usage: {e}")
+
+        return stats
+
+
+_cache: Optional[ExtractedTextCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_text_cache() -> Optional[ExtractedTextCache]:
+    """Return the process-wide text cache, or None if disabled or unavailable."""
+    global _cache
+    if os.getenv('TEXT_CACHE_ENABLED', 'true').strip().lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    max_mb = int(os.getenv('TEXT_CACHE_MAX_MB', 512))
+                    _cache = ExtractedTextCache(
+                        path=os.getenv('TEXT_CACHE_PATH', DEFAULT_CACHE_PATH),
+                        max_bytes=max_mb * 1024 * 1024
+                    )
+                except Exception as e:
+                    logger.warning(f"Extracted text cache unavailable: {e}")
+                    return None
+    return _cache
@@ -0,0 +1,354 @@
+"""
+Token-budget-aware prompt assembly.
+
+Document context used to be capped at 15,000 characters whatever the model,
+which overflows nothing on large-context models but wastes most of their
+window, while giving no real guarantee on small ones. The assembler counts
+tokens with tiktoken for the configured model and packs document context into
+what is left of the model's context window after the prompt framing, the
+question and the reserved output tokens, up to a per-prompt document cap.
+Documents over the cap get their most relevant pages instead of the full text.
+
+    AI_CONTEXT_TOKENS       override the model's context window
+    AI_OUTPUT_TOKENS        tokens reserved for the answer (default: max_tokens or 1024)
+    AI_MAX_CONTEXT_TOKENS   cap on document tokens per prompt (default 12000, 0 for the full window)
+
+When the tiktoken encoding files cannot be loaded (offline hosts), counts fall
+back to a conservative characters-per-token estimate.
+"""
+import os
+import math
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.utils.answer_cache import normalize_prompt
+from backend.utils.pdf_text_extractor import format_pages
+
+logger = logging.getLogger(__name__)
+
+# Context windows (tokens) of the serving endpoints we query through ai_query
+MODEL_CONTEXT_TOKENS = {
+    "databricks-gpt-oss-120b": 131072,
+    "databricks-gpt-oss-20b": 131072,
+    "databricks-meta-llama-3-3-70b-instruct": 128000,
+    "databricks-meta-llama-3-1-8b-instruct": 128000,
+    "databricks-meta-llama-3-1-405b-instruct": 128000,
+    "databricks-llama-4-maverick": 128000,
+    "databricks-claude-3-7-sonnet": 200000,
+    "databricks-claude-sonnet-4": 200000,
+    "databricks-gemma-3-12b": 128000,
+    "databricks-mixtral-8x7b-instruct": 32768,
+}
+DEFAULT_CONTEXT_TOKENS = 32768
+DEFAULT_OUTPUT_TOKENS = 1024
+# Keeps cost and latency per prompt near the old 15,000-character cap's order of
+# magnitude; a full 128k window on every prompt costs ~30x more
+DEFAULT_MAX_DOCUMENT_TOKENS = 12000
+
+# Model name prefix -> tiktoken encoding; anything else uses cl100k_base
+MODEL_ENCODINGS = {
+    "databricks-gpt-oss": "o200k_base",
+}
+DEFAULT_ENCODING = "cl100k_base"
+
+# Fallback estimate when no encoding is available; deliberately pessimistic
+FALLBACK_CHARS_PER_TOKEN = 3.0
+
+# Headroom for tokenizer differences between tiktoken and the serving endpoint
+SAFETY_MARGIN = 0.03
+
+TRUNCATION_MARKER = "\n\n[Text truncated due to length...]"
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Invalid {name} value '{value}', ignoring")
+        return None
+
+
+class TokenCounter:
+    """Counts and truncates text in tokens for one encoding."""
+
+    def __init__(self, encoding_name: str):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(f"tiktoken encoding '{encoding_name}' unavailable, estimating tokens from length: {str(e)}")
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Return the longest prefix of text that fits in max_tokens."""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens])
+        return text[:int(max_tokens * FALLBACK_CHARS_PER_TOKEN)]
+
+
+def chunk_text(text: str, max_chunk_size: int, size: Callable[[str], int] = len) -> List[str]:
+    """
+    Split text on word boundaries into chunks of at most max_chunk_size.
+
+    Args:
+        text: Text to chunk
+        max_chunk_size: Maximum size per chunk, in the units of size
+        size: Size of a piece of text (characters by default, or a token counter)
+
+    Returns:
+        List of text chunks
+    """
+    if size(text) <= max_chunk_size:
+        return [text]
+
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    for word in text.split():
+        word_length = size(word) + 1  # +1 for space
+
+        if current_length + word_length > max_chunk_size and current_chunk:
+            chunks.append(' '.join(current_chunk))
+            current_chunk = [word]
+            current_length = word_length
+        else:
+            current_chunk.append(word)
+            current_length += word_length
+
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+
+    return chunks
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Return the shared token counter for a model's encoding."""
+    encoding_name = next(
+        (name for prefix, name in MODEL_ENCODINGS.items() if model.startswith(prefix)),
+        DEFAULT_ENCODING
+    )
+    with _counters_lock:
+        counter = _counters.get(encoding_name)
+        if counter is None:
+            counter = _counters[encoding_name] = TokenCounter(encoding_name)
+        return counter
+
+
+class PromptAssembler:
+    """Packs document context into a model's remaining context window."""
+
+    MAX_CACHED_PACKS = 256
+
+    def __init__(self, model: str, template_text: str = "", max_output_tokens: Optional[int] = None):
+        """
+        Initialize the assembler.
+
+        Args:
+            model: Serving endpoint name, used for the context window and encoding
+            template_text: Fixed prompt framing sent around the document and question
+            max_output_tokens: Tokens reserved for the answer (defaults to AI_OUTPUT_TOKENS)
+        """
+        self.model = model
+        self.counter = get_token_counter(model)
+        self.context_tokens = _env_int('AI_CONTEXT_TOKENS') or MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+        self.output_tokens = max_output_tokens or _env_int('AI_OUTPUT_TOKENS') or DEFAULT_OUTPUT_TOKENS
+        max_document_tokens = _env_int('AI_MAX_CONTEXT_TOKENS')
+        # 0 lifts the cap, so documents may fill the model's whole window
+        self.max_document_tokens = (DEFAULT_MAX_DOCUMENT_TOKENS if max_document_tokens is None
+                                    else max_document_tokens)
+        self.template_tokens = self.counter.count(template_text)
+
+        self._packs: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._page_tokens: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def document_budget(self, question: str = "") -> int:
+        """Return how many document tokens fit alongside the framing, question and answer."""
+        available = self.context_tokens - self.output_tokens - self.template_tokens - self.counter.count(question)
+        budget = int(available * (1 - SAFETY_MARGIN))
+        if self.max_document_tokens:
+            budget = min(budget, self.max_document_tokens)
+        return max(0, budget)
+
+    def fit_text(self, text: str, question: str = "") -> str:
+        """Truncate text to the document budget (safety net for unpacked callers)."""
+        budget = self.document_budget(question)
+        if self.counter.count(text) <= budget:
+            return text
+        marker_tokens = self.counter.count(TRUNCATION_MARKER)
+        return self.counter.truncate(text, budget - marker_tokens) + TRUNCATION_MARKER
+
+    def _get_page_tokens(self, content_hash: str, pages: List[Dict[str, Any]]) -> List[int]:
+        with self._lock:
+            counts = self._page_tokens.get(content_hash)
+            if counts is not None:
+                self._page_tokens.move_to_end(content_hash)
+                return counts
+
+        # Each page is sent with its '--- Page N ---' marker
+        counts = [self.counter.count(format_pages([page])) for page in pages]
+        with self._lock:
+            self._page_tokens[content_hash] = counts
+            while len(self._page_tokens) > self.MAX_CACHED_PACKS:
+                self._page_tokens.popitem(last=False)
+        return counts
+
+    def pack(self, content_hash: str, pages: List[Dict[str, Any]], question: str = "",
+             select_pages: Optional[Callable[[str, int, Callable[[Dict[str, Any]], int]], List[Dict[str, Any]]]] = None
+             ) -> Dict[str, Any]:
+        """
+        Build the document context for one question, cached per document.
+
+        Args:
+            content_hash: SHA-256 of the document, used as the cache key
+            pages: Extracted page dicts ({page_number, text}) in page order
+            question: The question the context is for
+            select_pages: Optional relevance selector (query, budget, cost) -> pages,
+                used when the whole document does not fit
+
+        Returns:
+            Dict with 'text', 'pages' (page numbers sent, None when the whole
+            document fits), 'tokens', 'budget' and 'strategy'
+            ('full_text', 'retrieval' or 'truncate')
+        """
+        budget = self.document_budget(question)
+        page_tokens = self._get_page_tokens(content_hash, pages)
+        total_tokens = sum(page_tokens)
+
+        if total_tokens <= budget:
+            # The whole document fits, whatever the question
+            key = (content_hash, None, budget)
+        else:
+            key = (content_hash, normalize_prompt(question) if select_pages else None, budget)
+
+        with self._lock:
+            packed = self._packs.get(key)
+            if packed is not None:
+                self._packs.move_to_end(key)
+                return packed
+
+        if total_tokens <= budget:
+            packed = {'text': format_pages(pages), 'pages': None, 'tokens': total_tokens, 'strategy': 'full_text'}
+        elif select_pages is not None:
+            costs = {page['page_number']: tokens for page, tokens in zip(pages, page_tokens)}
+            selected = select_pages(question, budget, lambda page: costs.get(page['page_number'], 0))
+            text = format_pages(selected)
+            packed = {'text': text, 'pages': [p['page_number'] for p in selected],
+                      'tokens': sum(costs.get(p['page_number'], 0) for p in selected), 'strategy': 'retrieval'}
+            if packed['tokens'] > budget:
+                # A single oversized page was selected; cut it to the budget
+                packed['text'] = self.fit_text(text, question)
+                packed['tokens'] = budget
+        else:
+            text = self.fit_text(format_pages(pages), question)
+            packed = {'text': text, 'pages': None, 'tokens': min(total_tokens, budget), 'strategy': 'truncate'}
+
+        packed['budget'] = budget
+        with self._lock:
+            self._packs[key] = packed
+            while len(self._packs) > self.MAX_CACHED_PACKS:
+                self._packs.popitem(last=False)
+        return packed
+
+    def chunk_pages(self, content_hash: str, pages: List[Dict[str, Any]], question: str = "",
+                    max_chunk_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Split a document into page-aligned chunks that each fit the budget.
+
+        Consecutive pages are grouped until the next page would overflow; a single
+        page larger than the budget is split on word boundaries.
+
+        Args:
+            content_hash: SHA-256 of the document (reuses cached page token counts)
+            pages: Extracted page dicts in page order
+            question: The question sent with every chunk
+            max_chunk_tokens: Optional smaller chunk size, for more parallelism
+
+        Returns:
+            List of {'text', 'pages', 'tokens'} dicts in document order
+        """
+        budget = self.document_budget(question)
+        if max_chunk_tokens:
+            budget = min(budget, max_chunk_tokens)
+        page_tokens = self._get_page_tokens(content_hash, pages)
+
+        chunks = []
+        current, current_tokens = [], 0
+
+        def flush():
+            if current:
+                chunks.append({'text': format_pages(current), 'pages': [p['page_number'] for p in current],
+                               'tokens': current_tokens})
+
+        for page, tokens in zip(pages, page_tokens):
+            if tokens > budget:
+                flush()
+                current, current_tokens = [], 0
+                for part in chunk_text(page['text'], budget, size=self.counter.count):
+                    part_page = {**page, 'text': part}
+                    chunks.append({'text': format_pages([part_page]), 'pages': [page['page_number']],
+                                   'tokens': self.counter.count(part)})
+                continue
+
+            if current and current_tokens + tokens > budget:
+                flush()
+                current, current_tokens = [], 0
+            current.append(page)
+            current_tokens += tokens
+
+        flush()
+        return chunks
+
+    def describe(self) -> Dict[str, Any]:
+        """Return the budget configuration (for logs and metrics)."""
+        return {
+            'model': self.model,
+            'encoding': self.counter.encoding_name,
+            'exact_counts': self.counter.exact,
+            'context_tokens': self.context_tokens,
+            'output_tokens': self.output_tokens,
+            'template_tokens': self.template_tokens,
+            'max_document_tokens': self.max_document_tokens,
+        }
+
+
+_assemblers: Dict[tuple, PromptAssembler] = {}
+_assemblers_lock = threading.Lock()
+
+
+def get_prompt_assembler(model: str, template_text: str = "",
+                         max_output_tokens: Optional[int] = None) -> PromptAssembler:
+    """Return the shared assembler for a model, framing and output reservation."""
+    key = (model, template_text, max_output_tokens)
+    with _assemblers_lock:
+        assembler = _assemblers.get(key)
+        if assembler is None:
+            assembler = _assemblers[key] = PromptAssembler(model, template_text, max_output_tokens)
+        return assembler
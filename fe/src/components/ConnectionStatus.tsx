@@ -5,7 +5,10 @@ import {
   Typography,
   useTheme,
 } from "@mui/material";
-import React from "react";
+import React, { useEffect, useState } from "react";
+import { getWarehouseStatus } from "../services/databricksService";
+
+const WAREHOUSE_POLL_MS = 15000;
 
 interface ConnectionStatusProps {
   loading: boolean;
@@ -19,6 +22,26 @@ const ConnectionStatus: React.FC<ConnectionStatusProps> = ({
   initializeApp,
 }) => {
   const theme = useTheme();
+  const [warehouseStatus, setWarehouseStatus] = useState<string | null>(null);
+
+  useEffect(() => {
+    if (!databricksConnected) return;
+    let active = true;
+    const poll = async () => {
+      try {
+        const result = await getWarehouseStatus();
+        if (active) setWarehouseStatus(result?.warehouse?.status ?? null);
+      } catch (error) {
+        console.error("Failed to fetch warehouse status:", error);
+      }
+    };
+    poll();
+    const timer = setInterval(poll, WAREHOUSE_POLL_MS);
+    return () => {
+      active = false;
+      clearInterval(timer);
+    };
+  }, [databricksConnected]);
 
   if (loading) {
     return (
@@ -81,6 +104,18 @@ const ConnectionStatus: React.FC<ConnectionStatusProps> = ({
         {databricksConnected ? "Connected to Databricks" : "Disconnected"}
       </Typography>
 
+      {databricksConnected &&
+        (warehouseStatus === "warming" || warehouseStatus === "cold") && (
+          <Typography
+            variant="body2"
+            sx={{ color: theme.palette.warning.main }}
+          >
+            {warehouseStatus === "warming"
+              ? "SQL warehouse is starting, the first analysis may take 1-2 minutes longer"
+              : "SQL warehouse is stopped, it will start with the next analysis"}
+          </Typography>
+        )}
+
       {!databricksConnected && (
         <Button
           variant="outlined"
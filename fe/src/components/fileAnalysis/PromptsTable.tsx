@@ -129,7 +129,7 @@ const PromptsTable: React.FC<PromptsTableProps> = ({
               color: colors.textSecondary,
             }}
           >
-            {r?.timing?.total_time}s
+            {r?.timing?.total_time}s{r?.timing?.cached ? " (cached)" : ""}
           </Typography>
         </Box>
       ))}
@@ -1,6 +1,6 @@
 import { useState } from "react";
 import "../App.css";
-import { uploadAndAnalyzePdf } from "../services/databricksService";
+import { analyzePdfAsJob } from "../services/databricksService";
 import { Alert, Box, Snackbar, Stack } from "@mui/material";
 import Grid from "@mui/material/Grid";
 import FileUploadBox from "../components/FileUploadBox";
@@ -57,7 +57,7 @@ const Home: React.FC<HomeProps> = () => {
           setToastOpen(true);
         }
 
-        const result = await uploadAndAnalyzePdf(queue[i].file, usedPrompts);
+        const result = await analyzePdfAsJob(queue[i].file, usedPrompts);
         console.log({ result });
 
         if (result?.success) {
@@ -6,6 +6,8 @@ export interface iPromptResponseTiming {
   download_time?: number;
   extraction_time?: number;
   total_time?: number;
+  cached?: boolean;
+  cache_age?: number;
 }
 export interface AiAnalysisResponse {
   responses: {
@@ -16,6 +18,7 @@ export interface AiAnalysisResponse {
     explanation?: string;
     title: string;
     timing?: iPromptResponseTiming;
+    context_pages?: number[] | null;
   }[];
   merged_summary: string;
   total_processing_time: number;
@@ -45,3 +45,128 @@ export const uploadAndAnalyzePdf = async (
       throw new Error(`PDF upload failed: ${error.message}`);
   }
 };
+
+export const startAnalysisJob = async (
+  file: any,
+  prompts: { title: string; prompt: string }[]
+) => {
+  try {
+    const formData = new FormData();
+    formData.append("file", file);
+    formData.append("prompts_json", JSON.stringify(prompts));
+    const response = await api.post("/api/jobs/upload-and-analyze", formData, {
+      headers: {
+        "Content-Type": "multipart/form-data",
+      },
+    });
+
+    return response.data;
+  } catch (error: unknown) {
+    if (error instanceof Error)
+      throw new Error(`Starting analysis failed: ${error.message}`);
+  }
+};
+
+export const getAnalysisJob = async (jobId: string) => {
+  try {
+    const response = await api.get(`/api/jobs/${jobId}`);
+    return response.data;
+  } catch (error: unknown) {
+    if (error instanceof Error)
+      throw new Error(`Fetching analysis job failed: ${error.message}`);
+  }
+};
+
+// Warm/cold state of the SQL warehouse: status is "warm", "warming", "cold"
+// or "unknown". A cold warehouse adds a 1-2 minute start to the next analysis.
+export const getWarehouseStatus = async () => {
+  try {
+    const response = await api.get("/api/databricks/warehouse/status");
+    return response.data;
+  } catch (error: unknown) {
+    if (error instanceof Error)
+      throw new Error(`Fetching warehouse status failed: ${error.message}`);
+  }
+};
+
+// Starts the warehouse in the background, e.g. when the user picks a file.
+export const warmWarehouse = async () => {
+  try {
+    const response = await api.post("/api/databricks/warehouse/warm");
+    return response.data;
+  } catch (error: unknown) {
+    if (error instanceof Error)
+      throw new Error(`Warming warehouse failed: ${error.message}`);
+  }
+};
+
+// Reads the NDJSON event stream of a job, calling onEvent for every line
+// (status changes, one prompt_result per finished prompt, then the result).
+export const streamAnalysisJob = async (
+  jobId: string,
+  onEvent: (event: any) => void
+) => {
+  const response = await fetch(`${API_BASE_URL}/api/jobs/${jobId}/stream`);
+  if (!response.ok || !response.body) {
+    throw new Error(`Streaming analysis job failed: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    const lines = buffer.split("\n");
+    buffer = lines.pop() ?? "";
+    for (const line of lines) {
+      if (line.trim()) onEvent(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) onEvent(JSON.parse(buffer));
+};
+
+const JOB_POLL_INTERVAL_MS = 2000;
+
+// Analyzes a PDF as a background job instead of one long request, so no
+// HTTP timeout applies to the analysis itself. onPromptResult is called as
+// each prompt finishes; resolves with the same body as uploadAndAnalyzePdf.
+export const analyzePdfAsJob = async (
+  file: any,
+  prompts: { title: string; prompt: string }[],
+  onPromptResult?: (index: number, response: any) => void
+) => {
+  const job = await startAnalysisJob(file, prompts);
+  if (!job?.success) throw new Error("Starting analysis failed");
+
+  let result: any = null;
+  let failure: string | null = null;
+  try {
+    await streamAnalysisJob(job.job_id, (event) => {
+      if (event.type === "prompt_result") {
+        onPromptResult?.(event.index, event.response);
+      } else if (event.type === "result") {
+        result = event.result;
+      } else if (event.type === "status" && event.error) {
+        failure = event.error;
+      }
+    });
+  } catch (error: unknown) {
+    console.log({ error });
+  }
+
+  // The stream can be cut by a proxy; the job keeps running, so poll it instead
+  while (!result && !failure) {
+    const status = await getAnalysisJob(job.job_id);
+    if (status?.result) result = status.result;
+    else if (["failed", "cancelled"].includes(status?.status))
+      failure = status.error || `Analysis ${status.status}`;
+    else await new Promise((r) => setTimeout(r, JOB_POLL_INTERVAL_MS));
+  }
+
+  if (failure) throw new Error(`PDF analysis failed: ${failure}`);
+  return result;
+};